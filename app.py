@@ -1,15 +1,28 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, ValidationError
-from gen import generate_question, add_question, load_prompts, load_questions_from_firebase, get_human_feedback, save_human_feedback, load_feedback_log
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from gen import QUESTION_STAGES, PIPELINE_MODES, DEFAULT_PIPELINE_MODE, resilient_caller, llm_cache, context_caches, prompt_contexts, stage_metrics, model_router, seeded_random, question_writes, human_feedback_writes, load_prompts, question_store, question_sync, get_human_feedback, load_feedback_log
+from models import QuestionRequest, Question, FeedbackRequest
+from jobs import JobManager, summarize
+from pipeline import StagePipeline
+from scheduler import WorkScheduler, expand_work_items
+from metrics import render_gauge
+from model_routing import ROUTING_PROFILES
+from review_stats import ACCEPTED, GROUPS, REMOVED, ReviewStats
+from singleflight import SingleFlight, all_settled
+from question_query import InvalidQuery, QuestionQuery
+from write_outbox import WriteOutbox
+from firestore_store import commit_writes, firestore_delete, firestore_write
 from typing import List, Dict, Optional
+import collections
 import os
 import json
-import random
+import asyncio
 import threading
-import queue
+from concurrent.futures import Future
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials
 
 
 app = FastAPI()
@@ -30,32 +43,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-class QuestionRequest(BaseModel):
-    section: str
-    domains: List[str]
-    skill_categories: List[str]
-    difficulties: List[str]
-    num_questions: int
-
-    
-
-class Question(BaseModel):
-    question: str
-    section: str
-    domain: str
-    skill_category: str
-    choices: List[str]
-    correct_answer: str
-    difficulty: str
-    difficulty_ranking: str
-    explanations: Dict[str, str]
-    graphic_url: Optional[str] = None
-
-
-class FeedbackRequest(BaseModel):
-    index: int
-    content: str
-
 prompts = load_prompts()
 main_prompt = prompts["main_prompt"]
 
@@ -108,7 +95,13 @@ if not firebase_admin._apps:
         "storageBucket": "rocketprepai.firebasestorage.app"
     })
 
-db = firestore.client()
+# Question submissions are queued locally before they are written; retry anything a previous run left behind
+send_outbox = WriteOutbox(question_store)
+if send_outbox.pending():
+    try:
+        print(f"Retrying {send_outbox.flush()} queued Firestore write(s)")
+    except Exception as e:
+        print(f"Queued Firestore writes are still failing, will retry on the next submission: {e}")
 
 @app.middleware("http")
 async def log_request_body(request: Request, call_next):
@@ -118,43 +111,90 @@ async def log_request_body(request: Request, call_next):
     response = await call_next(request)
     return response
 
-def generate_questions_for_skill_category(section: str, skill_category: str, difficulties: List[str], num_questions: int, generated_questions: List[Dict], question_queue: queue.Queue):
+def validate_skill_categories(skill_categories: List[str]):
+    for skill_category in skill_categories:
+        if skill_category not in skill_category_to_domain:
+            raise HTTPException(status_code=400, detail=f"Invalid skill category: {skill_category}")
+
+def validate_question_request(request: QuestionRequest):
+    validate_skill_categories(request.skill_categories)
+    if request.pipeline_mode is not None and request.pipeline_mode not in PIPELINE_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid pipeline mode: {request.pipeline_mode}. Must be one of {', '.join(PIPELINE_MODES)}.")
+    if request.routing_profile is not None and request.routing_profile not in ROUTING_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Invalid routing profile: {request.routing_profile}. Must be one of {', '.join(ROUTING_PROFILES)}.")
+    try:
+        # Checked against the models the routes resolve to, since e.g. Pro rejects thinking_budget 0
+        model_router.check(request.routing_profile, request.routes)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def request_work_items(request: QuestionRequest) -> List[Dict]:
+    items = expand_work_items(request.section, request.skill_categories, request.difficulties, request.num_questions)
+    for item in items:
+        item["pipeline_mode"] = request.pipeline_mode
+        item["routing_profile"] = request.routing_profile
+        item["routes"] = request.routes
+        item["early_exit"] = request.early_exit
+    return items
+
+def submit_question(section: str, skill_category: str, difficulty: str, generated_questions: List[Dict], on_stage=None, index: int = 0, pipeline_mode: Optional[str] = None, routing_profile: Optional[str] = None, routes: Optional[Dict] = None, early_exit: Optional[bool] = None) -> Future:
+    """
+    Builds the prompts for one question and queues it on the stage pipeline.
+    The returned Future resolves to the pipeline state; the question is under "question".
+    """
     domain = skill_category_to_domain.get(skill_category)
     if not domain:
         raise HTTPException(status_code=400, detail=f"Invalid skill category: {skill_category}")
-    for difficulty in difficulties:
-                for _ in range(num_questions):
-                    random_choice = random.choice(["A", "B", "C", "D"])
-                    if difficulty == "easy":
-                        target_difficulty_ranking = random.uniform(0, 0.33)
-                    elif difficulty == "medium":
-                        target_difficulty_ranking = random.uniform(0.33, 0.67)
-                    elif difficulty == "hard":
-                        target_difficulty_ranking = random.uniform(0.67, 1.0)
-                    else:
-                        raise ValueError("Invalid difficulty level. Must be 'easy', 'medium', or 'hard'.")
-                    
-
-                    user_prompt = base_user_prompt.format(difficulty=difficulty, random_choice=random_choice)
-                    print(f"domain: {domain}, section: {section}")
-                    system_prompt = f"Using the sources as a guide, generate an authentic and unique question of the given difficulty level.\
-                    # For RW Questions \
-                    Make questions harder than you think they should be always, \
-                    and ensure that the tone and style does not differ drastically from those of the examples. The only way in which your question should differ \
-                    is that it is allowed to be harder than the others. Realistically, your easiest questions for each difficulty should be as hard as the harder ones in the provided sources. (the files). To ensure question diversity, use the sources as reference to decide when you need to switch gears and  \
-                    generate questions of a different style, for example expository vs fictional (for reading and writing questions), based off of how many questions of different styles there are. For now, any math questions should be multiple choice and that are numerical or use a clearly formatted table. For the reading and writing questions, unlike the math do NOT make each question an image of one of the source questions. Your reading and writing questions should be original and they should not be copies, but should take inspiration. Ensure to make your distractors harder too for reading and writing questions. (if its a math question, obviously, otherwise ignore this). Make them HARDER! \
-                    However, to make questions harder, you should not just make questions wordier- they should be concise actually. They should be difficult because they mirror the logical thinkng that is required on the SAT.\
-                    # For math questions\
-                    please use the relevant sources as inspiration when generating your question, only testing topics that are covered in those questions. DO NOT USE ANY CONCEPTS/STRATEGIES THAT DO NOT APPEAR IN THE SOURCE QUESTIONS. The questions should only contain mathematical concepts that you can find in the source questions (CollegeBoard questions), and should be indestinguishable from real SAT math question, besides the fact they should be a litte bit harder. Harder does not mean using concepts that are not covered in the source questions, however. You should basically be taking the provided source questions and making a replica of them for the math questions (but not for RW) to avoid creating questions that don't look exactly like SAT questions, because these math questions need to be of the *exact same format and style*  as the example ones. You are given less creative leeway with the math questions, as they should be made in the image of one of the source questions. NOTHING SUPER CREATIVE OR OFF TOPIC OR NOT IN THE EXACT FORMAT OF ONE OF THE EXAMPLES! THIS MEANS YOUR QUESTIONS SHOULD BE SOLVABLE ALMOST EXACTLY LIKE ONE OF THE SOURCE QUESTIONS. You should really take one of the source questions and just modify it to have different equations/whatever instead of just writing the question from scratch. Don't try to combine a bunch of things, just focus on testing one thing at a time- only the hardest questions should have multiple steps\
-                    If you need to create a graphic for your math problem (not all problems need one), please generate latex code for the graph or diagram that you need generated. This latex should use pgfplots for graphs and tikz for shapes. ONLY USE LATEX FOR THE GRAPHS/DIAGRAMS/TABLES, and ONLY IN THE MATH SECTION!!! Not for anything else! THE LATEX IS ONLY TO GENERATE IMAGES, YOU SHOULD TREAT EQUATIONS AND EVERYTHING ELSE LIKE NORMAL TEXT, WE WILL FORMAT EQUATIONS AS VALID LATEX IN REACT, BUT WE WANT IMAGES FOR SHAPES AND STUFF. LIKE IF YOU DECIDE TO DO A GRAPH QUESTION OR A SHAPE QUESTION, THEN DO DO THE LATEX GENERATION THING, OTHERWISE DONT.\
-                    If you do generate a math graphic, IT NEEDS TO BE OF THE EXACT SAME FORMAT AS ONE OF THE SOURCE QUESTION GRAPHICS. NO FANCY SHIT THAT DOESN'T ACTUALLY APPEAR ON THE SAT!!! Ensure i can pass your output directly to a latex generator! Don't just pass newline caracters (\\n), actually generate a newline! pretend this text is going straight to a latex generatr!\
-                    Using the prompt above, here is a new, generated question of difficulty {difficulty}, domain {domain}, skill category {skill_category} and section {section}. Please ensure you achieve the correct difficulty level. \
+    rng = seeded_random("answer", section, skill_category, difficulty, index)
+    random_choice = rng.choice(["A", "B", "C", "D"])
+    if difficulty == "easy":
+        target_difficulty_ranking = rng.uniform(0, 0.33)
+    elif difficulty == "medium":
+        target_difficulty_ranking = rng.uniform(0.33, 0.67)
+    elif difficulty == "hard":
+        target_difficulty_ranking = rng.uniform(0.67, 1.0)
+    else:
+        raise ValueError("Invalid difficulty level. Must be 'easy', 'medium', or 'hard'.")
+    
+
+    user_prompt = base_user_prompt.format(difficulty=difficulty, random_choice=random_choice)
+    print(f"domain: {domain}, section: {section}")
+    system_prompt = f"Using the sources as a guide, generate an authentic and unique question of the given difficulty level.\
+    # For RW Questions \
+    Make questions harder than you think they should be always, \
+    and ensure that the tone and style does not differ drastically from those of the examples. The only way in which your question should differ \
+    is that it is allowed to be harder than the others. Realistically, your easiest questions for each difficulty should be as hard as the harder ones in the provided sources. (the files). To ensure question diversity, use the sources as reference to decide when you need to switch gears and  \
+    generate questions of a different style, for example expository vs fictional (for reading and writing questions), based off of how many questions of different styles there are. For now, any math questions should be multiple choice and that are numerical or use a clearly formatted table. For the reading and writing questions, unlike the math do NOT make each question an image of one of the source questions. Your reading and writing questions should be original and they should not be copies, but should take inspiration. Ensure to make your distractors harder too for reading and writing questions. (if its a math question, obviously, otherwise ignore this). Make them HARDER! \
+    However, to make questions harder, you should not just make questions wordier- they should be concise actually. They should be difficult because they mirror the logical thinkng that is required on the SAT.\
+    # For math questions\
+    please use the relevant sources as inspiration when generating your question, only testing topics that are covered in those questions. DO NOT USE ANY CONCEPTS/STRATEGIES THAT DO NOT APPEAR IN THE SOURCE QUESTIONS. The questions should only contain mathematical concepts that you can find in the source questions (CollegeBoard questions), and should be indestinguishable from real SAT math question, besides the fact they should be a litte bit harder. Harder does not mean using concepts that are not covered in the source questions, however. You should basically be taking the provided source questions and making a replica of them for the math questions (but not for RW) to avoid creating questions that don't look exactly like SAT questions, because these math questions need to be of the *exact same format and style*  as the example ones. You are given less creative leeway with the math questions, as they should be made in the image of one of the source questions. NOTHING SUPER CREATIVE OR OFF TOPIC OR NOT IN THE EXACT FORMAT OF ONE OF THE EXAMPLES! THIS MEANS YOUR QUESTIONS SHOULD BE SOLVABLE ALMOST EXACTLY LIKE ONE OF THE SOURCE QUESTIONS. You should really take one of the source questions and just modify it to have different equations/whatever instead of just writing the question from scratch. Don't try to combine a bunch of things, just focus on testing one thing at a time- only the hardest questions should have multiple steps\
+    If you need to create a graphic for your math problem (not all problems need one), please generate latex code for the graph or diagram that you need generated. This latex should use pgfplots for graphs and tikz for shapes. ONLY USE LATEX FOR THE GRAPHS/DIAGRAMS/TABLES, and ONLY IN THE MATH SECTION!!! Not for anything else! THE LATEX IS ONLY TO GENERATE IMAGES, YOU SHOULD TREAT EQUATIONS AND EVERYTHING ELSE LIKE NORMAL TEXT, WE WILL FORMAT EQUATIONS AS VALID LATEX IN REACT, BUT WE WANT IMAGES FOR SHAPES AND STUFF. LIKE IF YOU DECIDE TO DO A GRAPH QUESTION OR A SHAPE QUESTION, THEN DO DO THE LATEX GENERATION THING, OTHERWISE DONT.\
+    If you do generate a math graphic, IT NEEDS TO BE OF THE EXACT SAME FORMAT AS ONE OF THE SOURCE QUESTION GRAPHICS. NO FANCY SHIT THAT DOESN'T ACTUALLY APPEAR ON THE SAT!!! Ensure i can pass your output directly to a latex generator! Don't just pass newline caracters (\\n), actually generate a newline! pretend this text is going straight to a latex generatr!\
+    Using the prompt above, here is a new, generated question of difficulty {difficulty}, domain {domain}, skill category {skill_category} and section {section}. Please ensure you achieve the correct difficulty level. \
 "
-                    system_prompt = str(system_prompt)
-                    #system_prompt = main_prompt.format(section=section, domain=domain, skill_category=skill_category, formula=prompts[section][domain][skill_category], difficulty=difficulty, evaluation_formula=prompts["evaluation_prompt"], refine_formula=prompts["refine_prompt"])
-                    question = generate_question(system_prompt, user_prompt, section, domain, skill_category, difficulty, generated_questions)
-                    print(f"question JSON: {question}")
-                    question_queue.put(question)
+    system_prompt = str(system_prompt)
+    #system_prompt = main_prompt.format(section=section, domain=domain, skill_category=skill_category, formula=prompts[section][domain][skill_category], difficulty=difficulty, evaluation_formula=prompts["evaluation_prompt"], refine_formula=prompts["refine_prompt"])
+    state = {
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt,
+        "section": section,
+        "domain": domain,
+        "skill_category": skill_category,
+        "difficulty": difficulty,
+        "messages": generated_questions,
+        "pipeline_mode": pipeline_mode or DEFAULT_PIPELINE_MODE,
+        "routing_profile": routing_profile,
+        "routes": routes or {},
+        "early_exit": early_exit,
+        "correct_answer": random_choice,
+        "index": index,
+        # Told each stage as it starts; stages the question skips aren't reported
+        "on_stage": on_stage,
+    }
+    return question_pipeline.submit(state)
+
+def start_work_item(item: Dict, on_stage=None) -> Future:
+    return submit_question(item["section"], item["skill_category"], item["difficulty"], generated_questions, on_stage=on_stage, index=item["index"], pipeline_mode=item.get("pipeline_mode"), routing_profile=item.get("routing_profile"), routes=item.get("routes"), early_exit=item.get("early_exit"))
 
 def save_pending_questions(questions: List[Dict]):
     with open ("pending_questions.json", "w") as f:
@@ -169,29 +209,201 @@ def load_pending_questions() -> List[Dict] :
         return []
     
 generated_questions = load_pending_questions()
+review_stats = ReviewStats()
+
+# Per-stage worker counts, e.g. DRAFT_WORKERS=6 FORMAT_WORKERS=2
+question_pipeline = StagePipeline(
+    QUESTION_STAGES,
+    workers={stage: int(os.getenv(f"{stage.upper()}_WORKERS", "4")) for stage, _ in QUESTION_STAGES},
+)
+
+# Caps questions in flight across all requests; each request is broken into (skill, difficulty, index) items
+max_in_flight_questions = int(os.getenv("MAX_IN_FLIGHT_QUESTIONS", "8"))
+work_scheduler = WorkScheduler(start_work_item, max_in_flight=max_in_flight_questions)
+
+pending_lock = threading.Lock()
+
+def add_pending_question(question: Dict):
+    with pending_lock:
+        generated_questions.append(question)
+        save_pending_questions(generated_questions)
+
+# Identical concurrent generate requests share one run
+generations = SingleFlight()
+
+def generation_key(request: QuestionRequest) -> str:
+    return json.dumps({
+        "section": request.section,
+        "skill_categories": sorted(set(request.skill_categories)),
+        "difficulties": sorted(set(request.difficulties)),
+        "num_questions": request.num_questions,
+        "pipeline_mode": request.pipeline_mode or DEFAULT_PIPELINE_MODE,
+        "routing_profile": request.routing_profile,
+        "routes": request.routes or {},
+        "early_exit": request.early_exit,
+    }, sort_keys=True)
+
+def start_generation(items: List[Dict]) -> Future:
+    """
+    Runs the items through the scheduler and adds the finished questions to the pending list once,
+    however many coalesced requests are waiting on the result.
+    """
+    done = Future()
+
+    def finish(settled):
+        try:
+            results = settled.result()
+            with pending_lock:
+                for item, result in zip(items, results):
+                    if isinstance(result, Exception):
+                        print(f"Failed to generate {item['skill_category']} question: {result}")
+                        continue
+                    print(f"question JSON: {result['question']}")
+                    generated_questions.append(result["question"])
+                save_pending_questions(generated_questions)
+            done.set_result(results)
+        except Exception as e:
+            done.set_exception(e)
+
+    all_settled(work_scheduler.submit(item) for item in items).add_done_callback(finish)
+    return done
+
+def run_job_item(item: Dict, on_stage) -> Dict:
+    return work_scheduler.submit(item, on_stage).result()["question"]
+
+# Finished job questions also land in the pending list, so they show up for review like any other batch
+job_manager = JobManager(run_job_item, max_workers=int(os.getenv("JOB_WORKERS", str(max_in_flight_questions))), on_result=add_pending_question)
+job_manager.resume()
 
 @app.post("/generate-questions")
 async def generate_questions(request: QuestionRequest):
 
-    section = request.section
-    question_queue = queue.Queue()
-    threads = []
+    validate_question_request(request)
+
+    # Work items go through the shared scheduler; awaiting the wrapped future keeps the
+    # event loop free to serve the other endpoints while generation is in flight.
+    # A request identical to one already running waits for that run instead of starting another.
+    items = request_work_items(request)
     try:
-        for skill_category in request.skill_categories:
-            thread = threading.Thread(target=generate_questions_for_skill_category, args=(section, skill_category, request.difficulties, request.num_questions, generated_questions, question_queue))
-            threads.append(thread)
-            thread.start()
-        for thread in threads:
-            thread.join()
-
-        while not question_queue.empty():
-            generated_questions.append(question_queue.get())
-        #print(generated_questions)
-        save_pending_questions(generated_questions)
+        await asyncio.wrap_future(generations.submit(generation_key(request), lambda: start_generation(items)))
         return {"questions": generated_questions}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate-questions/stream")
+async def generate_questions_stream(request: QuestionRequest):
+    """
+    Streaming variant of /generate-questions. Responds with NDJSON, one event per line:
+    "progress" when a question enters a pipeline stage, "question" as soon as a question is done,
+    "error" when one fails, and a final "done" event.
+    """
+    validate_question_request(request)
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event: Dict):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def finish(future: Future, position: Dict):
+        # Runs on the pipeline thread that completed the question, after its progress events
+        try:
+            question = future.result()["question"]
+            add_pending_question(question)
+            emit({"type": "question", "question": question, **position})
+        except Exception as e:
+            emit({"type": "error", "error": str(e), **position})
+
+    items = request_work_items(request)
+
+    async def event_stream():
+        for item in items:
+            position = {"skill_category": item["skill_category"], "difficulty": item["difficulty"], "index": item["index"]}
+            on_stage = lambda stage, position=position: emit({"type": "progress", "stage": stage, **position})
+            work_scheduler.submit(item, on_stage).add_done_callback(lambda future, position=position: finish(future, position))
+
+        remaining = len(items)
+        count = 0
+        while remaining:
+            event = await events.get()
+            if event["type"] != "progress":
+                remaining -= 1
+            if event["type"] == "question":
+                count += 1
+            yield json.dumps(event) + "\n"
+        yield json.dumps({"type": "done", "count": count}) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@app.post("/jobs")
+async def create_generation_job(request: QuestionRequest):
+    """
+    Queues a generation job and returns its id immediately; poll /jobs/{job_id} for progress.
+    """
+    validate_question_request(request)
+
+    items = request_work_items(request)
+    job_id = job_manager.submit(request.dict(), items)
+    return {"job_id": job_id, "total": len(items)}
+
+@app.get("/jobs")
+def list_generation_jobs():
+    return {"jobs": job_manager.store.list()}
+
+@app.get("/jobs/{job_id}")
+def get_generation_job(job_id: str):
+    job = job_manager.store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    return summarize(job)
+
+@app.get("/jobs/{job_id}/results")
+def get_generation_job_results(job_id: str):
+    """
+    Returns the questions finished so far, so partial results are available while the job runs.
+    """
+    job = job_manager.store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    return {
+        "id": job_id,
+        "status": job["status"],
+        "questions": [item["question"] for item in job["items"] if item["question"] is not None],
+        "errors": [{"index": item["index"], "error": item["error"]} for item in job["items"] if item["error"]],
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Prometheus text format: per-stage wall time, Gemini call latency, prompt/candidate/cached/thought
+    tokens and retry/failure counts (labelled by stage, section, skill category and difficulty),
+    plus the current pipeline and scheduler backlog.
+    """
+    lines = stage_metrics.render()
+    lines += render_gauge("question_pipeline_backlog", "Questions waiting in front of each pipeline stage.", question_pipeline.backlog(), "stage")
+    lines += render_gauge("question_scheduler_waiting", "Work items waiting for an in-flight slot.", {"all": work_scheduler.queued()}, "queue")
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/review-stats")
+def get_review_stats():
+    """
+    How often the early-exit gate skipped the critique, and reviewer removal rates grouped by
+    early_exit, pipeline_mode and routing_profile.
+    """
+    decisions = stage_metrics.decision_counts("gate")
+    gated = sum(decisions.values())
+    return {
+        "gate": {**decisions, "skip_fraction": round(decisions.get("skipped", 0) / gated, 3) if gated else None},
+        "removal_rates": review_stats.report(),
+    }
+
+@app.get("/llm-stats")
+def get_llm_stats():
+    """
+    Per-stage counts of Gemini calls, retries, hedges, hedge wins, timeouts and failures.
+    """
+    return {"stages": resilient_caller.stats(), "cache": llm_cache.stats(), "context_caches": context_caches.stats(), "prompt_contexts": prompt_contexts.stats(), "routing": model_router.table(), "singleflight": {"generations": generations.stats()}, "question_sync": question_sync.stats(), "outbox": send_outbox.stats()}
+
 @app.post("/remove-question")
 async def remove_question(request: Request):
     try:
@@ -201,20 +413,22 @@ async def remove_question(request: Request):
         if index_to_remove is None:
             raise HTTPException(status_code=400, detail="Missing question index")
 
-        global generated_questions
-
-        if not (0 <= index_to_remove < len(generated_questions)):
-            raise HTTPException(status_code=404, detail=f"No question at index {index_to_remove}")
-
-        # Actually remove by index
-        removed_question = generated_questions.pop(index_to_remove)
+        with pending_lock:
+            if not (0 <= index_to_remove < len(generated_questions)):
+                raise HTTPException(status_code=404, detail=f"No question at index {index_to_remove}")
 
-        save_pending_questions(generated_questions)
+            # Actually remove by index
+            removed_question = generated_questions[index_to_remove]
+            drop_pending([index_to_remove])
+            questions = list(generated_questions)
+        review_stats.record(removed_question, REMOVED)
 
         return {
-            "questions": generated_questions
+            "questions": questions
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -223,24 +437,77 @@ async def human_feedback(request: FeedbackRequest):
     question_index = request.index
     feedback_content = request.content
 
-    if not (0 <= question_index < len(generated_questions)):
-        raise HTTPException(status_code=404, detail=f"No question at index {question_index}")
-
-    original_question = generated_questions[question_index]
+    with pending_lock:
+        if not (0 <= question_index < len(generated_questions)):
+            raise HTTPException(status_code=404, detail=f"No question at index {question_index}")
+        original_question = generated_questions[question_index]
     old_difficulty_rating = original_question.get("difficulty_ranking", "unknown")
 
     section = original_question.get("section", "unknown")
     difficulty = original_question.get("difficulty", "unknown")
     skill_category = original_question.get("skill_category", "unknown")
 
-    revised_question = get_human_feedback(original_question, section, skill_category, difficulty, question_index, feedback_content, prompts["main_prompt"])
-    generated_questions[question_index] = revised_question  # Update in place
-
+    loop = asyncio.get_running_loop()
+    revised_question = await loop.run_in_executor(None, get_human_feedback, original_question, section, skill_category, difficulty, question_index, feedback_content, prompts["main_prompt"])
+    # The revision is still the question generated with these settings, for the review stats
+    for field in GROUPS:
+        if field in original_question:
+            revised_question[field] = original_question[field]
+
+    with pending_lock:
+        # Other questions may have been added, removed or sent while the revision ran
+        position = next((i for i, question in enumerate(generated_questions) if question is original_question), None)
+        if position is None:
+            raise HTTPException(status_code=409, detail="The question was removed or sent while it was being revised")
+        generated_questions[position] = revised_question  # Update in place
+        save_pending_questions(generated_questions)
+        questions = list(generated_questions)
 
+    return {"questions": questions}
 
+def match_pending(questions_data: List[Dict]) -> List[Optional[int]]:
+    """
+    The pending-list index of each submitted question (None if it isn't pending), matched by content.
+    Call with pending_lock held.
+    """
+    taken = set()
+    indices = []
+    for question in questions_data:
+        index = next((i for i, pending in enumerate(generated_questions) if i not in taken and pending == question), None)
+        if index is not None:
+            taken.add(index)
+        indices.append(index)
+    return indices
+
+def drop_pending(indices):
+    """
+    Removes the pending questions at `indices` and their feedback log entries; entries of the
+    questions that stay are renumbered to their new positions. Call with pending_lock held.
+    """
+    indices = set(indices)
+    positions = {}
+    kept = []
+    for index, question in enumerate(generated_questions):
+        if index not in indices:
+            positions[index] = len(kept)
+            kept.append(question)
+    generated_questions[:] = kept
     save_pending_questions(generated_questions)
 
-    return {"questions": generated_questions}
+    feedback_log = [
+        {**entry, "question_index": positions[entry.get("question_index")]}
+        for entry in load_feedback_log() if entry.get("question_index") in positions
+    ]
+    with open("feedback_log.json", "w") as f:
+        json.dump(feedback_log, f, indent=4)
+
+def clear_submitted(questions_data: List[Dict]):
+    """
+    Drops the submitted questions from the pending list, leaving any that were generated after the
+    reviewer loaded them.
+    """
+    with pending_lock:
+        drop_pending(index for index in match_pending(questions_data) if index is not None)
 
 @app.post("/send-questions")
 async def send_questions(request: Request):
@@ -251,33 +518,50 @@ async def send_questions(request: Request):
         questions: List[Question] = [Question(**q) for q in questions_data]
         print("Received questions:", questions)
 
-        feedback_log = load_feedback_log()
-        for idx, question in enumerate(questions):
+        with pending_lock:
+            pending_indices = match_pending(questions_data)
+            feedback_by_index = collections.defaultdict(list)
+            for entry in load_feedback_log():
+                feedback_by_index[entry.get("question_index")].append(entry)
+
+        # The whole submission goes to the outbox first, then to Firestore in batched commits
+        writes = []
+        submitted = []
+        for question, pending_index in zip(questions, pending_indices):
             question_data = question.dict()
-            question_id = add_question(question_data)  # Get unique ID from Firebase
-
-            # Find matching feedback by index
-            for entry in feedback_log:
-                print(entry)
-                if entry["question_index"] == idx:
-                    entry["question_id"] = question_id  # Add the unique ID here
-                    print("saving feedback")
-                    save_human_feedback(
-                        feedback=entry,
-                        question_id=question_id,
-                    )
-                    
-
-        load_questions_from_firebase()
-        global generated_questions
-        generated_questions = []
-        with open("pending_questions.json", "w") as f:
-            json.dump([], f)
-
-# Clear feedback log
-        with open("feedback_log.json", "w") as f:
-            json.dump([], f)
+            writes += question_writes(question_data)
+            submitted.append(question_data)
+
+            # Feedback is logged against the question's position in the pending list
+            for entry in feedback_by_index[pending_index] if pending_index is not None else ():
+                entry["question_id"] = question_data["id"]  # Add the unique ID here
+                writes += human_feedback_writes(entry, question_data["id"])
+
+        group_id = send_outbox.enqueue(writes)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, send_outbox.flush)
+            flush_error = None
+        except Exception as e:
+            flush_error = e
+        error = send_outbox.dead_letter_error(group_id)
+        if error is not None:
+            # Never going to be written, so the questions stay pending for another try
+            raise HTTPException(status_code=500, detail=f"Questions could not be written to Firebase and are still pending: {error}")
+
+        # Written, or queued and retried on the next flush (resending would write them twice)
+        for question_data in submitted:
+            review_stats.record(question_data, ACCEPTED)
+        clear_submitted(questions_data)
+        if flush_error is not None:
+            raise HTTPException(status_code=503, detail=f"Questions queued but not yet written to Firebase; they will be retried: {flush_error}")
+
+        # Wait until the bank shows the new questions, so the next read includes them
+        await asyncio.get_running_loop().run_in_executor(None, question_sync.await_writes, [
+            (question_data["section"], question_data["id"], None, False) for question_data in submitted
+        ])
         return {"message": "Questions successfully sent to Firebase"}
+    except HTTPException:
+        raise
     except ValidationError as e:
         print("Validation error:", e.json())
         raise HTTPException(status_code=422, detail=e.errors())
@@ -295,38 +579,32 @@ async def get_firebase_questions(
     section: Optional[str] = None,
     domain: Optional[str] = None,
     skill_category: Optional[str] = None,
-    difficulty: Optional[str] = None
+    difficulty: Optional[str] = None,
+    limit: Optional[int] = None,
+    start_after: Optional[str] = None,
+    fields: Optional[str] = None,
+    all_pages: bool = Query(False, alias="all")
 ):
     """
-    Load questions from Firebase with optional filtering
+    Load questions from Firebase with optional filtering. Results come a page at a time (`limit`,
+    100 by default): pass the returned `next_cursor` back as `start_after` for the next page, or
+    ask for `all=true` to get every match at once. `fields` (comma separated) returns only those
+    fields, plus id and section.
     """
     try:
-        # Load all questions from Firebase
-        all_firebase_questions = load_questions_from_firebase()
-        
-        if not all_firebase_questions or "SAT" not in all_firebase_questions:
-            return {"questions": []}
-        
-        questions = []
-        
-        # Extract questions from the nested structure
-        for section_key, section_data in all_firebase_questions["SAT"].items():
-            if section and section_key != section:
-                continue
-                
-            if isinstance(section_data, list):
-                for question in section_data:
-                    # Apply filters
-                    if domain and question.get("domain") != domain:
-                        continue
-                    if skill_category and question.get("skill_category") != skill_category:
-                        continue
-                    if difficulty and question.get("difficulty") != difficulty:
-                        continue
-                    
-                    questions.append(question)
-        
-        return {"questions": questions}
+        query = QuestionQuery.from_params(section, domain, skill_category, difficulty, limit, start_after, fields, all_pages)
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        if question_sync.listening:
+            # The live replica answers without any Firestore reads
+            questions, next_cursor = query.run_local(question_sync.bank)
+        else:
+            # Filters, cursor, limit and projection run in Firestore, so reads scale with the page
+            questions, next_cursor = await question_store.run(query.run_firestore)
+
+        return {"questions": questions, "next_cursor": next_cursor}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading Firebase questions: {str(e)}")
@@ -348,15 +626,14 @@ async def update_firebase_question(question_id: str, request: Request):
         if not section:
             raise HTTPException(status_code=400, detail="Missing section in question data")
         
-        # Update the question in Firebase
-        db.collection("questions") \
-          .document("SAT") \
-          .collection(section) \
-          .document(question_id) \
-          .set(updated_question, merge=True)
+        # Update the question in Firebase; the commit time stamped into updated_at is what the incremental sync picks changes up by
+        [updated_at] = await question_store.run(commit_writes, [
+            firestore_write(("questions", "SAT", section, question_id), updated_question, merge=True, server_timestamps=("updated_at",)),
+        ])
+        updated_question["updated_at"] = updated_at.isoformat()
         
-        # Reload questions to update local cache
-        load_questions_from_firebase()
+        # Wait for the local replica to show the update
+        await asyncio.get_running_loop().run_in_executor(None, question_sync.await_write, section, question_id, updated_at)
         
         return {"message": "Question updated successfully", "question": updated_question}
     
@@ -369,15 +646,14 @@ async def delete_firebase_question(question_id: str, section: str):
     Delete a specific question from Firebase
     """
     try:
-        # Delete the question from Firebase
-        db.collection("questions") \
-          .document("SAT") \
-          .collection(section) \
-          .document(question_id) \
-          .delete()
+        # Delete the question from Firebase, atomically with the tombstone that tells syncs it is gone
+        await question_store.run(commit_writes, [
+            firestore_delete(("questions", "SAT", section, question_id)),
+            question_sync.tombstone_write(section, question_id),
+        ])
         
-        # Reload questions to update local cache
-        load_questions_from_firebase()
+        # Wait for the local replica to drop the question
+        await asyncio.get_running_loop().run_in_executor(None, lambda: question_sync.await_write(section, question_id, deleted=True))
         
         return {"message": "Question deleted successfully"}
     
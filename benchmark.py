@@ -0,0 +1,299 @@
+"""
+End-to-end throughput benchmark for /generate-questions that spends no Gemini quota.
+
+The Gemini client, Firestore and Storage are replaced with the in-memory fakes from fakes.py,
+Firestore is seeded from the local questions_data.json/feedback.json snapshots, and the app runs
+in a scratch directory so pending_questions.json, jobs.json and friends are left alone.
+
+Each scenario is one request shape (skills x difficulties x num_questions) at one concurrency.
+It reports questions/minute and p50/p95/p99 per pipeline stage. With the gate options it exits
+with status 1 on a regression, so it can run in CI:
+
+    python benchmark.py --shapes 1x1x2 3x2x1 --concurrency 1 4 --error-rate 0.02 \\
+        --min-qpm 60 --max-p95 draft=1.5 --max-p95 revision=2 --json benchmark.json
+
+--routing-profiles repeats every scenario per model routing profile and adds estimated cost per
+question and acceptance (the share of requested questions that came back valid). Against the fake
+backend only latency and cost differ between profiles; --live keeps the Firestore and Storage
+fakes but calls the real Gemini API (needs GEMINI_API_KEY and spends quota) to compare quality:
+
+    python benchmark.py --live --routing-profiles quality balanced economy --shapes 2x3x2
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stage recognised from the start of each stage's system instruction (the part before any {placeholders})
+SYSTEM_PROMPT_STAGES = {
+    "ai_feedback_prompt": "ai_feedback",
+    "human_feedback_prompt": "revision",
+    "format_prompt": "format",
+    "evaluation_prompt": "evaluate",
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark /generate-questions against a fake Gemini backend")
+    parser.add_argument("--section", default="math", choices=["math", "reading_and_writing"])
+    parser.add_argument("--shapes", nargs="+", default=["1x1x2", "2x3x1"],
+                        help="request shapes as SKILLSxDIFFICULTIESxNUM_QUESTIONS")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4],
+                        help="concurrent clients per scenario")
+    parser.add_argument("--requests", type=int, default=None,
+                        help="requests per scenario (default: one per client)")
+    parser.add_argument("--pipeline-mode", choices=["format", "structured"], default=None)
+    parser.add_argument("--routing-profiles", nargs="+", default=[None],
+                        help="run every scenario once per model routing profile (quality, balanced, economy)")
+    parser.add_argument("--early-exit", action="store_true",
+                        help="let drafts that pass the local checks skip the AI critique and revision")
+    parser.add_argument("--live", action="store_true",
+                        help="call the real Gemini API instead of the fake (spends quota)")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="multiplies the fake per-stage median latencies")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of fake Gemini calls that fail with a retryable 503")
+    parser.add_argument("--backoff", type=float, default=0.05,
+                        help="retry base delay in seconds (production uses 2s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_file", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own output")
+    parser.add_argument("--min-qpm", type=float, default=None,
+                        help="fail if any scenario generates fewer questions per minute")
+    parser.add_argument("--max-p95", action="append", default=[], metavar="STAGE=SECONDS",
+                        help="fail if a stage's p95 exceeds SECONDS in any scenario (repeatable)")
+    parser.add_argument("--max-failure-rate", type=float, default=None,
+                        help="fail if the fraction of questions that failed exceeds this")
+    return parser.parse_args(argv)
+
+
+def parse_shape(shape):
+    skills, difficulties, num_questions = (int(n) for n in shape.lower().split("x"))
+    return skills, difficulties, num_questions
+
+
+def prepare_workspace():
+    """Scratch working directory with the prompts, sources and snapshots the app reads at import."""
+    workspace = tempfile.mkdtemp(prefix="rocketprep-bench-")
+    for name in ("prompts", "sources"):
+        if os.path.exists(os.path.join(REPO_DIR, name)):
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(workspace, name))
+    for name in ("sources_data.json", "questions_data.json", "feedback.json"):
+        if os.path.exists(os.path.join(REPO_DIR, name)):
+            shutil.copy(os.path.join(REPO_DIR, name), workspace)
+    return workspace
+
+
+def load_app(args, output):
+    """Installs the fakes and imports the app; returns (app module, gen module, fake Gemini client)."""
+    import fakes
+
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    # The fake backend has no quota; keep the limiter out of the measurement
+    os.environ.setdefault("GEMINI_RPM", "1000000")
+    os.environ.setdefault("GEMINI_TPM", "1000000000")
+    os.environ["LLM_CACHE_MODE"] = "off"
+    os.environ["LLM_CACHE_SEED"] = str(args.seed)
+
+    gemini = None
+    if not args.live:
+        gemini = fakes.FakeGeminiClient(latency_scale=args.latency_scale, error_rate=args.error_rate, seed=args.seed)
+    firestore_client = fakes.FakeFirestore()
+    firestore_client.load_snapshots()
+    fakes.install(gemini, firestore_client, fakes.FakeBucket())
+
+    with contextlib.redirect_stdout(output):
+        import app
+        import gen
+
+    if gemini is not None:
+        gemini.system_stages = [
+            (gen.prompts[name].split("{")[0][:200], stage) for name, stage in SYSTEM_PROMPT_STAGES.items()
+        ]
+    for policy in gen.resilient_caller.policies.values():
+        policy.base_delay = args.backoff
+    gen.resilient_caller.default_policy.base_delay = args.backoff
+    return app, gen, gemini
+
+
+def accepted(question, section):
+    """Whether a generated question would survive review: valid Question, four choices, right section style."""
+    from draft_checks import check_section_style
+    from models import Question
+
+    try:
+        Question.model_validate(question)
+    except Exception:
+        return False
+    return (
+        len(question.get("choices", [])) == 4
+        and question.get("correct_answer") in ("A", "B", "C", "D")
+        and check_section_style(question.get("question", ""), section) is None
+    )
+
+
+def run_scenario(app_module, gen, args, shape, concurrency, routing_profile, output):
+    from fastapi.testclient import TestClient
+
+    skills, difficulties, num_questions = parse_shape(shape)
+    section_skills = [
+        skill for skill in app_module.skill_category_to_domain
+        if skill in gen.sources.get(args.section, {}).get(app_module.skill_category_to_domain[skill], {})
+    ]
+
+    def body(n):
+        # Each request gets its own window of skills, since identical concurrent requests share one run
+        start = (n * skills) % max(1, len(section_skills))
+        rotated = section_skills[start:] + section_skills[:start]
+        return {
+            "section": args.section,
+            "domains": [],
+            "skill_categories": rotated[:skills],
+            "difficulties": ["easy", "medium", "hard"][:difficulties],
+            "num_questions": num_questions,
+            "pipeline_mode": args.pipeline_mode,
+            "routing_profile": routing_profile,
+            "early_exit": args.early_exit or None,
+        }
+
+    total_requests = args.requests or concurrency
+    bodies = [body(n) for n in range(total_requests)]
+    remaining = iter(bodies)
+    remaining_lock = threading.Lock()
+    statuses = []
+
+    def client_loop():
+        client = TestClient(app_module.app)
+        while True:
+            with remaining_lock:
+                request_body = next(remaining, None)
+            if request_body is None:
+                return
+            response = client.post("/generate-questions", json=request_body)
+            statuses.append(response.status_code)
+
+    gen.stage_metrics.reset()
+    app_module.generated_questions.clear()
+    started = time.monotonic()
+    with contextlib.redirect_stdout(output):
+        threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.monotonic() - started
+
+    counts = gen.stage_metrics.stage_counts()
+    questions = counts.get("render", {}).get("completed", 0)
+    # Requests that still coincide (a section with few skills) are coalesced, so only distinct ones count
+    distinct = len({json.dumps(request_body, sort_keys=True) for request_body in bodies})
+    expected = distinct * skills * difficulties * num_questions
+    valid = sum(1 for question in app_module.generated_questions if accepted(question, args.section))
+    return {
+        "shape": shape,
+        "concurrency": concurrency,
+        "routing_profile": routing_profile or gen.model_router.profile,
+        "requests": total_requests,
+        "http_errors": sum(1 for status in statuses if status != 200),
+        "questions": questions,
+        "failed_questions": expected - questions,
+        "seconds": round(elapsed, 3),
+        "questions_per_minute": round(60 * questions / elapsed, 2) if elapsed else 0.0,
+        "cost_per_question": round(gen.stage_metrics.total_cost() / questions, 5) if questions else None,
+        "acceptance": round(valid / expected, 3) if expected else None,
+        "gate": gen.stage_metrics.decision_counts("gate"),
+        "stages": {
+            stage: {name: round(value, 4) for name, value in quantiles.items()}
+            for stage, quantiles in gen.stage_metrics.stage_quantiles().items()
+        },
+        "events": {
+            f"{stage}:{event}": count
+            for stage, events in gen.stage_metrics.event_counts().items()
+            for event, count in events.items()
+            if event != "calls"
+        },
+    }
+
+
+def check_gates(args, results):
+    """Returns a list of human-readable gate violations."""
+    max_p95 = {}
+    for gate in args.max_p95:
+        stage, _, seconds = gate.partition("=")
+        max_p95[stage] = float(seconds)
+
+    violations = []
+    for result in results:
+        name = f"{result['shape']} @ {result['concurrency']} ({result['routing_profile']})"
+        if args.min_qpm is not None and result["questions_per_minute"] < args.min_qpm:
+            violations.append(f"{name}: {result['questions_per_minute']} questions/min < {args.min_qpm}")
+        for stage, limit in max_p95.items():
+            p95 = result["stages"].get(stage, {}).get("p95")
+            if p95 is not None and p95 > limit:
+                violations.append(f"{name}: {stage} p95 {p95:.3f}s > {limit}s")
+        expected = result["questions"] + result["failed_questions"]
+        if args.max_failure_rate is not None and expected and result["failed_questions"] / expected > args.max_failure_rate:
+            violations.append(f"{name}: {result['failed_questions']}/{expected} questions failed")
+    return violations
+
+
+def print_results(results):
+    for result in results:
+        print(
+            f"\n[{result['routing_profile']}] {result['shape']} x {result['requests']} request(s) @ concurrency {result['concurrency']}: "
+            f"{result['questions']} questions in {result['seconds']:.1f}s = {result['questions_per_minute']:.1f}/min"
+            f" ({result['failed_questions']} failed, {result['http_errors']} HTTP errors)"
+        )
+        cost = result["cost_per_question"]
+        print(f"  est. cost/question {'n/a' if cost is None else f'${cost:.4f}'}, acceptance {result['acceptance']}")
+        if result["gate"]:
+            print("  early-exit gate: " + ", ".join(f"{decision}={count}" for decision, count in sorted(result["gate"].items())))
+        for stage, quantiles in result["stages"].items():
+            print(f"  {stage:<12} " + "  ".join(f"{name} {value * 1000:7.1f}ms" for name, value in quantiles.items()))
+        if result["events"]:
+            print("  events: " + ", ".join(f"{name}={count}" for name, count in sorted(result["events"].items())))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workspace = prepare_workspace()
+    sys.path.insert(0, REPO_DIR)
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    output = sys.stdout if args.verbose else io.StringIO()
+    try:
+        app_module, gen, _ = load_app(args, output)
+        results = []
+        for routing_profile in args.routing_profiles:
+            for shape in args.shapes:
+                for concurrency in args.concurrency:
+                    results.append(run_scenario(app_module, gen, args, shape, concurrency, routing_profile, output))
+                    if not args.verbose:
+                        output.seek(0)
+                        output.truncate()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    print_results(results)
+    if args.json_file:
+        with open(args.json_file, "w") as f:
+            json.dump(results, f, indent=4)
+
+    violations = check_gates(args, results)
+    for violation in violations:
+        print(f"FAIL {violation}")
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
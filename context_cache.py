@@ -0,0 +1,133 @@
+import collections
+import hashlib
+import json
+import threading
+import time
+
+from google.genai.types import CreateCachedContentConfig, UpdateCachedContentConfig
+
+# How the API says a prefix can never be cached: below the model's minimum size, or a model without caching
+UNSUPPORTED_MARKERS = ("too small", "min_total_token_count", "not supported", "does not support")
+
+
+def is_unsupported(error):
+    """Whether a caches.create error means this prefix can't be cached at all, rather than not right now."""
+    code = getattr(error, "code", None)
+    return code in (400, 404) and any(marker in str(error).lower() for marker in UNSUPPORTED_MARKERS)
+
+
+class ContextCacheManager:
+    """
+    Creates Gemini cached-content handles for the static prefix of a prompt (system instruction plus
+    the leading contents) and hands out their names for `GenerateContentConfig(cached_content=...)`.
+
+    Handles are keyed by the caller's key (e.g. stage, section, domain, skill, difficulty) plus a digest
+    of the prefix, so an edited prompt gets a fresh cache. A handle's TTL is extended when it is used
+    within `refresh_margin` seconds of expiring. Prefixes the API refuses to cache (below the model's
+    minimum cacheable size, or a model without caching) are remembered and served uncached. Any other
+    failure is served uncached for a backoff that doubles from `retry_after` up to `max_retry_after`
+    seconds, then creation is tried again.
+    """
+
+    def __init__(self, client, ttl_seconds=3600, refresh_margin=300, enabled=True, retry_after=30, max_retry_after=1800):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.enabled = enabled
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self.lock = threading.Lock()
+        self.key_locks = collections.defaultdict(threading.Lock)
+        self.entries = {}
+        self.unsupported = set()
+        self.backoff = {}  # full key -> (retry at, consecutive failures)
+        self.counters = collections.Counter()
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _full_key(self, key, model, system_instruction, contents):
+        digest = hashlib.sha256(json.dumps([model, system_instruction, contents], default=str).encode("utf-8")).hexdigest()
+        return (*key, model, digest[:16])
+
+    def get(self, key, model, system_instruction, contents):
+        """Returns a cached-content name for this prefix, or None if the call should go uncached."""
+        if not self.enabled:
+            return None
+        full_key = self._full_key(key, model, system_instruction, contents)
+        with self.lock:
+            if full_key in self.unsupported:
+                return None
+            if full_key in self.backoff and self.backoff[full_key][0] > time.time():
+                self.counters["backing_off"] += 1
+                return None
+            key_lock = self.key_locks[full_key]
+
+        # Per-key lock so concurrent questions for the same skill create the cache only once
+        with key_lock:
+            entry = self.entries.get(full_key)
+            now = time.time()
+            if entry and entry["expires"] - now > self.refresh_margin:
+                self._count("hits")
+                return entry["name"]
+            if entry and entry["expires"] > now:
+                try:
+                    self.client.caches.update(
+                        name=entry["name"],
+                        config=UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s"),
+                    )
+                    entry["expires"] = now + self.ttl_seconds
+                    self._count("refreshes")
+                    return entry["name"]
+                except Exception as e:
+                    print(f"Could not refresh context cache {entry['name']}: {e}")
+
+            try:
+                cache = self.client.caches.create(
+                    model=model,
+                    config=CreateCachedContentConfig(
+                        display_name="-".join(map(str, key))[:128],
+                        system_instruction=system_instruction,
+                        contents=contents,
+                        ttl=f"{self.ttl_seconds}s",
+                    ),
+                )
+            except Exception as e:
+                with self.lock:
+                    if is_unsupported(e):
+                        print(f"Context caching unavailable for {key}: {e}")
+                        self.unsupported.add(full_key)
+                    else:
+                        failures = self.backoff.get(full_key, (0, 0))[1] + 1
+                        delay = min(self.max_retry_after, self.retry_after * 2 ** (failures - 1))
+                        print(f"Could not create a context cache for {key}, retrying in {delay}s: {e}")
+                        self.backoff[full_key] = (now + delay, failures)
+                        self.counters["create_errors"] += 1
+                return None
+            with self.lock:
+                self.backoff.pop(full_key, None)
+            self.entries[full_key] = {"name": cache.name, "expires": now + self.ttl_seconds}
+            self._count("created")
+            print(f"Created context cache {cache.name} for {key}")
+            return cache.name
+
+    def invalidate(self, name):
+        """Forgets a handle the API no longer accepts (e.g. it expired server-side)."""
+        for full_key, entry in list(self.entries.items()):
+            if entry["name"] == name:
+                self.entries.pop(full_key, None)
+                self._count("invalidated")
+
+    def close(self):
+        """Deletes every cache this process created, so storage isn't billed until the TTL runs out."""
+        for entry in list(self.entries.values()):
+            try:
+                self.client.caches.delete(name=entry["name"])
+            except Exception as e:
+                print(f"Could not delete context cache {entry['name']}: {e}")
+        self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"active": len(self.entries), "unsupported": len(self.unsupported), "backing_off_keys": len(self.backoff), **self.counters}
@@ -0,0 +1,174 @@
+import re
+
+# Markers of graphic LaTeX, which the generation prompt only allows in math questions. A
+# generation_latex key only counts with a non-empty value: structured output always has the key.
+LATEX_MARKERS = re.compile(r'\\documentclass|\\begin\{(tikzpicture|axis|document)\}|\\usepackage|pgfplots|"generation_latex"\s*:\s*"[^"]')
+
+# Stems that only appear in reading and writing questions
+RW_STEMS = re.compile(
+    r"which choice completes the text|most logically completes the text|"
+    r"conforms to the conventions of standard english|text 1 and text 2|"
+    r"main purpose of the text|overall structure of the text",
+    re.IGNORECASE,
+)
+
+CHOICE_PATTERNS = {
+    letter: re.compile(rf'(^|[\s("\[*]){letter}[.):]', re.MULTILINE)
+    for letter in "ABCD"
+}
+
+
+class DraftRejected(Exception):
+    """
+    Raised when a local check fails on a model response, possibly mid-stream. It is a quick, cheap
+    failure, so the resilience layer retries it right away instead of backing off.
+    """
+    retry_immediately = True
+
+    def __init__(self, stage, reason):
+        super().__init__(f"{stage} rejected: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+def check_section_style(text, section):
+    """Checks that can run on a partial response; returns a reason string or None."""
+    if section == "reading_and_writing" and LATEX_MARKERS.search(text):
+        return "LaTeX graphic in a reading and writing question"
+    if section == "math" and RW_STEMS.search(text):
+        return "reading and writing question stem in a math question"
+    return None
+
+
+def missing_choices(text):
+    return [letter for letter, pattern in CHOICE_PATTERNS.items() if not pattern.search(text)]
+
+
+def stream_check_for(section):
+    """
+    Returns check(text, final) for streaming a draft or revision: section-style checks run on
+    every chunk, and the four-choices check runs once the response is complete.
+    """
+    def check(text, final):
+        reason = check_section_style(text, section)
+        if reason is None and final:
+            missing = missing_choices(text)
+            if missing:
+                reason = f"missing answer choice(s) {', '.join(missing)}"
+        return reason
+
+    return check
+
+
+# Early-exit gate: validators run on a finished draft to decide whether it can skip the AI critique
+# and revision and go straight to formatting.
+
+ANSWER_PATTERN = re.compile(r"correct\s+answer\s*(?:is|:)?\s*[*_]*\s*\(?([A-D])\b", re.IGNORECASE)
+CHOICE_LINE = re.compile(r"^[\s*_#]*\(?([A-D])[.):][*_]*\s*(.+?)\s*$", re.MULTILINE)
+NUMBER = re.compile(r"^\$?\s*(-?\d+(?:\.\d+)?(?:\s*/\s*-?\d+(?:\.\d+)?)?)\s*\$?\.?$")
+WORKED_RESULT = re.compile(r"(?:=|answer is)\s*\$?\s*(-?\d+(?:\.\d+)?(?:\s*/\s*-?\d+(?:\.\d+)?)?)(?![\d/.]*\s*[a-zA-Z(])")
+WORD = re.compile(r"[a-z0-9']+")
+
+# Allowed words in the question stem (everything before the choices)
+STEM_WORD_BOUNDS = {
+    "reading_and_writing": (25, 150),
+    "math": (5, 150),
+}
+
+
+def declared_answer(text):
+    match = ANSWER_PATTERN.search(text)
+    return match.group(1).upper() if match else None
+
+
+def choice_texts(text):
+    """The first line labelled with each letter, e.g. {"A": "12", "B": "15", ...}."""
+    choices = {}
+    for match in CHOICE_LINE.finditer(text):
+        choices.setdefault(match.group(1), match.group(2))
+    return choices
+
+
+def question_stem(text):
+    match = CHOICE_LINE.search(text)
+    return text[:match.start()] if match else text
+
+
+def _number(text):
+    match = NUMBER.match(text.strip())
+    if not match:
+        return None
+    numerator, _, denominator = match.group(1).replace(" ", "").partition("/")
+    try:
+        return float(numerator) / float(denominator) if denominator else float(numerator)
+    except ZeroDivisionError:
+        return None
+
+
+def _shingles(text, size=3):
+    words = WORD.findall(text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def exemplar_similarity(text, exemplars):
+    """Highest Jaccard similarity of word trigrams between the draft's stem and any exemplar question."""
+    stem = _shingles(question_stem(text))
+    best = 0.0
+    for exemplar in exemplars:
+        other = _shingles(exemplar)
+        if stem and other:
+            best = max(best, len(stem & other) / len(stem | other))
+    return best
+
+
+def check_math_answer(text, letter):
+    """
+    For numeric choices: the choices must be distinct and the last worked result in the draft
+    ("... = 5", "the answer is 5") must equal the value of the declared correct choice.
+    """
+    choices = choice_texts(text)
+    values = {key: _number(value) for key, value in choices.items()}
+    if letter not in values or values[letter] is None:
+        return "correct choice is not numeric, answer not verified"
+    numeric = [value for value in values.values() if value is not None]
+    if len(set(numeric)) != len(numeric):
+        return "duplicate numeric choices"
+    results = [_number(match.group(1)) for match in WORKED_RESULT.finditer(text[CHOICE_LINE.search(text).start():])]
+    results = [value for value in results if value is not None]
+    if not results:
+        return "no worked result to check the answer against"
+    if abs(results[-1] - values[letter]) > 1e-6 * max(1.0, abs(values[letter])):
+        return f"worked result {results[-1]:g} does not match choice {letter}"
+    return None
+
+
+def gate_checks(text, section, exemplars=(), expected_answer=None, max_similarity=0.6):
+    """Runs every early-exit validator; returns {name: reason or None}."""
+    checks = {"style": check_section_style(text, section)}
+
+    missing = missing_choices(text)
+    checks["choices"] = f"missing answer choice(s) {', '.join(missing)}" if missing else None
+
+    letter = declared_answer(text)
+    if letter is None:
+        checks["answer"] = "no correct answer stated"
+    elif expected_answer and letter != expected_answer:
+        checks["answer"] = f"correct answer is {letter}, requested {expected_answer}"
+    else:
+        checks["answer"] = None
+
+    low, high = STEM_WORD_BOUNDS.get(section, (5, 200))
+    words = len(WORD.findall(question_stem(text).lower()))
+    checks["length"] = None if low <= words <= high else f"stem has {words} words, expected {low}-{high}"
+
+    similarity = exemplar_similarity(text, exemplars)
+    checks["similarity"] = None if similarity <= max_similarity else f"{similarity:.2f} similar to an existing question"
+
+    if section == "math":
+        checks["math_answer"] = check_math_answer(text, letter) if letter else "no correct answer stated"
+    return checks
+
+
+def gate_score(checks):
+    """Fraction of validators passed."""
+    return sum(1 for reason in checks.values() if reason is None) / len(checks) if checks else 0.0
@@ -0,0 +1,698 @@
+import collections
+import copy
+import enum
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+from google.genai.types import (
+    Candidate,
+    Content,
+    GenerateContentResponse,
+    GenerateContentResponseUsageMetadata,
+    Part,
+)
+
+# Median seconds and lognormal sigma per stage for the fake Gemini client
+DEFAULT_LATENCY = {
+    "draft": (0.30, 0.35),
+    "ai_feedback": (0.40, 0.35),
+    "revision": (0.40, 0.35),
+    "format": (0.15, 0.30),
+    "evaluate": (0.15, 0.30),
+    "human_feedback": (0.40, 0.35),
+}
+
+# Latency multiplier per model, relative to Pro
+MODEL_SPEED = {
+    "gemini-2.5-flash": 0.4,
+    "gemini-2.5-flash-lite": 0.25,
+}
+
+CANNED_QUESTION = {
+    "question": "If 3x + 5 = 20, what is the value of x?",
+    "section": "math",
+    "domain": "algebra",
+    "skill_category": "linear_equations_in_one_variable",
+    "difficulty": "medium",
+    "choices": ["A) 3", "B) 5", "C) 7", "D) 15"],
+    "correct_answer": "B",
+    "difficulty_ranking": "0.5",
+    "explanations": {
+        "A": "This is the result of subtracting 5 from 20 and dividing by 5.",
+        "B": "Subtracting 5 from both sides gives 3x = 15, so x = 5.",
+        "C": "This is the result of adding 5 to 20 and dividing by 3, then rounding down.",
+        "D": "This is the value of 3x, not x.",
+    },
+}
+
+
+class FakeAPIError(Exception):
+    """Stands in for google.genai.errors.APIError; ResilientCaller retries it by its code."""
+
+    def __init__(self, code, message="fake Gemini error"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def canned_text(config, serial=None):
+    """
+    A response every stage accepts: prose with four labelled choices, followed by the question JSON.
+    A `serial` is worked into the question text, so responses can be told apart.
+    """
+    question = dict(CANNED_QUESTION)
+    if serial is not None:
+        question["question"] = f"If 3x + {5 + serial} = {20 + serial}, what is the value of x?"
+    if getattr(config, "response_schema", None) is not None:
+        question["explanations"] = dict(CANNED_QUESTION["explanations"])
+        return json.dumps(question)
+    prose = question["question"] + "\n" + "\n".join(question["choices"]) + "\nCorrect answer: B\nSince 3x = 15, x = 5."
+    return f"{prose}\n\n{json.dumps(question)}"
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self.client = client
+
+    def generate_content(self, model, contents, config=None):
+        stage = self.client.stage_for(config)
+        self.client.wait(stage, model, config)
+        return self.client.response(contents, config, self.client.text(config))
+
+    def generate_content_stream(self, model, contents, config=None):
+        stage = self.client.stage_for(config)
+        text = self.client.text(config)
+
+        def chunks():
+            # Time to first token, then the rest of the latency spread over the remaining chunks
+            self.client.wait(stage, model, config, fraction=0.3)
+            pieces = [text[i:i + 200] for i in range(0, len(text), 200)]
+            for n, piece in enumerate(pieces):
+                if n:
+                    self.client.wait(stage, model, config, fraction=0.7 / max(1, len(pieces) - 1), fail=False)
+                last = n == len(pieces) - 1
+                yield self.client.response(contents, config, piece, usage=last)
+
+        return chunks()
+
+
+class _FakeFiles:
+    def __init__(self):
+        self.names = set()
+
+    def get(self, name):
+        return type("File", (), {"name": name})()
+
+    def upload(self, file):
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        self.names.add(name)
+        return type("File", (), {"name": name})()
+
+
+class _FakeCaches:
+    def __init__(self, client):
+        self.client = client
+        self.counter = itertools.count()
+
+    def create(self, model, config):
+        name = f"cachedContents/fake-{next(self.counter)}"
+        self.client.cache_stages[name] = (config.display_name or "").split("-")[0]
+        return type("CachedContent", (), {"name": name})()
+
+    def update(self, name, config):
+        return type("CachedContent", (), {"name": name})()
+
+    def delete(self, name):
+        self.client.cache_stages.pop(name, None)
+
+
+class FakeGeminiClient:
+    """
+    Stand-in for genai.Client for benchmarks: models.generate_content(_stream), files and caches.
+
+    Each call sleeps for a lognormal latency drawn from `latency[stage]` (median seconds, sigma),
+    scaled by `latency_scale` and by MODEL_SPEED for the routed model, fails with a retryable 503
+    at `error_rate`, honours the per-attempt http_options timeout, and returns canned text that
+    passes the draft checks and JSON extraction.
+    The stage is recognised from the context-cache display name or from `system_stages`, a list of
+    (system instruction prefix, stage) pairs; anything else counts as "draft". With `unique`, every
+    response is different.
+    """
+
+    def __init__(self, latency=None, latency_scale=1.0, error_rate=0.0, seed=None, system_stages=None, unique=False):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self.system_stages = system_stages or []
+        self.cache_stages = {}
+        self.unique = unique
+        self.serials = itertools.count(1)
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.models = _FakeModels(self)
+        self.files = _FakeFiles()
+        self.caches = _FakeCaches(self)
+
+    def stage_for(self, config):
+        if config is None:
+            return "draft"
+        if getattr(config, "cached_content", None):
+            return self.cache_stages.get(config.cached_content, "draft")
+        instruction = config.system_instruction
+        if isinstance(instruction, list):
+            instruction = instruction[0] if instruction else ""
+        for prefix, stage in self.system_stages:
+            if str(instruction).startswith(prefix):
+                return stage
+        return "draft"
+
+    def wait(self, stage, model, config, fraction=1.0, fail=True):
+        median, sigma = self.latency.get(stage, DEFAULT_LATENCY["draft"])
+        median *= MODEL_SPEED.get(model, 1.0)
+        with self.rng_lock:
+            delay = self.rng.lognormvariate(math.log(median * self.latency_scale), sigma) * fraction
+            failed = fail and self.rng.random() < self.error_rate
+        timeout = getattr(getattr(config, "http_options", None), "timeout", None)
+        if timeout is not None and delay > timeout / 1000:
+            time.sleep(timeout / 1000)
+            raise TimeoutError(f"fake {stage} call timed out")
+        time.sleep(delay)
+        if failed:
+            raise FakeAPIError(503)
+
+    def text(self, config):
+        return canned_text(config, next(self.serials) if self.unique else None)
+
+    def response(self, contents, config, text, usage=True):
+        prompt_tokens = len(json.dumps(contents, default=str)) // 4
+        if config is not None and config.system_instruction:
+            prompt_tokens += len(str(config.system_instruction)) // 4
+        cached = getattr(config, "cached_content", None)
+        if cached:
+            # Like the real API, prompt_token_count includes the cached prefix
+            prompt_tokens += 4096
+        usage_metadata = None
+        if usage:
+            usage_metadata = GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=len(text) // 4,
+                cached_content_token_count=4096 if cached else None,
+                total_token_count=prompt_tokens + len(text) // 4,
+            )
+        return GenerateContentResponse(
+            candidates=[Candidate(content=Content(role="model", parts=[Part(text=text)]), finish_reason="STOP")],
+            usage_metadata=usage_metadata,
+        )
+
+
+def _stored(data, commit_time):
+    """A copy of `data` as Firestore would store it: SERVER_TIMESTAMP fields become the commit time."""
+    return {key: commit_time if value is SERVER_TIMESTAMP else copy.deepcopy(value) for key, value in data.items()}
+
+
+WriteResult = collections.namedtuple("WriteResult", "update_time")
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocumentReference:
+    def __init__(self, store, parts):
+        self.store = store
+        self.parts = parts
+        self.id = parts[-1]
+
+    @property
+    def path(self):
+        return "/".join(self.parts)
+
+    def collection(self, name):
+        return FakeCollectionReference(self.store, self.parts + (name,))
+
+    def collections(self):
+        return [FakeCollectionReference(self.store, self.parts + (name,)) for name in self.store.children(self.parts)]
+
+    def get(self):
+        with self.store.lock:
+            return FakeDocumentSnapshot(self, self.store.documents.get(self.parts))
+
+    def set(self, data, merge=False):
+        with self.store.lock:
+            existing = self.store.documents.get(self.parts) if merge else None
+            self.store.documents[self.parts] = {**(existing or {}), **_stored(data, datetime.now(timezone.utc))}
+        self.store.notify()
+
+    def update(self, data):
+        with self.store.lock:
+            if self.parts not in self.store.documents:
+                raise KeyError(f"No document to update: {'/'.join(self.parts)}")
+            self.store.documents[self.parts].update(_stored(data, datetime.now(timezone.utc)))
+        self.store.notify()
+
+    def delete(self):
+        with self.store.lock:
+            self.store.documents.pop(self.parts, None)
+        self.store.notify()
+
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+def _matches(op, a, b):
+    # Firestore compares values of different types by type order, so e.g. a string never matches a range on a timestamp
+    try:
+        return _OPERATORS[op](a, b)
+    except TypeError:
+        return False
+
+
+ChangeType = enum.Enum("ChangeType", "ADDED MODIFIED REMOVED")
+FakeDocumentChange = collections.namedtuple("FakeDocumentChange", "type document")
+
+
+class FakeWatch:
+    """An on_snapshot listener: after every write, calls back with the query's added, modified and removed documents."""
+
+    def __init__(self, store, query, callback):
+        self.store = store
+        self.query = query
+        self.callback = callback
+        self.seen = {}
+        self.started = False
+        self.lock = threading.Lock()
+
+    def deliver(self):
+        with self.lock:
+            docs = list(self.query.stream())
+            current = {doc.id: doc for doc in docs}
+            changes = [
+                FakeDocumentChange(ChangeType.ADDED if doc_id not in self.seen else ChangeType.MODIFIED, doc)
+                for doc_id, doc in current.items() if self.seen.get(doc_id) != doc.to_dict()
+            ]
+            changes += [
+                FakeDocumentChange(ChangeType.REMOVED, FakeDocumentSnapshot(FakeDocumentReference(self.store, self.query.parts + (doc_id,)), data))
+                for doc_id, data in self.seen.items() if doc_id not in current
+            ]
+            self.seen = {doc_id: doc.to_dict() for doc_id, doc in current.items()}
+            # The first snapshot is delivered even when empty
+            if changes or not self.started:
+                self.started = True
+                self.callback(docs, changes, datetime.utcnow())
+
+    @property
+    def is_active(self):
+        with self.store.lock:
+            return self in self.store.watches
+
+    def unsubscribe(self):
+        self.store.unwatch(self)
+
+
+class FakeQuery:
+    """
+    where (positional or filter=FieldFilter), order_by, limit, start_at, start_after, end_before and
+    select over one collection. Like Firestore, `__name__` orders by the full document path.
+    """
+
+    def __init__(self, store, parts, filters=(), orders=(), limit_count=None, cursor=None, end=None, fields=None, all_descendants=False):
+        self.store = store
+        self.parts = parts
+        self.all_descendants = all_descendants
+        self.filters = filters
+        self.orders = orders
+        self.limit_count = limit_count
+        self.cursor = cursor  # (document fields, inclusive)
+        self.end = end  # (document fields, inclusive)
+        self.fields = fields
+
+    def _copy(self, **changes):
+        options = {
+            "filters": self.filters, "orders": self.orders, "limit_count": self.limit_count,
+            "cursor": self.cursor, "end": self.end, "fields": self.fields, "all_descendants": self.all_descendants, **changes,
+        }
+        return FakeQuery(self.store, self.parts, **options)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self.filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self.orders + ((field_path, direction == "DESCENDING"),))
+
+    def limit(self, count):
+        return self._copy(limit_count=count)
+
+    def _cursor_fields(self, document_fields):
+        if isinstance(document_fields, FakeDocumentSnapshot):
+            return {"__name__": document_fields.reference, **document_fields.to_dict()}
+        return document_fields
+
+    def start_at(self, document_fields):
+        return self._copy(cursor=(self._cursor_fields(document_fields), True))
+
+    def start_after(self, document_fields):
+        return self._copy(cursor=(self._cursor_fields(document_fields), False))
+
+    def end_before(self, document_fields):
+        return self._copy(end=(self._cursor_fields(document_fields), False))
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def _key(self, path, data):
+        return tuple(path if field == "__name__" else data.get(field) for field, _ in self.orders)
+
+    def _cursor_key(self, document_fields):
+        def value(field):
+            if field != "__name__":
+                return document_fields.get(field)
+            # A document reference (sync or async), as the real client wants, or a bare id in this collection
+            name = document_fields[field]
+            reference = getattr(name, "reference", name)
+            return reference.parts if hasattr(reference, "parts") else self.parts + (name,)
+        return tuple(value(field) for field, _ in self.orders)
+
+    def _contains(self, path):
+        if self.all_descendants:
+            # A collection group: every collection with this id, wherever it is nested
+            return len(path) % 2 == 0 and path[-2] == self.parts[-1]
+        return len(path) == len(self.parts) + 1 and path[:-1] == self.parts
+
+    def stream(self):
+        with self.store.lock:
+            documents = [
+                (path, data) for path, data in self.store.documents.items()
+                if self._contains(path)
+            ]
+        # Like Firestore, a filter or ordering on a field leaves out documents that lack it
+        used = ({field for field, _, _ in self.filters} | {field for field, _ in self.orders}) - {"__name__"}
+        documents = [
+            (path, data) for path, data in documents
+            if all(field in data for field in used)
+            and all(_matches(op, data[field], value) for field, op, value in self.filters)
+        ]
+        documents.sort(key=lambda item: item[0])
+        for index in reversed(range(len(self.orders))):
+            documents.sort(key=lambda item: self._key(*item)[index], reverse=self.orders[index][1])
+        descending = bool(self.orders) and self.orders[0][1]
+        if self.cursor is not None:
+            cursor, inclusive = self._cursor_key(self.cursor[0]), self.cursor[1]
+            documents = [
+                (path, data) for path, data in documents
+                if (self._key(path, data) == cursor and inclusive)
+                or (self._key(path, data) < cursor if descending else self._key(path, data) > cursor)
+            ]
+        if self.end is not None:
+            end, inclusive = self._cursor_key(self.end[0]), self.end[1]
+            documents = [
+                (path, data) for path, data in documents
+                if (self._key(path, data) == end and inclusive)
+                or (self._key(path, data) > end if descending else self._key(path, data) < end)
+            ]
+        if self.limit_count is not None:
+            documents = documents[:self.limit_count]
+        for path, data in documents:
+            if self.fields is not None:
+                data = {field: data[field] for field in self.fields if field in data}
+            yield FakeDocumentSnapshot(FakeDocumentReference(self.store, path), data)
+
+    def get(self):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        return self.store.watch(self, callback)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, store, parts):
+        super().__init__(store, parts)
+        self.id = parts[-1]
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self.store, self.parts + (document_id or uuid.uuid4().hex,))
+
+    def add(self, data):
+        reference = self.document()
+        reference.set(data)
+        return time.time(), reference
+
+
+class FakeWriteBatch:
+    """Applies its writes together on commit() and notifies listeners once, like one batched round trip."""
+
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+
+    def set(self, reference, data, merge=False):
+        self.writes.append((reference, data, merge))
+
+    def delete(self, reference):
+        self.writes.append((reference, None, False))
+
+    def commit(self):
+        with self.store.lock:
+            commit_time = datetime.now(timezone.utc)
+            for reference, data, merge in self.writes:
+                if data is None:
+                    self.store.documents.pop(reference.parts, None)
+                    continue
+                existing = self.store.documents.get(reference.parts) if merge else None
+                self.store.documents[reference.parts] = {**(existing or {}), **_stored(data, commit_time)}
+            self.store.commits += 1
+        self.store.notify()
+        return [WriteResult(commit_time) for _ in self.writes]
+
+
+class FakeFirestore:
+    """
+    In-memory stand-in for firestore.Client covering the calls this app makes: nested
+    collection/document references, set/update/delete/add, batches, stream, simple and
+    collection-group queries, on_snapshot listeners, and listing subcollections.
+    Like Firestore, a document with subcollections need not exist itself.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.documents = {}
+        self.watches = []
+        self.commits = 0
+
+    def watch(self, query, callback):
+        watch = FakeWatch(self, query, callback)
+        with self.lock:
+            self.watches.append(watch)
+        watch.deliver()
+        return watch
+
+    def unwatch(self, watch):
+        with self.lock:
+            if watch in self.watches:
+                self.watches.remove(watch)
+
+    def notify(self):
+        # Called after the write's lock is released, like real listeners that fire on another thread
+        with self.lock:
+            watches = list(self.watches)
+        for watch in watches:
+            watch.deliver()
+
+    def collection(self, name):
+        return FakeCollectionReference(self, (name,))
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def collection_group(self, collection_id):
+        return FakeQuery(self, (collection_id,), all_descendants=True)
+
+    def children(self, path):
+        with self.lock:
+            return sorted({p[len(path)] for p in self.documents if len(p) > len(path) + 1 and p[:len(path)] == path})
+
+    def load_snapshots(self, questions_file="questions_data.json", feedback_file="feedback.json"):
+        """Seeds the store from the local questions/feedback JSON snapshots."""
+        with open(questions_file, "r") as f:
+            questions_data = json.load(f)
+        for test, sections in questions_data.items():
+            for section, questions in sections.items():
+                for question in questions:
+                    self.collection("questions").document(test).collection(section).document(question.get("id")).set(question)
+        try:
+            with open(feedback_file, "r") as f:
+                feedback_data = json.load(f)
+        except FileNotFoundError:
+            feedback_data = {}
+        for section, questions in feedback_data.items():
+            for question_id, entries in questions.items():
+                question_ref = self.collection("feedback").document("SAT").collection(section).document(question_id)
+                question_ref.set({"question_id": question_id})
+                for entry in entries:
+                    question_ref.collection("entries").document().set(entry)  # entry "id" is the question id
+
+
+class FakeAsyncQuery:
+    """AsyncClient-style wrapper over a fake query: the same builder methods, with an async stream()."""
+
+    def __init__(self, query):
+        self.query = query
+
+    def where(self, *args, **kwargs):
+        return FakeAsyncQuery(self.query.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return FakeAsyncQuery(self.query.order_by(*args, **kwargs))
+
+    def limit(self, count):
+        return FakeAsyncQuery(self.query.limit(count))
+
+    def start_at(self, document_fields):
+        return FakeAsyncQuery(self.query.start_at(document_fields))
+
+    def start_after(self, document_fields):
+        return FakeAsyncQuery(self.query.start_after(document_fields))
+
+    def end_before(self, document_fields):
+        return FakeAsyncQuery(self.query.end_before(document_fields))
+
+    def select(self, field_paths):
+        return FakeAsyncQuery(self.query.select(field_paths))
+
+    async def stream(self):
+        for doc in self.query.stream():
+            yield doc
+
+
+class FakeAsyncCollectionReference(FakeAsyncQuery):
+    def __init__(self, collection):
+        super().__init__(collection)
+        self.id = collection.id
+
+    def document(self, document_id=None):
+        return FakeAsyncDocumentReference(self.query.document(document_id))
+
+
+class FakeAsyncDocumentReference:
+    def __init__(self, reference):
+        self.reference = reference
+        self.id = reference.id
+
+    def collection(self, name):
+        return FakeAsyncCollectionReference(self.reference.collection(name))
+
+    async def collections(self):
+        for collection in self.reference.collections():
+            yield FakeAsyncCollectionReference(collection)
+
+    async def get(self):
+        return self.reference.get()
+
+    async def set(self, data, merge=False):
+        self.reference.set(data, merge=merge)
+
+    async def delete(self):
+        self.reference.delete()
+
+
+class FakeAsyncWriteBatch:
+    def __init__(self, store):
+        self.batch = FakeWriteBatch(store)
+
+    def set(self, reference, data, merge=False):
+        self.batch.set(reference.reference, data, merge=merge)
+
+    def delete(self, reference):
+        self.batch.delete(reference.reference)
+
+    async def commit(self):
+        return self.batch.commit()
+
+
+class FakeAsyncFirestore:
+    """firestore.AsyncClient over the same in-memory store as a FakeFirestore."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def collection(self, name):
+        return FakeAsyncCollectionReference(self.store.collection(name))
+
+    def batch(self):
+        return FakeAsyncWriteBatch(self.store)
+
+    def collection_group(self, collection_id):
+        return FakeAsyncQuery(self.store.collection_group(collection_id))
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.public_url = f"https://storage.invalid/{bucket.name}/{name}"
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.blobs[self.name] = data
+
+    def make_public(self):
+        pass
+
+
+class FakeBucket:
+    def __init__(self, name="fake-bucket"):
+        self.name = name
+        self.blobs = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+
+def install(gemini_client, firestore_client, bucket):
+    """
+    Points google.genai, firebase_admin and OpenAI construction at the given fakes. Must run before
+    gen/app are imported, since they create their clients and load Firestore at import time.
+    With `gemini_client=None` the real Gemini client is kept.
+    """
+    import firebase_admin
+    import openai
+    from firebase_admin import credentials, firestore, firestore_async, storage
+    from google import genai
+
+    if gemini_client is not None:
+        genai.Client = lambda *args, **kwargs: gemini_client
+    openai.OpenAI = lambda *args, **kwargs: None
+    credentials.Certificate = lambda *args, **kwargs: None
+
+    def initialize_app(*args, **kwargs):
+        firebase_admin._apps.setdefault("[DEFAULT]", object())
+
+    firebase_admin.initialize_app = initialize_app
+    firestore.client = lambda *args, **kwargs: firestore_client
+    firestore_async.client = lambda *args, **kwargs: FakeAsyncFirestore(firestore_client)
+    storage.bucket = lambda *args, **kwargs: bucket
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+
+from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+# Firestore's limit on writes per batch commit
+MAX_BATCH_WRITES = 500
+
+
+def firestore_write(path, data, merge=False, server_timestamps=()):
+    """
+    A set() of `data` at `path` (alternating collection and document ids), in a JSON-serializable form.
+    The `server_timestamps` fields are set to the commit time by Firestore, however late the write is committed.
+    """
+    return {"path": list(path), "data": data, "merge": merge, "server_timestamps": list(server_timestamps)}
+
+
+def firestore_delete(path):
+    return {"path": list(path), "delete": True}
+
+
+def document_ref(db, path):
+    ref = db
+    for n, name in enumerate(path):
+        ref = ref.collection(name) if n % 2 == 0 else ref.document(name)
+    return ref
+
+
+async def commit_writes(db, writes):
+    """
+    Commits `writes` in as few batches as the per-batch limit allows; each batch is atomic.
+    Returns the update time of each write, in order.
+    """
+    update_times = []
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for write in writes[start:start + MAX_BATCH_WRITES]:
+            if write.get("delete"):
+                batch.delete(document_ref(db, write["path"]))
+            else:
+                data = {**write["data"], **{field: SERVER_TIMESTAMP for field in write.get("server_timestamps", ())}}
+                batch.set(document_ref(db, write["path"]), data, merge=write["merge"])
+        update_times += [result.update_time for result in await batch.commit()]
+    return update_times
+
+
+async def delete_documents(db, path, field, before):
+    """Deletes the documents of the collection at `path` whose `field` is before `before`; returns how many."""
+    query = document_ref(db, path).where(filter=FieldFilter(field, "<", before))
+    paths = [(*path, doc.id) async for doc in query.stream()]
+    await commit_writes(db, [firestore_delete(document_path) for document_path in paths])
+    return len(paths)
+
+
+async def collection_ids(db, path):
+    """Ids of the subcollections of the document at `path`."""
+    return [collection.id async for collection in document_ref(db, path).collections()]
+
+
+async def stream_documents(db, path, since_field=None, since=None):
+    """[(id, data)] for the collection at `path`, or only its documents with `since_field` >= `since`."""
+    query = document_ref(db, path)
+    if since is not None:
+        query = query.where(filter=FieldFilter(since_field, ">=", since))
+    return [(doc.id, doc.to_dict()) async for doc in query.stream()]
+
+
+async def stream_collection_group(db, collection_id, parent=()):
+    """
+    [(path, data)] for the documents of every collection named `collection_id` under the document at
+    `parent`, in one query. Paths are tuples of alternating collection and document ids.
+    """
+    query = db.collection_group(collection_id)
+    if parent:
+        # Document names sort segment by segment, so everything under `parent` sorts after it and before
+        # the same path with a NUL appended to its last id; the range is applied by the server
+        end = (*parent[:-1], parent[-1] + "\0")
+        query = (
+            query.order_by("__name__")
+            .start_at({"__name__": document_ref(db, parent)})
+            .end_before({"__name__": document_ref(db, end)})
+        )
+    return [(tuple(doc.reference.path.split("/")), doc.to_dict()) async for doc in query.stream()]
+
+
+class FirestoreStore:
+    """
+    The app's Firestore data access, on one google.cloud.firestore AsyncClient. The client lives on a
+    private event loop thread, so its connections are reused by every caller. Operations are
+    coroutine functions taking the client as their first argument. Request handlers
+    `await store.run(op, ...)` without blocking the server's event loop, and worker threads and
+    import-time code use the blocking `store.call(op, ...)`.
+    """
+
+    def __init__(self, client_factory):
+        self.client_factory = client_factory  # e.g. firebase_admin.firestore_async.client
+        self.lock = threading.Lock()
+        self.loop = None
+        self.client = None
+
+    async def _create_client(self):
+        # Created on the store's loop, which its channels are bound to
+        return self.client_factory()
+
+    def _start(self):
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="firestore-store", daemon=True).start()
+                self.client = asyncio.run_coroutine_threadsafe(self._create_client(), loop).result()
+                self.loop = loop
+        return self.loop
+
+    def submit(self, op, *args):
+        """Schedules `op(client, *args)` on the store's loop; returns a concurrent.futures.Future."""
+        loop = self.loop or self._start()
+        return asyncio.run_coroutine_threadsafe(op(self.client, *args), loop)
+
+    def call(self, op, *args):
+        return self.submit(op, *args).result()
+
+    def run(self, op, *args):
+        return asyncio.wrap_future(self.submit(op, *args))
@@ -78,6 +78,8 @@ const FirebaseQuestionReview = ({
       if (selectedDomain) params.append('domain', selectedDomain);
       if (selectedSkillCategory) params.append('skill_category', selectedSkillCategory);
       if (selectedDifficulty) params.append('difficulty', selectedDifficulty);
+      // The review page lists every match, rather than the API's default first page
+      params.append('all', 'true');
 
       const response = await axios.get(`http://localhost:8000/firebase-questions?${params}`);
       setQuestions(response.data.questions || []);
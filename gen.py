@@ -1,21 +1,34 @@
 from openai import OpenAI
 from google import genai
-from google.genai.types import GenerateContentConfig
+from google.genai.types import Candidate, Content, GenerateContentConfig, GenerateContentResponse, HttpOptions, Part
 import sys
 import argparse
 import random
 import os
-import re
 import json
 from datetime import datetime
 import uuid
 import firebase_admin
-from firebase_admin import credentials, firestore, storage
+from firebase_admin import credentials, firestore, firestore_async, storage
 import logging
 import atexit
+import contextvars
 import random
 import tempfile
 import subprocess
+import time
+from rate_limit import GeminiRateLimiter
+from resilience import ResilientCaller, StagePolicy
+from llm_cache import LLMCache, file_sha256
+from context_cache import ContextCacheManager
+from models import StructuredQuestion
+from json_extract import extract_json
+from draft_checks import DraftRejected, gate_checks, gate_score, stream_check_for
+from prompt_context import PromptContextCache
+from metrics import StageMetrics, labelled
+from model_routing import ModelRouter, estimate_cost, routed
+from question_sync import QuestionSync, utc_now
+from firestore_store import FirestoreStore, commit_writes, firestore_write, stream_collection_group
 
 all_questions = []
 
@@ -25,7 +38,182 @@ chatgpt_client = OpenAI(api_key=openai_api_key)
 gemini_api_key = os.environ["GEMINI_API_KEY"]
 gemini_client = genai.Client(api_key=gemini_api_key)
 
-GEMINI_MODEL = "gemini-2.5-pro"
+# Model, temperature and thinking budget per stage: GEMINI_ROUTING_PROFILE=quality|balanced|economy,
+# GEMINI_ROUTES='{"format": {"model": "gemini-2.5-flash-lite"}}', or per request
+model_router = ModelRouter.from_env()
+
+# "format": draft -> ai_feedback -> revision (prose) -> format (prose to JSON)
+# "structured": the revision call returns schema-constrained JSON and the format call is skipped
+PIPELINE_MODES = ("format", "structured")
+DEFAULT_PIPELINE_MODE = os.getenv("PIPELINE_MODE", "format")
+
+# Shared across every stage and thread so a large batch queues instead of bursting into 429s
+rate_limiter = GeminiRateLimiter(
+    requests_per_minute=float(os.getenv("GEMINI_RPM", "150")),
+    tokens_per_minute=float(os.getenv("GEMINI_TPM", "2000000")),
+)
+
+# Per-attempt deadlines per stage. Hedging is opt-in, e.g. GEMINI_HEDGE_STAGES=format,draft
+hedge_stages = set(filter(None, os.getenv("GEMINI_HEDGE_STAGES", "").split(",")))
+stage_timeouts = {
+    "draft": 180,
+    "ai_feedback": 240,
+    "revision": 240,
+    "format": 120,
+    "evaluate": 120,
+    "refine": 180,
+    "human_feedback": 240,
+}
+# Latency, token and retry metrics per stage, section, skill and difficulty; served on /metrics
+stage_metrics = StageMetrics()
+resilient_caller = ResilientCaller(
+    policies={stage: StagePolicy(timeout=timeout, hedge=stage in hedge_stages) for stage, timeout in stage_timeouts.items()},
+    limiter=rate_limiter,
+    observer=stage_metrics.count_event,
+)
+
+# LLM_CACHE_MODE=record captures every response; replay serves a whole run from disk without calling Gemini
+source_file_hashes = {}
+llm_cache = LLMCache(
+    directory=os.getenv("LLM_CACHE_DIR", ".llm_cache"),
+    mode=os.getenv("LLM_CACHE_MODE", "off"),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    resolve_file=source_file_hashes.get,
+)
+
+# Static prompt prefixes (system prompt, source file, reference prompt) are cached server-side per
+# (stage, section, domain, skill, difficulty) so repeated questions in a skill don't resend them
+context_caches = ContextCacheManager(
+    gemini_client,
+    ttl_seconds=int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600")),
+    enabled=os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1",
+)
+atexit.register(context_caches.close)
+
+# With a seed, exemplar sampling and answer letters are deterministic, so a recorded run
+# builds exactly the same prompts when it is replayed.
+LLM_CACHE_SEED = os.getenv("LLM_CACHE_SEED")
+
+# Index of the work item whose stage is running, so questions of the same skill and difficulty in one
+# batch sample their own exemplars and get their own LLM cache entries
+current_item = contextvars.ContextVar("current_item", default=None)
+
+
+def seeded_random(*parts):
+    """
+    Returns an RNG seeded from LLM_CACHE_SEED, `parts` and the current work item if a seed is set,
+    otherwise the shared `random` module.
+    """
+    if LLM_CACHE_SEED is None:
+        return random
+    item = current_item.get()
+    if item is not None:
+        parts = (*parts, f"item{item}")
+    return random.Random(":".join([LLM_CACHE_SEED, *map(str, parts)]))
+
+
+# Draft and revision calls stream and are cancelled as soon as a local check fails
+STREAM_CHECKS = os.getenv("GEMINI_STREAM_CHECKS", "1") == "1"
+
+# Early-exit gate: drafts scoring at least EARLY_EXIT_MIN_SCORE on the local validators skip the
+# AI critique and revision. Off unless EARLY_EXIT=1 or the request asks for it.
+EARLY_EXIT = os.getenv("EARLY_EXIT", "0") == "1"
+EARLY_EXIT_MIN_SCORE = float(os.getenv("EARLY_EXIT_MIN_SCORE", "1.0"))
+EARLY_EXIT_MAX_SIMILARITY = float(os.getenv("EARLY_EXIT_MAX_SIMILARITY", "0.6"))
+
+
+def stream_content(stage, model, contents, config, check):
+    """
+    Streams a response, running `check(text, final)` on the text so far after every chunk and
+    cancelling the stream as soon as it returns a reason. Returns a response shaped like the
+    one generate_content would have returned.
+    """
+    text = ""
+    last_chunk = None
+    stream = gemini_client.models.generate_content_stream(model=model, contents=contents, config=config)
+    try:
+        for chunk in stream:
+            last_chunk = chunk
+            text += chunk.text or ""
+            reason = check(text, False)
+            if reason:
+                print(f"{stage} stream cancelled after {len(text)} chars: {reason}")
+                raise DraftRejected(stage, reason)
+    finally:
+        stream.close()
+    if last_chunk is None:
+        raise DraftRejected(stage, "empty response")
+    reason = check(text, True)
+    if reason:
+        raise DraftRejected(stage, reason)
+
+    response = last_chunk.model_copy(deep=True)
+    finish_reason = last_chunk.candidates[0].finish_reason if last_chunk.candidates else None
+    response.candidates = [Candidate(content=Content(role="model", parts=[Part(text=text)]), finish_reason=finish_reason)]
+    return response
+
+
+def generate_content(stage, contents, config, model=None, prefix=None, prefix_key=None, stream_check=None):
+    """
+    Single entry point for Gemini calls. Responses can be served from / recorded to the LLM cache;
+    live attempts wait for the shared rate limiter, are bounded by the stage deadline,
+    and are retried with backoff on transient errors.
+
+    `prefix` is the static leading part of the contents. With a `prefix_key`, the system instruction
+    and prefix are sent as a Gemini context cache and only the remaining contents go with the request.
+
+    `stream_check(text, final)`, if given, makes the call stream; a returned reason cancels it and
+    the attempt is retried immediately.
+
+    The model, temperature and thinking budget come from the stage's route unless `model` is given.
+    """
+    route = model_router.route(stage)
+    model = model or route.model
+    config = route.apply(config)
+    full_contents = prefix + contents if prefix else contents
+    cache_key = None
+    if llm_cache.enabled:
+        cache_key = llm_cache.key(
+            model, config.system_instruction, full_contents, config.temperature,
+            config.response_schema, config.response_mime_type, config.thinking_config, current_item.get(),
+        )
+        cached = llm_cache.lookup(cache_key)
+        if cached is not None:
+            print(f"{stage} served from LLM cache ({cache_key[:12]})")
+            stage_metrics.count_event(stage, "llm_cache_hits")
+            return GenerateContentResponse.model_validate(cached)
+
+    cached_content = None
+    if prefix and prefix_key:
+        cached_content = context_caches.get((stage, *prefix_key), model, config.system_instruction, prefix)
+
+    def request(request_contents, request_config):
+        if stream_check and STREAM_CHECKS:
+            return stream_content(stage, model, request_contents, request_config, stream_check)
+        return gemini_client.models.generate_content(model=model, contents=request_contents, config=request_config)
+
+    def send(timeout):
+        # The client-side timeout makes sure an abandoned attempt doesn't hold a thread forever
+        http_options = HttpOptions(timeout=int(timeout * 1000))
+        if cached_content:
+            try:
+                cached_config = config.model_copy(update={"http_options": http_options, "cached_content": cached_content, "system_instruction": None})
+                return request(contents, cached_config)
+            except Exception as e:
+                if getattr(e, "code", None) not in (400, 403, 404):
+                    raise
+                print(f"{stage} context cache {cached_content} rejected ({e}), sending the full prompt")
+                context_caches.invalidate(cached_content)
+        attempt_config = config.model_copy(update={"http_options": http_options})
+        return request(full_contents, attempt_config)
+
+    started = time.monotonic()
+    response = resilient_caller.call(stage, send)
+    stage_metrics.record_call(stage, time.monotonic() - started, response.usage_metadata, model, estimate_cost(model, response.usage_metadata))
+    print(f"{stage} metadata: {response.usage_metadata}")
+    if cache_key:
+        llm_cache.store(cache_key, response.model_dump(mode="json", exclude_none=True))
+    return response
 
 '''parser = argparse.ArgumentParser(description="tool to generate questions for RocketPrepAI")
 parser.add_argument("--domains", nargs="+", choices=["all", "craft_and_structure", "information_and_ideas", "standard_english_conventions", "expression_of_ideas"], default="all")
@@ -40,7 +228,8 @@ firebase_admin.initialize_app(cred, {
     "storageBucket": "rocketprepai.firebasestorage.app"
 })
 
-db = firestore.client()
+# Shared AsyncClient-backed data access; the API awaits it, blocking code here calls through it
+question_store = FirestoreStore(firestore_async.client)
 bucket = storage.bucket()
 
 base_user_prompt = "Please generate a question, where the correct answer is {random_choice} and the difficulty is {difficulty}"
@@ -48,10 +237,10 @@ base_user_prompt = "Please generate a question, where the correct answer is {ran
 
 
 
-def load_questions_from_firebase(json_file="questions_data.json"):
+def load_questions_from_firebase():
     """
-    Loads all questions from Firebase, saves them to a JSON file,
-    and returns the questions as a list of dictionaries.
+    Brings the question bank up to date with Firebase and returns it. Only questions changed or
+    deleted since the last sync are read (see question_sync); questions_data.json is kept in step.
     """
     try:
         # Initialize Firebase Admin SDK (if not already initialized)
@@ -59,27 +248,7 @@ def load_questions_from_firebase(json_file="questions_data.json"):
             cred = credentials.Certificate("serviceAccountKey.json")
             firebase_admin.initialize_app(cred)
 
-        db = firestore.client()
-        questions_ref = db.collection("questions").document("SAT")
-        questions_collections = questions_ref.collections()
-
-        questions_docs = {}
-
-        all_questions = {}
-        for questions_collection in questions_collections:
-            questions_docs = questions_collection.stream()
-            for question_doc in questions_docs:
-                question_data = question_doc.to_dict()
-                print(question_data["id"])
-                all_questions.setdefault("SAT", {}).setdefault(questions_collection.id, []).append(question_data)
-
-
-        # Save the questions to a JSON file
-        with open(json_file, "w") as f:
-            json.dump(all_questions, f, indent=4)
-
-        print(f"Successfully loaded {len(all_questions)} questions from Firebase and saved to {json_file}")
-        return all_questions
+        return question_sync.sync()
 
     except Exception as e:
         print(f"Error loading questions from Firebase: {e}")
@@ -94,32 +263,14 @@ def load_feedback_from_firebase(json_file="feedback.json"):
             cred = credentials.Certificate("serviceAccountKey.json")
             firebase_admin.initialize_app(cred)
 
-        db = firestore.client()
-
-        feedback_ref = db.collection("feedback").document("SAT")
+        # Every feedback entry in one collection-group query, rather than a stream per reviewed question
+        entries = question_store.call(stream_collection_group, "entries", ("feedback", "SAT"))
 
         all_feedback = {}
-
-        # List all section-level subcollections (e.g., "reading_and_writing")
-        section_collections = feedback_ref.collections()
-
-        for section_collection in section_collections:
-            section_id = section_collection.id
-            print(f"Processing section: {section_id}")
-            all_feedback[section_id] = {}
-
-            # Each document here represents a question_id
-            question_docs = section_collection.stream()
-            for question_doc in question_docs:
-                question_id = question_doc.id
-                print(f"Processing question ID: {question_id}")
-                entries_ref = section_collection.document(question_id).collection("entries")
-                entries = entries_ref.stream()
-
-                all_feedback[section_id][question_id] = []
-                for entry in entries:
-                    entry_data = entry.to_dict()
-                    all_feedback[section_id][question_id].append(entry_data)
+        for path, entry_data in entries:
+            # feedback/SAT/{section}/{question_id}/entries/{entry_id}
+            section_id, question_id = path[2], path[3]
+            all_feedback.setdefault(section_id, {}).setdefault(question_id, []).append(entry_data)
 
         # Save to file
         with open(json_file, "w") as f:
@@ -181,6 +332,7 @@ def update_local_questions_data(new_question, json_file="pending_questions.json"
             return [] # Return empty list if even recovery fails
         return []
 
+question_sync = QuestionSync(question_store, firestore.client)
 all_questions = load_questions_from_firebase()
 
 all_feedback = load_feedback_from_firebase()
@@ -295,6 +447,12 @@ def load_sources():
     with open(SOURCES_FILE, "w") as f:
         json.dump(sources_data, f, indent=4)
 
+    # Cache keys refer to sources by content hash rather than by (re-uploadable) file ID
+    if llm_cache.enabled:
+        for filepath, file_id in sources_data.items():
+            if os.path.exists(filepath):
+                source_file_hashes[file_id] = file_sha256(filepath)
+
     return sources_nested
 
                     
@@ -488,7 +646,7 @@ def get_questions_by_difficulty(questions_data, section, skill_category, target_
     
     # Apply limit with random selection if specified and exceeded
     if limit is not None and len(domain_questions) > limit:
-        domain_questions = random.sample(domain_questions, limit)
+        domain_questions = seeded_random("questions", section, skill_category, target_difficulty, limit).sample(domain_questions, limit)
     
     return domain_questions
 
@@ -522,35 +680,54 @@ def get_feedback_by_difficulty(feedback_data, section, difficulty, limit=15):
     
     # Apply limit with random selection if specified and exceeded
     if limit is not None and len(difficulty_feedback) > limit:
-        difficulty_feedback = random.sample(difficulty_feedback, limit)
+        difficulty_feedback = seeded_random("feedback", section, difficulty, limit).sample(difficulty_feedback, limit)
     
     return difficulty_feedback
 
 
+# Exemplar and feedback pools, filtered once per (section, skill, difficulty) on first use and sampled per prompt
+prompt_contexts = PromptContextCache(
+    lambda section, skill_category, difficulty: get_questions_by_difficulty(all_questions, section, skill_category, difficulty, None),
+    lambda section, difficulty: get_feedback_by_difficulty(all_feedback, section, difficulty, None),
+    seeded_random,
+)
+
+
+def _questions_changed(bank):
+    global all_questions
+    all_questions = bank
+    prompt_contexts.invalidate()
+
+
+question_sync.on_change = _questions_changed
+
+# Keep the bank current from Firestore listeners rather than reloading it (QUESTION_LISTENERS=0 to sync on demand)
+if os.environ.get("QUESTION_LISTENERS", "1") == "1":
+    try:
+        question_sync.listen()
+    except Exception as e:
+        print(f"Error attaching question listeners, syncing on demand instead: {e}")
+
+
 def evaluate_question_difficulty(raw_question_data, section, domain, skill_category, difficulty, ref_system_prompt):
     print("# Evaluating difficulty\n")
     evaluation_system_prompt = prompts["evaluation_prompt"]
     evaluation_prompt = f"Please evaluate the difficulty of the following question: {raw_question_data}.\nThe question is from the section {section}, domain {domain}, skill category {skill_category}, and is of difficulty {difficulty}.\n"
     reference_prompt = f"Original system prompt, for reference: {ref_system_prompt}"
     print("evaluating difficulty")
-    all_questions_text = json.dumps(all_questions)
-    difficulty_questions = str(get_questions_by_difficulty(all_questions, str(section), skill_category, str(difficulty), 25))
-    response = gemini_client.models.generate_content(
-        model=GEMINI_MODEL,
+    difficulty_questions = prompt_contexts.get(str(section), skill_category, str(difficulty)).exemplars("evaluate", 25)
+    response = generate_content(
+        "evaluate",
         contents=[evaluation_prompt, difficulty_questions, reference_prompt],
         config=GenerateContentConfig(
             system_instruction=[evaluation_system_prompt]
         )
     )
-    print(f"metadata: {response.usage_metadata}")
     evaluation = response.text
 
     print(evaluation)
-    evaluation = re.search(r'\{.*\}', evaluation, re.DOTALL)
-
-    print(evaluation)
-    evaluation_data = json.loads(evaluation.group(0))
-    print(evaluation)
+    evaluation_data = extract_json(evaluation)
+    print(evaluation_data)
     evaluation = str(evaluation_data["evaluation"])
     difficulty_ranking = str(evaluation_data["difficulty_ranking"])
     
@@ -562,15 +739,14 @@ def refine_question(raw_question_data, question_evaluation, section, domain, ski
     refine_system_prompt = prompts["refine_prompt"]
     refine_system_prompt = refine_system_prompt.format(section=section, domain=domain, skill_category=skill_category, difficulty=difficulty, evaluation=question_evaluation)
 
-    response = gemini_client.models.generate_content(
-        model=GEMINI_MODEL,
+    response = generate_content(
+        "refine",
         contents=[f"Please refine the following question: {raw_question_data}", f"Reference generation prompt: {ref_system_prompt}"],
         config=GenerateContentConfig(
             system_instruction=[refine_system_prompt]
         )
     )
     print(f"# Refine notes: {response} ")
-    print(f"metadata: {response.usage_metadata}")
     return response.text
 
 def format_question(raw_question_data, section, domain, skill_category, difficulty):
@@ -584,48 +760,41 @@ def format_question(raw_question_data, section, domain, skill_category, difficul
         messages=format_messages
     )'''
 
-    gemini_response = gemini_client.models.generate_content(
-        model=GEMINI_MODEL,
+    gemini_response = generate_content(
+        "format",
         contents=f"Please format this for me: {raw_question_data}.",
         config=GenerateContentConfig(
             system_instruction=[format_prompt]
         ),
     )
     print(f"format question response: {gemini_response.text}")
-    print(f"metadata: {gemini_response.usage_metadata}")
     #response = response.choices[0].message.content
     gemini_response = gemini_response.text
 
-    question = re.search(r'\{.*\}', gemini_response, re.DOTALL)
-    if question:
-        question_json = question.group(0) # changed from question.group(0)
-        print (f"Question json generated: {json.loads(question_json)}")
-        update_local_questions_data(json.loads(question_json))
-        return json.loads(question_json)
-        return question
-    else:
-        raise ValueError("No valid JSON found in response")
+    question = extract_json(gemini_response)
+    print (f"Question json generated: {question}")
+    update_local_questions_data(question)
+    return question
 
 
 
 def generate_ai_feedback(question, section, domain, skill_category, difficulty, ref_system_prompt):
     ai_feedback_system_prompt = prompts["ai_feedback_prompt"]
-    section_questions = str(all_questions["SAT"].get(section, []))
-
-    difficulty_questions = str(get_questions_by_difficulty(all_questions, str(section),  skill_category, str(difficulty)))
-
-    difficulty_feedback = str(get_feedback_by_difficulty(all_feedback, str(section), str(difficulty)))
+    context = prompt_contexts.get(str(section), skill_category, str(difficulty))
+    difficulty_questions = context.exemplars("ai_feedback")
+    difficulty_feedback = context.feedback("ai_feedback")
 
     ref_system_prompt = f"reference system prompt: {ref_system_prompt}. This question should be of difficulty {difficulty}. Do not take an easy question and make it a hard, or vice versa, for example."
-    feedback_response = gemini_client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=[str(question), "feedback:", difficulty_feedback, "other questions that have been generated of this difficulty: ", difficulty_questions, "source questions", sources[section][domain][skill_category][difficulty], ref_system_prompt],
+    feedback_response = generate_content(
+        "ai_feedback",
+        prefix=["source questions", sources[section][domain][skill_category][difficulty], ref_system_prompt],
+        prefix_key=(section, domain, skill_category, difficulty),
+        contents=[str(question), "feedback:", difficulty_feedback, "other questions that have been generated of this difficulty: ", difficulty_questions],
         config=GenerateContentConfig(
             system_instruction=[ai_feedback_system_prompt],
             temperature=1.0
         ),
     )
-    print(f"feedback metadata: {feedback_response.usage_metadata}")
     feedback_response = feedback_response.text
 
     print(feedback_response)
@@ -633,26 +802,50 @@ def generate_ai_feedback(question, section, domain, skill_category, difficulty,
     return feedback_response
 
 
-def get_ai_feedback(question, section, domain, skill_category, difficulty, feedback, ref_system_prompt):
+def get_ai_feedback(question, section, domain, skill_category, difficulty, feedback, ref_system_prompt, structured=False):
+    """
+    Revises the draft using the AI feedback. Returns the revised question as prose, or, with
+    `structured=True`, as a question dict constrained to the StructuredQuestion schema.
+    """
     human_feedback_system_prompt = prompts["human_feedback_prompt"]
-    section_questions = str(all_questions["SAT"].get(section, []))
-    difficulty_questions = str(get_questions_by_difficulty(all_questions, str(section), skill_category, str(difficulty)))
+    difficulty_questions = prompt_contexts.get(str(section), skill_category, str(difficulty)).exemplars("revision")
     ref_system_prompt = f"reference system prompt: {ref_system_prompt}"
     feedback_prompt=f"section: {section}, domain: {domain}, skill_category: {skill_category}, difficulty:{difficulty}. Please ensure that the question remains in the target difficulty {difficulty}. Please ensure response is in proper markdown for formatting, and that you only test concepts that appear in the source questions. You do have more freedom for readining and writing questions however, those should be more diverse"
-    feedback_response = gemini_client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=[feedback_prompt, str(question), str(feedback), difficulty_questions, "source questions: ", sources[section][domain][skill_category][difficulty], ref_system_prompt],
-        config=GenerateContentConfig(
-            system_instruction=[human_feedback_system_prompt],
-            temperature=1.0
-        ),
+    feedback_response = generate_content(
+        "revision",
+        prefix=[feedback_prompt, "source questions: ", sources[section][domain][skill_category][difficulty], ref_system_prompt],
+        prefix_key=(section, domain, skill_category, difficulty),
+        contents=[str(question), str(feedback), difficulty_questions],
+        stream_check=stream_check_for(section),
+        config=revision_config(human_feedback_system_prompt, section, domain, skill_category, difficulty, structured),
     )
 
     feedback_response = feedback_response.text
    
+    if structured:
+        question = json.loads(feedback_response)
+        print(f"Question json generated: {question}")
+        return question
 
     return feedback_response
 
+
+def revision_config(human_feedback_system_prompt, section, domain, skill_category, difficulty, structured):
+    if not structured:
+        return GenerateContentConfig(
+            system_instruction=[human_feedback_system_prompt],
+            temperature=1.0
+        )
+    # The format prompt's field rules (markdown question text, no choices in the question field,
+    # LaTeX only in generation_latex) still apply when the revision writes the JSON itself
+    format_prompt = prompts["format_prompt"].format(section=section, domain=domain, skill_category=skill_category, difficulty=difficulty)
+    return GenerateContentConfig(
+        system_instruction=[human_feedback_system_prompt, format_prompt],
+        temperature=1.0,
+        response_mime_type="application/json",
+        response_schema=StructuredQuestion,
+    )
+
 def generate_and_upload_graphic(generation_latex):
     graphic_id = str(uuid.uuid4())
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -702,7 +895,7 @@ def generate_and_upload_graphic(generation_latex):
 
         return public_url
 
-def generate_question(system_prompt, user_prompt, section, domain, skill_category, difficulty, messages):
+def draft_question(system_prompt, user_prompt, section, domain, skill_category, difficulty, messages):
     print("# Generating Question\n")
     #messages.append({"role": "system", "content": system_prompt})
     #messages.append({"role": "user", "parts": [user_prompt]})
@@ -714,10 +907,6 @@ def generate_question(system_prompt, user_prompt, section, domain, skill_categor
     )
     '''
     special_instructions = "for now, if relevant, for math questions ONLY create questions that require a graph/shapes with the latex graphic generator. This is for question diversity. Do not do this for skill categories that do not contain source questions with graphs or shapes, but if the source questions do contain a question like this, THEN GENERATE ONE OF THOSE !!!!!! For Words in Context problems, MAKE SURE YOU ARE ADHEREING TO THE SOURCES! I SHOULD NOT BE GETTING TEXT STRUCTURE AND PURPOSE QUESTIONS FOR WORDS IN CONTEXT QUESTIONS! BAD BAD BAD!!! ONLY WORDS SHOULD BE THE ANSWER CHOICES FOR WORDS IN CONTEEXT!!!!!\n##The current ones are too wordy, maintain difficulty but be between 25-150 words, and more concise"
-    section_questions = all_questions["SAT"].get(section, [])
-    difficulty_questions = str(get_questions_by_difficulty(all_questions, section, skill_category, difficulty))
-    difficulty_session_questions = str(get_questions_by_difficulty(messages, section, skill_category, difficulty))
-
     if domain == "reading_and_writing":
         #generated_questions = f"Here are the existing questions, including the questions generated during this session and those that are already in the database. Make your next one different than these to ensure question diversity (no copycats!)THis session: {difficulty_session_questions} from database: \n{difficulty_questions}. THESE ARE NOT SOURCE QUESTIONS, THEY ARE PROVIDED ONLY SO YOU CAN ENSURE QUESTION DIVERSITY. DO NOT USE THESE AS REFERENCE TO GENERATE THE QUESTION, EXCEPT FOR GENERAL UNDERSTANDING OF APPROPRIATE STRUCTURE. THE TOPICS SHOULD NOT BE THE SAME"
         generated_questions = ""
@@ -727,11 +916,14 @@ def generate_question(system_prompt, user_prompt, section, domain, skill_categor
 # print(generated_questions)
 
 
-    gemini_response = gemini_client.models.generate_content(
-        model=GEMINI_MODEL,
+    gemini_response = generate_content(
+        "draft",
         #messages = str(messages)
         #print(generated_questions)
-        contents=["Question type:", skill_category, "source questions from CollegeBoard: ", sources[section][domain][skill_category][difficulty], str(generated_questions), user_prompt, f"special instructions: {special_instructions}"],
+        prefix=["Question type:", skill_category, "source questions from CollegeBoard: ", sources[section][domain][skill_category][difficulty]],
+        prefix_key=(section, domain, skill_category, difficulty),
+        contents=[str(generated_questions), user_prompt, f"special instructions: {special_instructions}"],
+        stream_check=stream_check_for(section),
         config=GenerateContentConfig(
             system_instruction=[system_prompt],
             temperature=1.0
@@ -741,31 +933,14 @@ def generate_question(system_prompt, user_prompt, section, domain, skill_categor
     question = gemini_response.text
     print(f"question draft: {question}")
 # print(f"# Question: {question}")
-    print(f"metadata: {gemini_response.usage_metadata}")
 
-# explanations = re.search(r'\{.*\}', explanations_response.text, re.DOTALL)
-    '''
-    if explanations:
-        explanations = explanations.group(0)
-        explanations = json.loads(explanations)
-    else:
-        raise ValueError("No valid JSON found in response")
-    '''
-    #response = response.choices[0].message.content
-    #messages.append({"role": "assistant", "content": response})
-
-    #question = refine_question(question, evaluation, section=section, domain=domain, skill_category=skill_category, difficulty=difficulty, target_difficulty_ranking=target_difficulty_ranking, ref_system_prompt=system_prompt)
-    #evaluation, difficulty_ranking = evaluate_question_difficulty(question, section=section, domain=domain, skill_category=skill_category, difficulty=difficulty, target_difficulty_ranking=target_difficulty_ranking, ref_system_prompt=system_prompt)
-    ai_feedback = generate_ai_feedback(question, section, domain, skill_category, difficulty, system_prompt)
-
-    question = get_ai_feedback(question, section, domain, skill_category, difficulty, ai_feedback, system_prompt)
-
-    
-
-    formatted_response = format_question(raw_question_data=question, section=section, domain=domain, skill_category=skill_category, difficulty=difficulty)
-    question = formatted_response
+    return question
 
 
+def render_question_graphic(question):
+    """
+    Compiles the question's generation_latex (if any) and replaces it with the uploaded graphic_url.
+    """
     generation_latex = question.get("generation_latex")
     
     if generation_latex != None:
@@ -777,16 +952,121 @@ def generate_question(system_prompt, user_prompt, section, domain, skill_categor
         except Exception as e:
             print(f"Unable to generate graphic: {e}")
 
-    #question = re.search(r'\{.*\}', formatted_response, re.DOTALL)
+    return question
 
-    if question:
-        question_json = question # changed from question.group(0)
-        #print (f"Question json generated: {json.loads(question_json)}")
-        #update_local_questions_data(json.loads(question_json))
-        #return json.loads(question_json)
-        return question
+
+def generate_question(system_prompt, user_prompt, section, domain, skill_category, difficulty, messages, on_stage=None):
+    """
+    Runs the draft -> gate -> ai_feedback -> revision -> format -> render pipeline for one question.
+    `on_stage`, if given, is called with the name of each stage as it starts; skipped stages aren't reported.
+    """
+    state = {
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt,
+        "section": section,
+        "domain": domain,
+        "skill_category": skill_category,
+        "difficulty": difficulty,
+        "messages": messages,
+        "on_stage": on_stage,
+    }
+    for stage, run_stage in QUESTION_STAGES:
+        state = run_stage(state)
+    return state["question"]
+
+
+# Each stage takes the question state dict, adds its output, and hands the state on.
+# generate_question runs them in sequence; pipeline.StagePipeline runs them with a worker pool per stage.
+def _draft_stage(state):
+    state["draft"] = draft_question(state["system_prompt"], state["user_prompt"], state["section"], state["domain"], state["skill_category"], state["difficulty"], state["messages"])
+    return state
+
+def _gate_stage(state):
+    exemplars = prompt_contexts.get(state["section"], state["skill_category"], state["difficulty"]).exemplar_texts()
+    checks = gate_checks(state["draft"], state["section"], exemplars, state.get("correct_answer"), EARLY_EXIT_MAX_SIMILARITY)
+    score = gate_score(checks)
+    state["gate"] = {"score": score, "failed": {name: reason for name, reason in checks.items() if reason}}
+    if score >= EARLY_EXIT_MIN_SCORE:
+        # The draft goes to the format stage as if it were the revision
+        state["skipped_critique"] = True
+        state["revision"] = state["draft"]
+    stage_metrics.count_decision("gate", "skipped" if state.get("skipped_critique") else "critiqued")
+    print(f"gate score {score:.2f}, {'skipping' if state.get('skipped_critique') else 'running'} critique: {state['gate']['failed']}")
+    return state
+
+def _ai_feedback_stage(state):
+    state["ai_feedback"] = generate_ai_feedback(state["draft"], state["section"], state["domain"], state["skill_category"], state["difficulty"], state["system_prompt"])
+    return state
+
+def _revision_stage(state):
+    structured = state.get("pipeline_mode") == "structured"
+    revision = get_ai_feedback(state["draft"], state["section"], state["domain"], state["skill_category"], state["difficulty"], state["ai_feedback"], state["system_prompt"], structured=structured)
+    if structured:
+        state["question"] = revision
     else:
+        state["revision"] = revision
+    return state
+
+def _format_stage(state):
+    question = format_question(raw_question_data=state["revision"], section=state["section"], domain=state["domain"], skill_category=state["skill_category"], difficulty=state["difficulty"])
+    if not question:
         raise ValueError("No valid JSON found in response")
+    state["question"] = question
+    return state
+
+def _render_stage(state):
+    state["question"] = render_question_graphic(state["question"])
+    # Recorded on the question so acceptance can be compared between modes and routing profiles
+    state["question"]["pipeline_mode"] = state.get("pipeline_mode", DEFAULT_PIPELINE_MODE)
+    state["question"]["routing_profile"] = state.get("routing_profile") or model_router.profile
+    state["question"]["early_exit"] = state.get("skipped_critique", False)
+    return state
+
+def _measured(stage, run_stage, skip=None):
+    """
+    Times a stage, applies the request's model routing, and labels the Gemini calls made inside it
+    with the question's section, skill and difficulty, and with its work item index for seeding and
+    the LLM cache. The state's `on_stage` callback, if any, is told the stage is starting. If
+    `skip(state)` is true the stage is passed over: not reported, not timed.
+    """
+    def run(state):
+        if skip and skip(state):
+            return state
+        if state.get("on_stage"):
+            state["on_stage"](stage)
+        token = current_item.set(state.get("index"))
+        try:
+            with labelled(state["section"], state["skill_category"], state["difficulty"]), \
+                    routed(state.get("routing_profile"), state.get("routes")), \
+                    stage_metrics.time_stage(stage):
+                return run_stage(state)
+        finally:
+            current_item.reset(token)
+
+    return run
+
+def _gate_disabled(state):
+    enabled = state.get("early_exit")
+    return not (EARLY_EXIT if enabled is None else enabled)
+
+def _critique_skipped(state):
+    return state.get("skipped_critique", False)
+
+def _already_formatted(state):
+    # Structured mode already produced the question JSON
+    return "question" in state
+
+QUESTION_STAGES = [
+    (stage, _measured(stage, run_stage, skip))
+    for stage, run_stage, skip in [
+        ("draft", _draft_stage, None),
+        ("gate", _gate_stage, _gate_disabled),
+        ("ai_feedback", _ai_feedback_stage, _critique_skipped),
+        ("revision", _revision_stage, _critique_skipped),
+        ("format", _format_stage, _already_formatted),
+        ("render", _render_stage, None),
+    ]
+]
 
 def load_feedback_log():
     if not os.path.exists("feedback_log.json"):
@@ -822,40 +1102,41 @@ def append_to_feedback_log(feedback_entry, log_file="feedback_log.json"):
 
     except Exception as e:
         print(f"Error appending to feedback log: {e}")
-def save_human_feedback(feedback, question_id):
-    try:
-        original_question = feedback["original_question"]
-
-        if not isinstance(original_question, dict):
-            raise ValueError("original_question must be a dict.")
+def human_feedback_writes(feedback, question_id):
+    """
+    The Firestore writes that store a reviewer's feedback on a question: the question document at
+    feedback/SAT/{section}/{question_id} and a new entry in its "entries" subcollection.
+    """
+    original_question = feedback["original_question"]
 
-        section = original_question.get("section")
-        if not isinstance(section, str):
-            raise ValueError("Missing or invalid 'section' in original_question.")
+    if not isinstance(original_question, dict):
+        raise ValueError("original_question must be a dict.")
 
-        timestamp = datetime.utcnow().isoformat()
+    section = original_question.get("section")
+    if not isinstance(section, str):
+        raise ValueError("Missing or invalid 'section' in original_question.")
 
-        feedback_data = {
-            "feedback": feedback,
-            "timestamp": timestamp,
-            "id": question_id,
-        }
+    timestamp = datetime.utcnow().isoformat()
 
-        # Path: feedback/SAT/{section}/{question_id}
-        question_doc_ref = db.collection("feedback") \
-                            .document("SAT") \
-                            .collection(section) \
-                            .document(question_id)
+    feedback_data = {
+        "feedback": feedback,
+        "timestamp": timestamp,
+        "id": question_id,
+    }
 
-        # Ensure the question document exists (you can also save metadata here)
-        question_doc_ref.set({
-            "question_id": question_id,
-            "timestamp": timestamp
-        }, merge=True)  # merge=True ensures existing data isn't overwritten
+    question_path = ("feedback", "SAT", section, question_id)
+    return [
+        # merge=True ensures existing data isn't overwritten
+        firestore_write(question_path, {"question_id": question_id, "timestamp": timestamp}, merge=True),
+        # A fixed entry id (rather than add()) so replaying the write can't duplicate the entry
+        firestore_write(question_path + ("entries", uuid.uuid4().hex), feedback_data),
+    ]
 
-        # Add feedback entry to the "entries" subcollection
-        print(f"Writing feedback to: feedback/SAT/{section}/{question_id}/entries")
-        question_doc_ref.collection("entries").add(feedback_data)
+def save_human_feedback(feedback, question_id):
+    try:
+        writes = human_feedback_writes(feedback, question_id)
+        print(f"Writing feedback to: {'/'.join(writes[1]['path'][:-1])}")
+        question_store.call(commit_writes, writes)
 
         print("✅ Feedback successfully added.")
 
@@ -867,65 +1148,62 @@ def save_human_feedback(feedback, question_id):
 
 def get_human_feedback(question, section, skill_category, difficulty, question_index, feedback: str, ref_system_prompt):
     human_feedback_system_prompt = prompts["human_feedback_prompt"]
-    section_questions = str(all_questions["SAT"].get(section, []))
-    difficulty_questions = str(get_questions_by_difficulty(all_questions, str(section), str(skill_category), str(difficulty)))
-
-    feedback_response = gemini_client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=[str(question), str(feedback), str(difficulty_questions), sources[question["section"]][question["domain"]][question["skill_category"]][question["difficulty"]], ref_system_prompt],
-        config=GenerateContentConfig(
-            system_instruction=[human_feedback_system_prompt],
-            temperature=1.0
-        ),
-    )
+    difficulty_questions = prompt_contexts.get(str(section), str(skill_category), str(difficulty)).exemplars("human_feedback")
+
+    with labelled(section, skill_category, difficulty):
+        feedback_response = generate_content(
+            "human_feedback",
+            prefix=[sources[question["section"]][question["domain"]][question["skill_category"]][question["difficulty"]], ref_system_prompt],
+            prefix_key=(question["section"], question["domain"], question["skill_category"], question["difficulty"]),
+            contents=[str(question), str(feedback), str(difficulty_questions)],
+            config=GenerateContentConfig(
+                system_instruction=[human_feedback_system_prompt],
+                temperature=1.0
+            ),
+        )
 
     feedback_response = feedback_response.text
-    updated_question = re.search(r'\{.*\}', feedback_response, re.DOTALL)
-
+    updated_question = extract_json(feedback_response)
 
+    update_local_questions_data(updated_question)
+    append_to_feedback_log({
+    "original_question": question,
+    "updated_question": feedback_response,
+    "feedback": feedback,
+    "original_difficulty_rating": question.get("difficulty_rating", "unknown"),
+    "question_index": question_index,
+    "timestamp": datetime.utcnow().isoformat()
+    })
+    return updated_question
 
-    if updated_question:
-        updated_question_json = updated_question.group(0)
-        #print (f"Question json generated: {json.loads(updated_question_json)}")
-        update_local_questions_data(json.loads(updated_question_json))
-        append_to_feedback_log({
-        "original_question": question,
-        "updated_question": feedback_response,
-        "feedback": feedback,
-        "original_difficulty_rating": question.get("difficulty_rating", "unknown"),
-        "question_index": question_index,
-        "timestamp": datetime.utcnow().isoformat()
-        })
-        return json.loads(updated_question_json)
-    else:
-        raise ValueError("No valid JSON found in response")
 
 
+def question_writes(question):
+    """
+    Validates a new question, stamps it with its id and metadata, and returns the Firestore write
+    that stores it at questions/SAT/{section}/{id}.
+    """
+    if not isinstance(question, dict):
+        raise ValueError("Input must be a dictionary.")
 
-def add_question(question):
-    try:
-        # Validate input
-        if not isinstance(question, dict):
-            raise ValueError("Input must be a dictionary.")
+    required_fields = ["section"]
+    for field in required_fields:
+        if field not in question or not isinstance(question[field], str):
+            raise ValueError(f"Missing or invalid field: {field}")
 
-        required_fields = ["section"]
-        for field in required_fields:
-            if field not in question or not isinstance(question[field], str):
-                raise ValueError(f"Missing or invalid field: {field}")
+    # Add metadata; updated_at is stamped by Firestore when the write commits
+    question["timestamp"] = utc_now()
+    question["id"] = str(uuid.uuid4())
+    question["test"] = "SAT"
 
-        # Add metadata
-        question["timestamp"] = datetime.utcnow().isoformat()
-        question["id"] = question_id = str(uuid.uuid4())
-        question["test"] = "SAT"
+    return [firestore_write(("questions", question["test"], question["section"], question["id"]), question, server_timestamps=("updated_at",))]
 
+def add_question(question):
+    try:
         # Save to Firestore
-        db.collection("questions") \
-        .document(question["test"]) \
-        .collection(question["section"]) \
-        .document(question_id) \
-        .set(question)
+        question_store.call(commit_writes, question_writes(question))
 
-        return question_id
+        return question["id"]
 
     except Exception as e:
         logging.error(f"Failed to add question: {e}")
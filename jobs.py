@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+JOBS_FILE = "jobs.json"
+
+# Finished jobs are dropped after JOB_TTL_HOURS, and beyond the newest MAX_FINISHED_JOBS
+JOB_TTL = timedelta(hours=float(os.environ.get("JOB_TTL_HOURS", "24")))
+MAX_FINISHED_JOBS = int(os.environ.get("MAX_FINISHED_JOBS", "200"))
+# Seconds progress-only changes (stage, running) may wait before being written out together
+SAVE_DELAY = 1.0
+
+# Job / item lifecycle
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class JobStore:
+    """
+    Keeps generation jobs in memory and mirrors them to a local JSON file, so job state (and
+    finished questions) survive a server restart. New jobs and finished or failed items are written
+    right away; progress-only changes are batched into one write per SAVE_DELAY, since a restart
+    re-runs unfinished items anyway. Finished jobs are pruned by age and count on every write.
+    """
+
+    def __init__(self, json_file=JOBS_FILE, ttl=JOB_TTL, max_finished=MAX_FINISHED_JOBS, save_delay=SAVE_DELAY):
+        self.json_file = json_file
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.save_delay = save_delay
+        self.lock = threading.Lock()
+        self.timer = None
+        self.dirty = False
+        self.jobs = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.json_file):
+            return {}
+        try:
+            with open(self.json_file, "r") as f:
+                jobs = json.load(f)
+                if isinstance(jobs, dict):
+                    return jobs
+                print(f"Warning: {self.json_file} contains non-dict data. Starting with no jobs.")
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON from {self.json_file}: {e}. Starting with no jobs.")
+        return {}
+
+    def _prune(self):
+        cutoff = (datetime.utcnow() - self.ttl).isoformat()
+        finished = sorted(
+            (job["updated_at"], job_id) for job_id, job in self.jobs.items() if job["status"] in (COMPLETED, FAILED)
+        )
+        expired = [job_id for updated_at, job_id in finished if updated_at < cutoff]
+        kept = [job_id for updated_at, job_id in finished if updated_at >= cutoff]
+        for job_id in expired + kept[:max(0, len(kept) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def _save(self):
+        """Call with the lock held."""
+        self._prune()
+        self.dirty = False
+        # Write to a temp file first so a crash mid-write never leaves a truncated jobs file
+        tmp_file = f"{self.json_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.jobs, f, indent=4)
+        os.replace(tmp_file, self.json_file)
+
+    def _save_later(self):
+        """Call with the lock held."""
+        self.dirty = True
+        if self.timer is None:
+            self.timer = threading.Timer(self.save_delay, self._save_pending)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _save_pending(self):
+        with self.lock:
+            self.timer = None
+            if self.dirty:
+                self._save()
+
+    def create(self, params, items):
+        now = datetime.utcnow().isoformat()
+        job_id = str(uuid.uuid4())
+        job = {
+            "id": job_id,
+            "status": QUEUED,
+            "params": params,
+            "created_at": now,
+            "updated_at": now,
+            "items": [
+                {**item, "index": i, "status": QUEUED, "stage": None, "error": None, "question": None}
+                for i, item in enumerate(items)
+            ],
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+            self._save()
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def list(self):
+        with self.lock:
+            return [summarize(job) for job in self.jobs.values()]
+
+    def update_item(self, job_id, index, **fields):
+        with self.lock:
+            job = self.jobs[job_id]
+            job["items"][index].update(fields)
+            job["status"] = _job_status(job)
+            job["updated_at"] = datetime.utcnow().isoformat()
+            if fields.get("status") in (COMPLETED, FAILED):
+                self._save()
+            else:
+                self._save_later()
+
+    def unfinished(self):
+        """Returns (job_id, item) pairs that still have to run, e.g. after a restart."""
+        with self.lock:
+            return [
+                (job_id, dict(item))
+                for job_id, job in self.jobs.items()
+                for item in job["items"]
+                if item["status"] in (QUEUED, RUNNING)
+            ]
+
+
+def _job_status(job):
+    statuses = [item["status"] for item in job["items"]]
+    if any(status in (QUEUED, RUNNING) for status in statuses):
+        return RUNNING if any(status != QUEUED for status in statuses) else QUEUED
+    if statuses and all(status == FAILED for status in statuses):
+        return FAILED
+    return COMPLETED
+
+
+def summarize(job):
+    """Progress view of a job without the generated questions."""
+    counts = {QUEUED: 0, RUNNING: 0, COMPLETED: 0, FAILED: 0}
+    for item in job["items"]:
+        counts[item["status"]] += 1
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "params": job["params"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "total": len(job["items"]),
+        "progress": counts,
+        "items": [{k: v for k, v in item.items() if k != "question"} for item in job["items"]],
+    }
+
+
+class JobManager:
+    """
+    Runs job items on a bounded worker pool. `run_item(item, on_stage)` produces one question;
+    `on_stage(stage)` lets the runner report which pipeline stage the item is in.
+    """
+
+    def __init__(self, run_item, store=None, max_workers=4, on_result=None):
+        self.run_item = run_item
+        self.on_result = on_result
+        self.store = store or JobStore()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, params, items):
+        job_id = self.store.create(params, items)
+        for item in self.store.get(job_id)["items"]:
+            self.executor.submit(self._run, job_id, item)
+        return job_id
+
+    def resume(self):
+        """Re-queues items that were queued or in flight when the server last stopped."""
+        pending = self.store.unfinished()
+        for job_id, item in pending:
+            self.store.update_item(job_id, item["index"], status=QUEUED, stage=None)
+            self.executor.submit(self._run, job_id, item)
+        if pending:
+            print(f"Resumed {len(pending)} unfinished job items")
+
+    def _run(self, job_id, item):
+        index = item["index"]
+        self.store.update_item(job_id, index, status=RUNNING)
+        try:
+            question = self.run_item(item, lambda stage: self.store.update_item(job_id, index, stage=stage))
+            self.store.update_item(job_id, index, status=COMPLETED, stage=None, question=question)
+            if self.on_result:
+                self.on_result(question)
+        except Exception as e:
+            print(f"Job {job_id} item {index} failed: {e}")
+            self.store.update_item(job_id, index, status=FAILED, error=str(e))
@@ -0,0 +1,126 @@
+import json
+import re
+
+# A backslash that isn't itself escaped (it ends an odd run) and either can't start a JSON escape or
+# starts a LaTeX command that JSON would read as \b, \f, \r, \t or \u (\frac, \times, \right, \usepackage ...).
+# Models often forget to double these inside generation_latex and LaTeX in question text.
+LATEX_BACKSLASH = re.compile(r'(?<!\\)((?:\\\\)*)\\(?=[^"\\/bfnrtu]|[bfrt][a-zA-Z]|u(?![0-9a-fA-F]{4}))')
+# \n before a letter is a newline in prose, but a command (\node, \neq, \newline) in generation_latex
+LATEX_NEWLINE = re.compile(r'(?<!\\)((?:\\\\)*)\\(?=n[a-zA-Z])')
+LATEX_FIELD = re.compile(r'("generation_latex"\s*:\s*")((?:[^"\\]|\\.)*)', re.DOTALL)
+
+
+class JSONExtractionError(ValueError):
+    def __init__(self, message, position=None, snippet=None):
+        if position is not None:
+            message = f"{message} at offset {position}: {snippet!r}"
+        super().__init__(message)
+        self.position = position
+        self.snippet = snippet
+
+
+def repair_latex(candidate):
+    """`candidate` with LaTeX backslashes doubled; JSON escapes and already doubled backslashes are left alone."""
+    candidate = LATEX_BACKSLASH.sub(r"\1\\\\", candidate)
+    return LATEX_FIELD.sub(lambda match: match.group(1) + LATEX_NEWLINE.sub(r"\1\\\\", match.group(2)), candidate)
+
+
+def _parse(candidate):
+    """Returns (object, None) or (None, JSONDecodeError) for one balanced {...} candidate."""
+    try:
+        return json.loads(candidate), None
+    except json.JSONDecodeError:
+        pass
+    # Only JSON that doesn't parse as it is gets its LaTeX repaired, so valid escapes ("\t" before a
+    # letter included) always mean what they say; raw newlines in strings are allowed from here on
+    try:
+        return json.loads(repair_latex(candidate), strict=False), None
+    except json.JSONDecodeError as e:
+        return None, e
+
+
+class JSONExtractor:
+    """
+    Incremental extractor for the first complete JSON object in model output.
+
+    Feed it text as it arrives (a whole response or streamed chunks). It tracks brace depth outside
+    of JSON strings, so braces inside string values (e.g. LaTeX in generation_latex) don't end the
+    object early, and stops at the first balanced candidate that parses, instead of grabbing
+    everything from the first "{" to the last "}". Candidates that don't parse (stray braces in
+    prose, LaTeX outside the JSON) are skipped and the failure position is kept in `last_error`.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.scan = 0
+        self.start = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.result = None
+        self.done = False
+        self.last_error = None
+
+    def feed(self, chunk):
+        """Adds text; returns the object once one is complete, otherwise None."""
+        if self.done:
+            return self.result
+        self.text += chunk
+        text = self.text
+        i = self.scan
+        while i < len(text):
+            c = text[i]
+            if self.start is None:
+                if c == "{":
+                    self.start, self.depth, self.in_string, self.escape = i, 1, False, False
+                i += 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c == "{":
+                self.depth += 1
+            elif c == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    obj, error = _parse(text[self.start:i + 1])
+                    if error is None and isinstance(obj, dict):
+                        self.result, self.done, self.scan = obj, True, i + 1
+                        return obj
+                    position = self.start + (error.pos if error else 0)
+                    self.last_error = (position, error.msg if error else "not a JSON object")
+                    # Retry from just past this candidate's opening brace; the real object may be nested in it
+                    i, self.start = self.start + 1, None
+                    continue
+            i += 1
+        self.scan = i
+        return None
+
+    def finish(self):
+        """Call once the input is complete. Returns the object or raises JSONExtractionError."""
+        # An unclosed brace in leading prose can swallow the real object; rescan past it
+        while not self.done and self.start is not None:
+            self.scan, self.start = self.start + 1, None
+            self.feed("")
+        if self.done:
+            return self.result
+        if self.last_error:
+            position, message = self.last_error
+            raise JSONExtractionError(f"Invalid JSON ({message})", position, self.text[max(0, position - 40):position + 40])
+        if "{" in self.text:
+            position = self.text.index("{")
+            raise JSONExtractionError("Unterminated JSON object", position, self.text[position:position + 80])
+        raise JSONExtractionError("No JSON object found in response")
+
+
+def extract_json(text):
+    """Returns the first complete JSON object in `text`, or raises JSONExtractionError."""
+    extractor = JSONExtractor()
+    extractor.feed(text)
+    return extractor.finish()
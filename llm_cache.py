@@ -0,0 +1,158 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+
+# off:    never touch the cache
+# record: always call the model, and store every response
+# replay: serve only from the cache; a miss raises CacheMiss instead of calling the model
+# auto:   serve hits from the cache, call the model (and store) on a miss
+CACHE_MODES = ("off", "record", "replay", "auto")
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class LLMCache:
+    """
+    Content-addressed on-disk cache of model responses, one JSON file per key under `directory`.
+
+    Keys hash everything that determines a response: model, system instruction, contents,
+    temperature, response schema and MIME type, thinking config, and the index of the work item the
+    call is for, so questions of one batch whose prompts coincide still get their own entries. Uploaded-file IDs in the contents are swapped for a hash of the file's bytes via
+    `resolve_file`, so re-uploading the same PDF doesn't invalidate the cache. The cache is bounded
+    to `max_bytes`; least recently used entries are evicted first.
+    """
+
+    def __init__(self, directory=".llm_cache", mode="off", max_bytes=512 * 1024 * 1024, resolve_file=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode: {mode}. Must be one of {', '.join(CACHE_MODES)}.")
+        self.directory = directory
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.resolve_file = resolve_file or (lambda value: None)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.entries = self._scan() if mode != "off" else collections.OrderedDict()
+        self.total_bytes = sum(self.entries.values())
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def _scan(self):
+        # Rebuild the LRU order from modification times; hits touch their file to stay recent
+        entries = []
+        if os.path.isdir(self.directory):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(".json"):
+                        stat = os.stat(os.path.join(root, name))
+                        entries.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        entries.sort()
+        return collections.OrderedDict((key, size) for _, key, size in entries)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _canonical(self, value):
+        if isinstance(value, str):
+            resolved = self.resolve_file(value)
+            return {"file_sha256": resolved} if resolved else value
+        if isinstance(value, (list, tuple)):
+            return [self._canonical(item) for item in value]
+        if isinstance(value, dict):
+            return {k: self._canonical(v) for k, v in value.items()}
+        if isinstance(value, type) and hasattr(value, "model_json_schema"):
+            # A pydantic response schema: key on its JSON schema, so editing a field is a new key
+            return self._canonical(value.model_json_schema())
+        if hasattr(value, "model_dump"):
+            return self._canonical(value.model_dump(mode="json", exclude_none=True))
+        return value if value is None or isinstance(value, (bool, int, float)) else str(value)
+
+    def key(self, model, system_instruction, contents, temperature, response_schema=None, response_mime_type=None, thinking_config=None, item=None):
+        payload = {
+            "model": model,
+            "system_instruction": self._canonical(system_instruction),
+            "contents": self._canonical(contents),
+            "temperature": temperature,
+            "response_schema": self._canonical(response_schema),
+            "response_mime_type": response_mime_type,
+            "thinking_config": self._canonical(thinking_config),
+            "item": item,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        """Returns the cached response dict, or None if the model should be called."""
+        if self.mode in ("off", "record"):
+            return None
+        with self.lock:
+            present = key in self.entries
+            if present:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if present:
+            path = self._path(key)
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                os.utime(path)
+                return data
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Discarding unreadable cache entry {key}: {e}")
+                self._forget(key)
+        if self.mode == "replay":
+            raise CacheMiss(f"No cached response for key {key} (LLM cache is in replay mode)")
+        return None
+
+    def store(self, key, response):
+        if self.mode not in ("record", "auto"):
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(response, f)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, key):
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
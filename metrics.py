@@ -0,0 +1,228 @@
+import bisect
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+
+LABEL_NAMES = ("section", "skill_category", "difficulty")
+
+SECONDS_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 240, 300)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000)
+
+# Labels of the question currently being worked on in this thread, so a Gemini call made deep
+# inside a stage is attributed to the right section, skill and difficulty.
+_current_labels = contextvars.ContextVar("metric_labels", default=("", "", ""))
+
+
+@contextlib.contextmanager
+def labelled(section="", skill_category="", difficulty=""):
+    token = _current_labels.set((str(section), str(skill_category), str(difficulty)))
+    try:
+        yield
+    finally:
+        _current_labels.reset(token)
+
+
+def current_labels():
+    return _current_labels.get()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, label_names, buckets):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(self.label_names + ('le',), labels + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.label_names, labels)} {_number(series['sum'])}")
+            lines.append(f"{self.name}_count{_label_text(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, label_names):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.series = collections.Counter()
+
+    def inc(self, labels, amount=1):
+        self.series[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{_label_text(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+def render_gauge(name, help, values, label_name):
+    """Prometheus text for a gauge read at scrape time, e.g. queue depths: {label value: number}."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for label, value in sorted(values.items()):
+        lines.append(f"{name}{_label_text((label_name,), (label,))} {_number(value)}")
+    return lines
+
+
+class StageMetrics:
+    """
+    Per-stage latency, token and retry metrics, labelled by stage, section, skill category and
+    difficulty, rendered in the Prometheus text exposition format.
+
+    Pipeline stages are timed end to end with `time_stage`; each Gemini call records its own wall
+    time and usage_metadata with `record_call`; ResilientCaller events (retries, failures,
+    rejections, timeouts, hedges) arrive through `count_event`.
+    """
+
+    def __init__(self, recent_samples=2000):
+        self.lock = threading.Lock()
+        self.recent_samples = recent_samples
+        self.reset()
+
+    def reset(self):
+        """Clears every series, e.g. between benchmark scenarios."""
+        with self.lock:
+            names = ("stage",) + LABEL_NAMES
+            self.stage_seconds = Histogram(
+                "question_stage_duration_seconds", "Wall time of one question pipeline stage.", names, SECONDS_BUCKETS)
+            self.stage_failures = Counter(
+                "question_stage_failures_total", "Question pipeline stages that raised.", names)
+            self.call_seconds = Histogram(
+                "gemini_call_duration_seconds", "Wall time of one Gemini call, including retries.", names, SECONDS_BUCKETS)
+            self.tokens = {
+                kind: Histogram(f"gemini_{kind}_tokens", f"{kind.capitalize()} tokens per Gemini call.", names, TOKEN_BUCKETS)
+                for kind in ("prompt", "candidates", "cached", "thoughts")
+            }
+            self.decisions = Counter(
+                "question_gate_decisions_total", "Early-exit gate decisions after the draft: skipped or critiqued.",
+                names + ("decision",),
+            )
+            self.cost = Counter(
+                "gemini_estimated_cost_dollars_total", "Estimated Gemini spend from usage_metadata and list prices.",
+                names + ("model",),
+            )
+            self.events = Counter(
+                "gemini_call_events_total",
+                "Gemini call events: calls, retries, rejections, hedges, hedge_wins, timeouts, failures, llm_cache_hits.",
+                names + ("event",),
+            )
+            # Exact recent durations of successful stages, for percentiles finer than the histogram buckets
+            self.recent = collections.defaultdict(lambda: collections.deque(maxlen=self.recent_samples))
+
+    def _labels(self, stage):
+        return (stage, *current_labels())
+
+    @contextlib.contextmanager
+    def time_stage(self, stage):
+        started = time.monotonic()
+        labels = self._labels(stage)
+        try:
+            yield
+        except Exception:
+            with self.lock:
+                self.stage_failures.inc(labels)
+                self.stage_seconds.observe(labels, time.monotonic() - started)
+            raise
+        elapsed = time.monotonic() - started
+        with self.lock:
+            self.stage_seconds.observe(labels, elapsed)
+            self.recent[stage].append(elapsed)
+
+    def record_call(self, stage, seconds, usage_metadata, model="", cost=0.0):
+        labels = self._labels(stage)
+        with self.lock:
+            self.call_seconds.observe(labels, seconds)
+            if usage_metadata is None:
+                return
+            self.cost.inc(labels + (model,), cost)
+            self.tokens["prompt"].observe(labels, usage_metadata.prompt_token_count or 0)
+            self.tokens["candidates"].observe(labels, usage_metadata.candidates_token_count or 0)
+            self.tokens["cached"].observe(labels, usage_metadata.cached_content_token_count or 0)
+            self.tokens["thoughts"].observe(labels, usage_metadata.thoughts_token_count or 0)
+
+    def count_decision(self, stage, decision):
+        with self.lock:
+            self.decisions.inc(self._labels(stage) + (decision,))
+
+    def decision_counts(self, stage):
+        """{decision: n} for one stage, summed over every label."""
+        counts = collections.Counter()
+        with self.lock:
+            for labels, value in self.decisions.series.items():
+                if labels[0] == stage:
+                    counts[labels[-1]] += value
+        return dict(counts)
+
+    def count_event(self, stage, event):
+        with self.lock:
+            self.events.inc(self._labels(stage) + (event,))
+
+    def stage_counts(self):
+        """{stage: {"completed": n, "failed": n}} summed over every label."""
+        counts = collections.defaultdict(lambda: {"completed": 0, "failed": 0})
+        with self.lock:
+            for labels, series in self.stage_seconds.series.items():
+                counts[labels[0]]["completed"] += sum(series["counts"])
+            for labels, value in self.stage_failures.series.items():
+                counts[labels[0]]["completed"] -= value
+                counts[labels[0]]["failed"] += value
+        return dict(counts)
+
+    def event_counts(self):
+        """{stage: {event: n}} summed over every label."""
+        counts = collections.defaultdict(collections.Counter)
+        with self.lock:
+            for labels, value in self.events.series.items():
+                counts[labels[0]][labels[-1]] += value
+        return {stage: dict(events) for stage, events in counts.items()}
+
+    def total_cost(self):
+        with self.lock:
+            return sum(self.cost.series.values())
+
+    def stage_quantiles(self, quantiles=(0.5, 0.95, 0.99)):
+        """{stage: {"p50": seconds, ...}} over the recent successful runs of each stage."""
+        with self.lock:
+            recent = {stage: sorted(samples) for stage, samples in self.recent.items() if samples}
+        return {
+            stage: {f"p{round(q * 100)}": samples[min(len(samples) - 1, int(q * len(samples)))] for q in quantiles}
+            for stage, samples in recent.items()
+        }
+
+    def render(self):
+        with self.lock:
+            metrics = [self.stage_seconds, self.stage_failures, self.call_seconds, *self.tokens.values(), self.cost, self.decisions, self.events]
+            lines = [line for metric in metrics for line in metric.render()]
+        return lines
@@ -0,0 +1,202 @@
+import contextlib
+import contextvars
+import json
+import os
+from dataclasses import asdict, dataclass, replace
+from typing import Optional
+
+from google.genai.types import ThinkingConfig
+
+PRO = "gemini-2.5-pro"
+FLASH = "gemini-2.5-flash"
+FLASH_LITE = "gemini-2.5-flash-lite"
+
+
+@dataclass(frozen=True)
+class StageRoute:
+    model: str
+    temperature: Optional[float] = None  # None keeps the model default
+    thinking_budget: Optional[int] = None  # None keeps the model default; 0 turns thinking off (Flash only)
+
+    def apply(self, config):
+        """Returns a copy of a GenerateContentConfig with this route's temperature and thinking budget."""
+        update = {}
+        if self.temperature is not None:
+            update["temperature"] = self.temperature
+        if self.thinking_budget is not None:
+            update["thinking_config"] = ThinkingConfig(thinking_budget=self.thinking_budget)
+        return config.model_copy(update=update) if update else config
+
+
+# "quality" is the default and keeps every stage on Pro, as before profiles existed.
+# The cheaper profiles are opt-in: "balanced" keeps the creative stages (draft, critique, revision)
+# on Pro and sends the mechanical ones (format, explanation backfill), which only restructure
+# text, to Flash; "economy" moves everything off Pro.
+ROUTING_PROFILES = {
+    "quality": {
+        "draft": StageRoute(PRO, 1.0),
+        "ai_feedback": StageRoute(PRO, 1.0),
+        "revision": StageRoute(PRO, 1.0),
+        "format": StageRoute(PRO),
+        "evaluate": StageRoute(PRO),
+        "refine": StageRoute(PRO),
+        "human_feedback": StageRoute(PRO, 1.0),
+        "explanations": StageRoute(PRO),
+    },
+    "balanced": {
+        "draft": StageRoute(PRO, 1.0),
+        "ai_feedback": StageRoute(PRO, 1.0),
+        "revision": StageRoute(PRO, 1.0),
+        "format": StageRoute(FLASH, 0.0, thinking_budget=0),
+        "evaluate": StageRoute(FLASH, thinking_budget=1024),
+        "refine": StageRoute(PRO),
+        "human_feedback": StageRoute(PRO, 1.0),
+        "explanations": StageRoute(FLASH, thinking_budget=1024),
+    },
+    "economy": {
+        "draft": StageRoute(FLASH, 1.0),
+        "ai_feedback": StageRoute(FLASH, 1.0, thinking_budget=2048),
+        "revision": StageRoute(FLASH, 1.0),
+        "format": StageRoute(FLASH_LITE, 0.0, thinking_budget=0),
+        "evaluate": StageRoute(FLASH, thinking_budget=0),
+        "refine": StageRoute(FLASH),
+        "human_feedback": StageRoute(PRO, 1.0),
+        "explanations": StageRoute(FLASH_LITE, thinking_budget=0),
+    },
+}
+
+# Thinking budgets each model accepts: (min, max, whether 0 turns thinking off). -1 (dynamic) is always accepted.
+THINKING_BUDGETS = {
+    PRO: (128, 32768, False),
+    FLASH: (0, 24576, True),
+    FLASH_LITE: (512, 24576, True),
+}
+TEMPERATURE_RANGE = (0.0, 2.0)
+
+# USD per million tokens: (input, output incl. thinking, cached input), prompts up to 200k tokens
+MODEL_PRICES = {
+    PRO: (1.25, 10.00, 0.31),
+    FLASH: (0.30, 2.50, 0.075),
+    FLASH_LITE: (0.10, 0.40, 0.025),
+}
+
+
+def estimate_cost(model, usage_metadata):
+    """Estimated USD for one call from its usage_metadata; 0.0 for unknown models or missing usage."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None or usage_metadata is None:
+        return 0.0
+    input_price, output_price, cached_price = prices
+    cached = usage_metadata.cached_content_token_count or 0
+    prompt = (usage_metadata.prompt_token_count or 0) - cached
+    output = (usage_metadata.candidates_token_count or 0) + (usage_metadata.thoughts_token_count or 0)
+    return (prompt * input_price + cached * cached_price + output * output_price) / 1e6
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def check_route(stage, route):
+    """Raises ValueError unless the StageRoute's model accepts its temperature and thinking budget."""
+    if route.model not in THINKING_BUDGETS:
+        raise ValueError(f"Unknown model {route.model!r} for {stage!r}. Must be one of {', '.join(THINKING_BUDGETS)}.")
+    if route.temperature is not None:
+        low, high = TEMPERATURE_RANGE
+        if not _is_number(route.temperature) or not low <= route.temperature <= high:
+            raise ValueError(f"temperature for {stage!r} must be a number between {low} and {high}, got {route.temperature!r}")
+    if route.thinking_budget is not None:
+        low, high, can_disable = THINKING_BUDGETS[route.model]
+        budget = route.thinking_budget
+        if not isinstance(budget, int) or isinstance(budget, bool):
+            raise ValueError(f"thinking_budget for {stage!r} must be an integer, got {budget!r}")
+        if budget == 0 and not can_disable:
+            raise ValueError(f"{route.model} can't turn thinking off (thinking_budget 0) for {stage!r}")
+        if budget not in (-1, 0) and not low <= budget <= high:
+            raise ValueError(f"thinking_budget for {stage!r} on {route.model} must be -1 (dynamic) or between {low} and {high}, got {budget}")
+
+
+def parse_routes(routes):
+    """
+    Validates stage overrides such as {"format": {"model": "gemini-2.5-flash", "thinking_budget": 0}}.
+    Raises ValueError on unknown stages, fields or models and on values of the wrong type. Ranges
+    depend on the model, which may come from the profile the route overrides; see ModelRouter.check.
+    """
+    parsed = {}
+    known_stages = ROUTING_PROFILES["quality"]
+    for stage, fields in (routes or {}).items():
+        if stage not in known_stages:
+            raise ValueError(f"Unknown stage {stage!r}. Must be one of {', '.join(known_stages)}.")
+        if not isinstance(fields, dict):
+            raise ValueError(f"Route for {stage!r} must be an object")
+        unknown = set(fields) - {"model", "temperature", "thinking_budget"}
+        if unknown:
+            raise ValueError(f"Unknown route field(s) for {stage!r}: {', '.join(sorted(unknown))}")
+        if "model" in fields and fields["model"] not in THINKING_BUDGETS:
+            raise ValueError(f"Unknown model {fields['model']!r} for {stage!r}. Must be one of {', '.join(THINKING_BUDGETS)}.")
+        if fields.get("temperature") is not None and not _is_number(fields["temperature"]):
+            raise ValueError(f"temperature for {stage!r} must be a number, got {fields['temperature']!r}")
+        budget = fields.get("thinking_budget")
+        if budget is not None and (not isinstance(budget, int) or isinstance(budget, bool)):
+            raise ValueError(f"thinking_budget for {stage!r} must be an integer, got {budget!r}")
+        parsed[stage] = fields
+    return parsed
+
+
+# Per-request profile and stage overrides for the work running in this thread
+_request_routing = contextvars.ContextVar("request_routing", default=(None, {}))
+
+
+@contextlib.contextmanager
+def routed(profile=None, routes=None):
+    token = _request_routing.set((profile, routes or {}))
+    try:
+        yield
+    finally:
+        _request_routing.reset(token)
+
+
+class ModelRouter:
+    """
+    Resolves the model, temperature and thinking budget for each stage. The most specific setting wins:
+    per-request stage overrides (`routed(routes=...)`), then the environment's GEMINI_ROUTES overrides,
+    then the per-request profile, then the environment's GEMINI_ROUTING_PROFILE.
+    """
+
+    def __init__(self, profile="quality", routes=None):
+        if profile not in ROUTING_PROFILES:
+            raise ValueError(f"Unknown routing profile {profile!r}. Must be one of {', '.join(ROUTING_PROFILES)}.")
+        self.profile = profile
+        self.routes = parse_routes(routes)
+        self.check()
+
+    @classmethod
+    def from_env(cls):
+        """GEMINI_ROUTING_PROFILE picks a profile; GEMINI_ROUTES is a JSON object of stage overrides."""
+        return cls(
+            profile=os.getenv("GEMINI_ROUTING_PROFILE", "quality"),
+            routes=json.loads(os.getenv("GEMINI_ROUTES", "{}")),
+        )
+
+    def check(self, profile=None, routes=None):
+        """Raises ValueError if any stage's effective route under `profile` and `routes` is one its model rejects."""
+        with routed(profile, parse_routes(routes)):
+            for stage in ROUTING_PROFILES[self.current_profile()]:
+                check_route(stage, self.route(stage))
+
+    def current_profile(self):
+        profile, _ = _request_routing.get()
+        return profile or self.profile
+
+    def route(self, stage):
+        request_profile, request_routes = _request_routing.get()
+        profile = ROUTING_PROFILES[request_profile or self.profile]
+        route = profile.get(stage) or StageRoute(PRO)
+        for overrides in (self.routes.get(stage), request_routes.get(stage)):
+            if overrides:
+                route = replace(route, **overrides)
+        return route
+
+    def table(self):
+        """The effective routing table for the current profile, for /llm-stats."""
+        return {stage: asdict(self.route(stage)) for stage in ROUTING_PROFILES[self.current_profile()]}
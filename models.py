@@ -0,0 +1,63 @@
+from pydantic import BaseModel
+from typing import Any, List, Dict, Optional
+
+
+class QuestionRequest(BaseModel):
+    section: str
+    domains: List[str]
+    skill_categories: List[str]
+    difficulties: List[str]
+    num_questions: int
+    pipeline_mode: Optional[str] = None  # "format" (default) or "structured"
+    routing_profile: Optional[str] = None  # "quality", "balanced" or "economy"; defaults to GEMINI_ROUTING_PROFILE
+    routes: Optional[Dict[str, Dict[str, Any]]] = None  # per-stage model/temperature/thinking_budget overrides
+    early_exit: Optional[bool] = None  # skip critique/revision for drafts passing local checks; defaults to EARLY_EXIT
+
+    
+
+class Question(BaseModel):
+    question: str
+    section: str
+    domain: str
+    skill_category: str
+    choices: List[str]
+    correct_answer: str
+    difficulty: str
+    difficulty_ranking: str
+    explanations: Dict[str, str]
+    graphic_url: Optional[str] = None
+    pipeline_mode: Optional[str] = None
+    routing_profile: Optional[str] = None
+    early_exit: Optional[bool] = None  # True when the draft skipped the AI critique and revision
+
+
+class AnswerExplanations(BaseModel):
+    A: str
+    B: str
+    C: str
+    D: str
+
+
+class StructuredQuestion(BaseModel):
+    """
+    Response schema for the structured pipeline mode: only the Question fields the model writes,
+    with the explanations spelled out per letter (Gemini response schemas can't express
+    Dict[str, str]) plus the optional LaTeX for math graphics, which render_question_graphic turns
+    into graphic_url. Pipeline metadata (graphic_url, pipeline_mode, routing_profile, early_exit)
+    is filled in afterwards.
+    """
+    question: str
+    section: str
+    domain: str
+    skill_category: str
+    choices: List[str]
+    correct_answer: str
+    difficulty: str
+    difficulty_ranking: str
+    explanations: AnswerExplanations
+    generation_latex: Optional[str] = None
+
+
+class FeedbackRequest(BaseModel):
+    index: int
+    content: str
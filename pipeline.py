@@ -0,0 +1,56 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class StagePipeline:
+    """
+    Runs a fixed sequence of stages, each with its own bounded queue and worker pool.
+
+    `stages` is a list of (name, fn) pairs where fn takes a state dict and returns it.
+    While question k is in the ai_feedback stage, question k+1 can already be drafted,
+    so throughput is set by the per-stage worker counts rather than by how the caller
+    groups its work.
+    """
+
+    def __init__(self, stages, workers=None, default_workers=4, queue_size=None):
+        self.stages = stages
+        workers = workers or {}
+        self.queues = []
+        for name, _ in stages:
+            count = workers.get(name, default_workers)
+            # A small bounded queue gives backpressure: a slow stage stalls the one before it
+            # instead of letting drafts pile up in memory.
+            self.queues.append(queue.Queue(maxsize=queue_size or 2 * count))
+            for n in range(count):
+                threading.Thread(
+                    target=self._work,
+                    args=(len(self.queues) - 1,),
+                    name=f"pipeline-{name}-{n}",
+                    daemon=True,
+                ).start()
+
+    def submit(self, state):
+        """Queues a state dict at the first stage and returns a Future for the final state."""
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.queues[0].put((state, future))
+        return future
+
+    def backlog(self):
+        """Number of items waiting in front of each stage."""
+        return {name: self.queues[i].qsize() for i, (name, _) in enumerate(self.stages)}
+
+    def _work(self, index):
+        _, run_stage = self.stages[index]
+        while True:
+            state, future = self.queues[index].get()
+            try:
+                state = run_stage(state)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            if index + 1 < len(self.stages):
+                self.queues[index + 1].put((state, future))
+            else:
+                future.set_result(state)
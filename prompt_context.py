@@ -0,0 +1,334 @@
+import collections
+import json
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from json_extract import JSONExtractionError, extract_json
+
+# Only what the model needs to judge style, difficulty and diversity. Explanations, ids,
+# timestamps, graphic URLs and the section/domain/skill labels (already in the prompt) are dropped.
+EXEMPLAR_FIELDS = ("question", "choices", "correct_answer", "difficulty_ranking")
+
+# Rough per-stage prompt budgets, in tokens, for each kind of context
+STAGE_BUDGETS = {
+    "draft": {"exemplars": 4000},
+    "ai_feedback": {"exemplars": 6000, "feedback": 4000},
+    "revision": {"exemplars": 6000},
+    "human_feedback": {"exemplars": 6000},
+    "evaluate": {"exemplars": 10000},
+}
+
+FEEDBACK_TEXT_LIMIT = 600
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for budgeting."""
+    return len(text) // 4 + 1
+
+
+def stage_budget(stage, part):
+    return STAGE_BUDGETS.get(stage, {}).get(part)
+
+
+def _compact_line(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _clip(text, limit):
+    text = str(text)
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def _join_within_budget(lines, budget_tokens):
+    """Joins lines until the token budget is used up; always keeps at least one line."""
+    kept = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line)
+        if budget_tokens is not None and kept and used + cost > budget_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+def project_question(question):
+    return {field: question[field] for field in EXEMPLAR_FIELDS if question.get(field) not in (None, "")}
+
+
+def compact_exemplars(questions, budget_tokens=None):
+    """One compact JSON object per line with only EXEMPLAR_FIELDS, cut off at the token budget."""
+    return _join_within_budget([_compact_line(project_question(q)) for q in questions], budget_tokens)
+
+
+def project_feedback(entry):
+    """
+    Reduces a stored feedback entry to the reviewer's note plus the question stem before and after
+    the revision, instead of two full question dicts and the raw model output.
+    """
+    info = entry.get("feedback", entry)
+    if not isinstance(info, dict):
+        return {"feedback": _clip(info, FEEDBACK_TEXT_LIMIT)}
+    projected = {"feedback": _clip(info.get("feedback", ""), FEEDBACK_TEXT_LIMIT)}
+    original = info.get("original_question")
+    if isinstance(original, dict):
+        projected["before"] = _clip(original.get("question", ""), FEEDBACK_TEXT_LIMIT)
+        if original.get("correct_answer"):
+            projected["before_answer"] = original["correct_answer"]
+    updated = info.get("updated_question")
+    if isinstance(updated, str):
+        try:
+            updated = extract_json(updated)
+        except JSONExtractionError:
+            updated = {"question": updated}
+    if isinstance(updated, dict):
+        projected["after"] = _clip(updated.get("question", ""), FEEDBACK_TEXT_LIMIT)
+    return projected
+
+
+def compact_feedback(entries, budget_tokens=None):
+    return _join_within_budget([_compact_line(project_feedback(entry)) for entry in entries], budget_tokens)
+
+
+class PromptContext:
+    """
+    Prompt context for one (section, skill_category, difficulty). Nothing is filtered or serialized
+    until a prompt asks for it; then the matching pool is memoized, and so is each entry's compact
+    form once it has been sampled, so concurrent questions for the same skill share one scan of the
+    bank and stages that don't use a pool never pay for it.
+
+    Every call draws a fresh sample from `rng(kind, *key, limit)`: without a seed that is the shared
+    `random` module, so each question still sees different exemplars and feedback; with one,
+    samples repeat exactly, as the LLM response cache needs.
+    """
+
+    def __init__(self, section, skill_category, difficulty, select_questions, select_feedback, rng, on_build=None):
+        self.section = section
+        self.skill_category = skill_category
+        self.difficulty = difficulty
+        self.select_questions = select_questions
+        self.select_feedback = select_feedback
+        self.rng = rng
+        self.on_build = on_build
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.projected = {}
+
+    def _pool(self, kind, select):
+        with self.lock:
+            if kind in self.pools:
+                return self.pools[kind]
+        pool = select()
+        with self.lock:
+            pool = self.pools.setdefault(kind, pool)
+        if self.on_build:
+            self.on_build(kind)
+        return pool
+
+    def _sample(self, kind, select, project, limit, *parts):
+        """`project` of up to `limit` entries sampled from the `kind` pool."""
+        pool = self._pool(kind, select)
+        indices = range(len(pool))
+        if limit is not None and len(pool) > limit:
+            # Sampling indices picks the same entries as sampling the pool itself
+            indices = self.rng(kind, *parts, limit).sample(indices, limit)
+        with self.lock:
+            cached = {index: self.projected.get((project, index)) for index in indices}
+        missing = {index: project(pool[index]) for index, value in cached.items() if value is None}
+        with self.lock:
+            for index, value in missing.items():
+                self.projected[(project, index)] = value
+        return [missing.get(index, cached[index]) for index in indices]
+
+    def _questions(self, project, limit):
+        return self._sample("questions", self.select_questions, project, limit, self.section, self.skill_category, self.difficulty)
+
+    def exemplars(self, stage, limit=10):
+        return _join_within_budget(self._questions(_exemplar_line, limit), stage_budget(stage, "exemplars"))
+
+    def exemplar_texts(self, limit=25):
+        """Plain question texts, for local similarity checks."""
+        return self._questions(_question_text, limit)
+
+    def feedback(self, stage, limit=15):
+        lines = self._sample("feedback", self.select_feedback, _feedback_line, limit, self.section, self.difficulty)
+        return _join_within_budget(lines, stage_budget(stage, "feedback"))
+
+
+def _exemplar_line(question):
+    return _compact_line(project_question(question))
+
+
+def _question_text(question):
+    return str(question.get("question", ""))
+
+
+def _feedback_line(entry):
+    return _compact_line(project_feedback(entry))
+
+
+class PromptContextCache:
+    """Hands out one PromptContext per (section, skill_category, difficulty)."""
+
+    def __init__(self, select_questions, select_feedback, rng=lambda *parts: random):
+        # select_questions(section, skill_category, difficulty) and select_feedback(section, difficulty)
+        # return every match; rng(*parts) is what samples of them are drawn from
+        self.select_questions = select_questions
+        self.select_feedback = select_feedback
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.contexts = {}
+        self.counters = collections.Counter()
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def get(self, section, skill_category, difficulty):
+        key = (section, skill_category, difficulty)
+        with self.lock:
+            context = self.contexts.get(key)
+            if context is None:
+                context = self.contexts[key] = PromptContext(
+                    section, skill_category, difficulty,
+                    lambda: self.select_questions(section, skill_category, difficulty),
+                    lambda: self.select_feedback(section, difficulty),
+                    self.rng,
+                    on_build=lambda kind: self._count(f"{kind}_pools_built"),
+                )
+            self.counters["requests"] += 1
+        return context
+
+    def invalidate(self):
+        """Drops every memoized pool, e.g. after the question bank or feedback log changes."""
+        with self.lock:
+            self.contexts.clear()
+            self.counters["invalidations"] += 1
+
+    def stats(self):
+        with self.lock:
+            return {"contexts": len(self.contexts), **self.counters}
+
+
+def measure(questions_file="questions_data.json", feedback_file="feedback.json", limit=10, feedback_limit=15):
+    """
+    Compares the old repr() context with the compact one for every (section, skill, difficulty)
+    in the local snapshots, using the same sample sizes as the prompts.
+    """
+    with open(questions_file, "r") as f:
+        questions_data = json.load(f)
+    try:
+        with open(feedback_file, "r") as f:
+            feedback_data = json.load(f)
+    except FileNotFoundError:
+        feedback_data = {}
+
+    totals = {"exemplars_repr": 0, "exemplars_compact": 0, "feedback_repr": 0, "feedback_compact": 0, "prompts": 0}
+    for section, questions in questions_data.get("SAT", {}).items():
+        groups = {}
+        for question in questions:
+            groups.setdefault((question.get("skill_category", ""), question.get("difficulty", "")), []).append(question)
+        for (skill_category, difficulty), group in sorted(groups.items()):
+            exemplars = group[:limit]
+            feedback = _filter_feedback(feedback_data, section, difficulty, feedback_limit)
+            totals["exemplars_repr"] += estimate_tokens(str(exemplars))
+            totals["exemplars_compact"] += estimate_tokens(compact_exemplars(exemplars, stage_budget("ai_feedback", "exemplars")))
+            totals["feedback_repr"] += estimate_tokens(str(feedback))
+            totals["feedback_compact"] += estimate_tokens(compact_feedback(feedback, stage_budget("ai_feedback", "feedback")))
+            totals["prompts"] += 1
+    return totals
+
+
+def _filter_questions(questions_data, section, skill_category, difficulty, limit):
+    matching = [
+        q for q in questions_data.get("SAT", {}).get(section, [])
+        if q.get("skill_category", "") == skill_category and q.get("difficulty", "") == difficulty
+    ]
+    return matching[:limit]
+
+
+def _filter_feedback(feedback_data, section, difficulty, limit):
+    matching = [
+        entry for entries in feedback_data.get(section, {}).values() for entry in entries
+        if entry.get("feedback", entry).get("original_question", {}).get("difficulty", "") == difficulty
+    ]
+    return matching[:limit]
+
+
+def _profile(run):
+    tracemalloc.start()
+    started = time.process_time()
+    run()
+    cpu = time.process_time() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu, peak
+
+
+def profile(questions_file="questions_data.json", feedback_file="feedback.json", questions_per_key=4):
+    """
+    CPU time and peak allocation of building every prompt's context for `questions_per_key`
+    questions per (section, skill, difficulty): the old eager path (section dumps and
+    json.dumps of the whole bank on every call) against one shared PromptContextCache.
+    """
+    with open(questions_file, "r") as f:
+        questions_data = json.load(f)
+    try:
+        with open(feedback_file, "r") as f:
+            feedback_data = json.load(f)
+    except FileNotFoundError:
+        feedback_data = {}
+
+    keys = sorted({
+        (section, q.get("skill_category", ""), q.get("difficulty", ""))
+        for section, questions in questions_data.get("SAT", {}).items() for q in questions
+    })
+    runs = [key for key in keys for _ in range(questions_per_key)]
+
+    def eager():
+        for section, skill_category, difficulty in runs:
+            # draft, ai_feedback, revision, human_feedback and evaluate, as they were
+            for _ in range(4):
+                str(questions_data["SAT"].get(section, []))
+                str(_filter_questions(questions_data, section, skill_category, difficulty, 10))
+            str(_filter_feedback(feedback_data, section, difficulty, 15))
+            json.dumps(questions_data)
+            str(_filter_questions(questions_data, section, skill_category, difficulty, 25))
+
+    def lazy():
+        cache = PromptContextCache(
+            lambda section, skill, difficulty: _filter_questions(questions_data, section, skill, difficulty, None),
+            lambda section, difficulty: _filter_feedback(feedback_data, section, difficulty, None),
+        )
+        for section, skill_category, difficulty in runs:
+            context = cache.get(section, skill_category, difficulty)
+            context.exemplars("ai_feedback")
+            context.feedback("ai_feedback")
+            context.exemplars("revision")
+            context.exemplars("evaluate", 25)
+
+    results = {"questions": len(runs)}
+    results["eager_cpu"], results["eager_peak"] = _profile(eager)
+    results["lazy_cpu"], results["lazy_peak"] = _profile(lazy)
+    return results
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "measure"
+    if command == "profile":
+        results = profile(*sys.argv[2:4])
+        questions = max(results["questions"], 1)
+        print(f"{results['questions']} questions")
+        print(f"eager: {1000 * results['eager_cpu'] / questions:.1f} ms CPU per question, peak {results['eager_peak'] / 1e6:.1f} MB")
+        print(f"lazy:  {1000 * results['lazy_cpu'] / questions:.1f} ms CPU per question, peak {results['lazy_peak'] / 1e6:.1f} MB")
+    else:
+        totals = measure(*sys.argv[2:4])
+        prompts = max(totals["prompts"], 1)
+        for part in ("exemplars", "feedback"):
+            before = totals[f"{part}_repr"] / prompts
+            after = totals[f"{part}_compact"] / prompts
+            saved = 100 * (1 - after / before) if before else 0
+            print(f"{part}: ~{before:.0f} -> ~{after:.0f} tokens per prompt ({saved:.0f}% smaller)")
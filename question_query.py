@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+# Equality filters GET /firebase-questions accepts; every combination of two or more has a composite
+# index per section collection in firestore.indexes.json (deploy with `firebase deploy --only firestore:indexes`)
+FILTER_FIELDS = ("domain", "skill_category", "difficulty")
+DEFAULT_PAGE_SIZE = 100  # callers that really want the whole result ask for all pages explicitly
+MAX_PAGE_SIZE = 500
+
+# Always returned with a projection, so questions can still be edited and deleted
+PROJECTION_KEYS = ("id", "section")
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(section, question_id):
+    return f"{section}/{question_id}"
+
+
+def decode_cursor(cursor):
+    section, _, question_id = (cursor or "").partition("/")
+    if not section or not question_id:
+        raise InvalidQuery(f"Invalid cursor: {cursor!r}")
+    return section, question_id
+
+
+@dataclass(frozen=True)
+class QuestionQuery:
+    """
+    A filtered page of questions, ordered by section and then document id (the order Firestore
+    streams them in). The cursor is the "section/id" of the last question of the previous page.
+    The same query runs against Firestore with the filters, cursor, limit and projection pushed down,
+    or against the in-memory replica with identical results.
+    """
+
+    section: Optional[str] = None
+    filters: Tuple[Tuple[str, str], ...] = ()
+    limit: Optional[int] = DEFAULT_PAGE_SIZE
+    cursor: Optional[Tuple[str, str]] = None
+    fields: Optional[Tuple[str, ...]] = None
+
+    @classmethod
+    def from_params(cls, section=None, domain=None, skill_category=None, difficulty=None, limit=None, start_after=None, fields=None, all_pages=False):
+        """Pages hold `limit` questions, DEFAULT_PAGE_SIZE by default; `all_pages` returns the whole result at once."""
+        if all_pages and limit is not None:
+            raise InvalidQuery("limit and all can't be combined")
+        if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+            raise InvalidQuery(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        values = {"domain": domain, "skill_category": skill_category, "difficulty": difficulty}
+        projection = None
+        if fields:
+            projection = tuple(dict.fromkeys([*PROJECTION_KEYS, *(field.strip() for field in fields.split(",") if field.strip())]))
+        return cls(
+            section=section or None,
+            filters=tuple((field, values[field]) for field in FILTER_FIELDS if values[field]),
+            limit=None if all_pages else limit or DEFAULT_PAGE_SIZE,
+            cursor=decode_cursor(start_after) if start_after else None,
+            fields=projection,
+        )
+
+    def sections(self, available):
+        """The sections to read, in order, starting from the cursor's."""
+        sections = sorted(available)
+        if self.section is not None:
+            sections = [self.section] if self.section in sections else []
+        if self.cursor is not None:
+            sections = [section for section in sections if section >= self.cursor[0]]
+        return sections
+
+    def _page(self, rows):
+        """(questions, next cursor) from an ordered iterable of (section, question) capped at the limit."""
+        questions = []
+        last = None
+        for section, question in rows:
+            if self.limit is not None and len(questions) == self.limit:
+                return questions, encode_cursor(*last)
+            questions.append(question)
+            last = (section, question.get("id"))
+        return questions, None
+
+    def _project(self, question):
+        if self.fields is None:
+            return question
+        return {field: question[field] for field in self.fields if field in question}
+
+    def run_local(self, bank, test="SAT"):
+        sections = bank.get(test, {})
+
+        def rows():
+            for section in self.sections(sections):
+                questions = sorted(sections[section], key=lambda question: question.get("id") or "")
+                for question in questions:
+                    if self.cursor is not None and (section, question.get("id") or "") <= self.cursor:
+                        continue
+                    if all(question.get(field) == value for field, value in self.filters):
+                        yield section, self._project(question)
+
+        return self._page(rows())
+
+    async def run_firestore(self, db, test="SAT"):
+        """Runs against a Firestore AsyncClient (see FirestoreStore)."""
+        test_ref = db.collection("questions").document(test)
+        available = [collection.id async for collection in test_ref.collections()] if self.section is None else [self.section]
+
+        rows = []
+        for section in self.sections(available):
+            query = test_ref.collection(section)
+            for field, value in self.filters:
+                query = query.where(filter=FieldFilter(field, "==", value))
+            query = query.order_by("__name__")
+            if self.cursor is not None and self.cursor[0] == section:
+                query = query.start_after({"__name__": test_ref.collection(section).document(self.cursor[1])})
+            if self.limit is not None:
+                # One extra tells whether there is another page without a second round trip
+                query = query.limit(self.limit + 1 - len(rows))
+            if self.fields is not None:
+                query = query.select(list(self.fields))
+            async for doc in query.stream():
+                rows.append((section, {"id": doc.id, **doc.to_dict()} if self.fields is not None else doc.to_dict()))
+            if self.limit is not None and len(rows) > self.limit:
+                break
+
+        return self._page(rows)
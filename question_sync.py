@@ -0,0 +1,387 @@
+import asyncio
+import collections
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from firestore_store import collection_ids, delete_documents, firestore_write, stream_documents
+
+SNAPSHOT_FILE = "questions_data.json"
+SYNC_STATE_FILE = "questions_sync.json"
+SYNC_STATE_VERSION = 2  # marks are server timestamps; older state (client-clock marks) forces a full read
+TOMBSTONES_COLLECTION = "question_tombstones"
+
+# How far before its mark each sync and listener query starts, for commits that land out of order
+LOOKBACK = timedelta(seconds=float(os.environ.get("QUESTION_SYNC_LOOKBACK", "300")))
+# Tombstones older than this are swept, at most once per SWEEP_INTERVAL; a replica last synced
+# before then may have missed a delete, so it does a full read instead
+TOMBSTONE_RETENTION = timedelta(days=float(os.environ.get("QUESTION_TOMBSTONE_RETENTION_DAYS", "30")))
+SWEEP_INTERVAL = timedelta(hours=1)
+
+# Seconds a writer waits for its own writes to come back through the listeners before falling back to a sync
+LISTENER_WAIT = float(os.environ.get("QUESTION_LISTENER_WAIT", "5"))
+# Seconds between checks for dead listeners and for sections created by other processes
+LISTENER_CHECK_INTERVAL = float(os.environ.get("QUESTION_LISTENER_CHECK_INTERVAL", "30"))
+
+
+def utc_now():
+    return datetime.utcnow().isoformat()
+
+
+def as_datetime(value):
+    """A timezone-aware datetime from a Firestore timestamp or an ISO string (naive ones are UTC), or None."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def plain_document(data):
+    """`data` with top-level timestamps as ISO strings, so the replica stays JSON-serializable."""
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in data.items()}
+
+
+def question_version(question):
+    """When a question last changed: updated_at, or the creation timestamp for older questions."""
+    return as_datetime(question.get("updated_at") or question.get("timestamp"))
+
+
+def latest(mark, versions):
+    """The newest of an ISO `mark` and some datetimes, as an ISO string (None when there are none)."""
+    versions = [version for version in (as_datetime(mark), *versions) if version is not None]
+    return max(versions).isoformat() if versions else None
+
+
+def merge_section(questions, changed, removed):
+    """
+    (new list, number of changes) for `questions` with `changed` upserted by id and `removed` ids
+    dropped, or None when nothing actually differs. The input list is left untouched.
+    """
+    existing = {question.get("id"): question for question in questions}
+    changed = [question for question in changed if existing.get(question.get("id")) != question]
+    removed = set(removed) & existing.keys()
+    if not changed and not removed:
+        return None
+    by_id = {question.get("id"): question for question in changed}
+    merged = [by_id.pop(question_id, question) for question_id, question in existing.items() if question_id not in removed]
+    merged += [question for question_id, question in by_id.items() if question_id not in removed]
+    return merged, len(changed) + len(removed)
+
+
+class QuestionSync:
+    """
+    Keeps an in-memory replica of questions/{test}/{section} and the questions_data.json snapshot up
+    to date by reading only what changed.
+
+    Every write has Firestore stamp the question's `updated_at` with the commit time, so a write
+    committed late (an outbox replay, say) still sorts after everything committed before it. Each
+    section keeps a high-water mark (the newest updated_at seen) and a sync only queries documents
+    from LOOKBACK before it. Deletes leave a tombstone in question_tombstones/{test}/{section}/{id},
+    read the same way and swept after TOMBSTONE_RETENTION. The snapshot and marks are saved locally,
+    so a restart also only reads the changes since the last sync. Syncs read every section
+    concurrently through the FirestoreStore.
+
+    After `listen()`, on_snapshot listeners on those same "changed since the mark" queries apply adds,
+    modifies and removes as Firestore pushes them, so nothing needs reloading (listeners need the
+    synchronous client: AsyncClient has no on_snapshot). A listener that dies has no error callback,
+    so a monitor thread checks them every LISTENER_CHECK_INTERVAL, along with the section list, and
+    syncs to catch up and re-attach when one died or a new section appeared. `listening` is only
+    true while every section has a live listener. Sections and the bank are replaced
+    copy-on-write and published with a single assignment, so readers take `bank` without locking
+    and always see a whole, consistent bank.
+    """
+
+    def __init__(self, store, listener_client, test="SAT", snapshot_file=SNAPSHOT_FILE, state_file=SYNC_STATE_FILE, on_change=None):
+        self.store = store  # FirestoreStore that syncs read through
+        self.listener_client = listener_client  # callable returning a synchronous client; only it has on_snapshot
+        self.test = test
+        self.snapshot_file = snapshot_file
+        self.state_file = state_file
+        self.on_change = on_change
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.bank = {}
+        self.watermarks = {}
+        self.tombstone_watermarks = {}
+        self.synced_at = None
+        self.swept_at = None
+        self.watches = {}
+        self.listen_requested = False
+        self.stopped = threading.Event()
+        self.monitor = None
+        self.counters = collections.Counter()
+        self._load_local()
+
+    def _load_local(self):
+        if not (os.path.exists(self.snapshot_file) and os.path.exists(self.state_file)):
+            return
+        try:
+            with open(self.snapshot_file, "r") as f:
+                bank = json.load(f)
+            with open(self.state_file, "r") as f:
+                state = json.load(f)
+        except json.JSONDecodeError as e:
+            print(f"Error decoding the question snapshot: {e}. Doing a full sync.")
+            return
+        if state.get("version") != SYNC_STATE_VERSION:
+            return
+        self.bank = bank
+        self.watermarks = state.get("watermarks", {})
+        self.tombstone_watermarks = state.get("tombstone_watermarks", {})
+        self.synced_at = state.get("synced_at")
+
+    def _save_local(self, snapshot=True):
+        # Temp file first so a crash mid-write never leaves a truncated snapshot
+        files = [(self.snapshot_file, self.bank)] if snapshot else []
+        for path, data in files + [
+            (self.state_file, {
+                "version": SYNC_STATE_VERSION,
+                "watermarks": self.watermarks,
+                "tombstone_watermarks": self.tombstone_watermarks,
+                "synced_at": self.synced_at,
+            }),
+        ]:
+            tmp_file = f"{path}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(data, f, indent=4)
+            os.replace(tmp_file, path)
+
+    def _section_ref(self, db, root, section):
+        return db.collection(root).document(self.test).collection(section)
+
+    def _cutoff(self, mark):
+        # >= a point before the mark rather than > it: re-applying a change is harmless, missing one is not
+        mark = as_datetime(mark)
+        return mark - LOOKBACK if mark is not None else None
+
+    def _since(self, collection, field, mark):
+        cutoff = self._cutoff(mark)
+        if cutoff is None:
+            return collection
+        return collection.where(filter=FieldFilter(field, ">=", cutoff))
+
+    def _expired(self):
+        # Tombstones this replica has not seen may already have been swept
+        synced_at = as_datetime(self.synced_at)
+        return synced_at is None or synced_at < datetime.now(timezone.utc) - TOMBSTONE_RETENTION
+
+    async def _fetch(self, db, full):
+        """{section: (changed questions, tombstones or None after a full read)}, reading every section concurrently."""
+        sections = set(await collection_ids(db, ("questions", self.test))) | set(self.bank.get(self.test, {}))
+
+        async def fetch_section(section):
+            mark = None if full else self.watermarks.get(section)
+            changed = await stream_documents(db, ("questions", self.test, section), "updated_at", self._cutoff(mark))
+            changed = [plain_document(data) for _, data in changed]
+            if mark is None:
+                return section, (changed, None)
+            tombstones = await stream_documents(db, (TOMBSTONES_COLLECTION, self.test, section), "deleted_at", self._cutoff(self.tombstone_watermarks.get(section)))
+            return section, (changed, [plain_document({"id": doc_id, **data}) for doc_id, data in tombstones])
+
+        return dict(await asyncio.gather(*(fetch_section(section) for section in sorted(sections))))
+
+    def _advance(self, section, changed, tombstones=()):
+        self.watermarks[section] = latest(self.watermarks.get(section), [question_version(question) for question in changed])
+        deleted = [as_datetime(tombstone.get("deleted_at")) for tombstone in tombstones]
+        self.tombstone_watermarks[section] = latest(self.tombstone_watermarks.get(section), deleted)
+
+    def _publish(self, sections, changes):
+        """Swaps in a new bank with `sections` replaced (an empty list drops a section). Call with the lock held."""
+        updated = dict(self.bank.get(self.test, {}))
+        for section, questions in sections.items():
+            if questions:
+                updated[section] = questions
+            else:
+                updated.pop(section, None)
+        self.bank = {**self.bank, self.test: updated}
+        self._save_local()
+        print(f"Question sync applied {changes} change(s) across {len(updated)} section(s)")
+        self.changed.notify_all()
+        if self.on_change:
+            self.on_change(self.bank)
+
+    def sync(self):
+        """Applies every change since the last sync and returns the bank ({test: {section: [question]}})."""
+        with self.lock:
+            self.counters["syncs"] += 1
+            started = utc_now()
+            fetched = self.store.call(self._fetch, self._expired())
+            current = self.bank.get(self.test, {})
+            replaced = {}
+            changes = 0
+
+            for section, (changed, tombstones) in sorted(fetched.items()):
+                self.counters["documents_read"] += len(changed) + len(tombstones or ())
+                if tombstones is None:
+                    # A full read has no deleted documents in it; only deletes from now on matter
+                    self.counters["full_reads"] += 1
+                    self.watermarks[section] = latest(None, [question_version(question) for question in changed]) or started
+                    self.tombstone_watermarks[section] = started
+                    replaced[section] = changed
+                    changes += len(changed)
+                    continue
+
+                self._advance(section, changed, tombstones)
+                merged = merge_section(current.get(section, []), changed, {tombstone["id"] for tombstone in tombstones})
+                if merged is not None:
+                    replaced[section], count = merged
+                    changes += count
+
+            self.synced_at = started
+            if replaced or self.test not in self.bank:
+                self._publish(replaced, changes)
+            else:
+                self._save_local(snapshot=False)
+            if self.listen_requested:
+                for section in self.bank.get(self.test, {}):
+                    self._watch(section)
+            bank = self.bank
+        self.sweep_tombstones()
+        return bank
+
+    async def _sweep(self, db, before):
+        sections = await collection_ids(db, (TOMBSTONES_COLLECTION, self.test))
+        return sum(await asyncio.gather(*(
+            delete_documents(db, (TOMBSTONES_COLLECTION, self.test, section), "deleted_at", before) for section in sections
+        )))
+
+    def sweep_tombstones(self):
+        """Deletes tombstones older than TOMBSTONE_RETENTION, at most once per SWEEP_INTERVAL."""
+        now = datetime.now(timezone.utc)
+        with self.lock:
+            if self.swept_at is not None and now - self.swept_at < SWEEP_INTERVAL:
+                return
+            self.swept_at = now
+        try:
+            self.counters["tombstones_swept"] += self.store.call(self._sweep, now - TOMBSTONE_RETENTION)
+        except Exception as e:
+            self.counters["sweep_errors"] += 1
+            print(f"Error sweeping question tombstones: {e}")
+
+    def listen(self):
+        """Brings the bank up to date, then keeps it current from on_snapshot listeners on every section."""
+        with self.lock:
+            self.listen_requested = True
+            self.stopped.clear()
+            bank = self.sync()
+            if self.monitor is None or not self.monitor.is_alive():
+                self.monitor = threading.Thread(target=self._monitor, name="question-listeners", daemon=True)
+                self.monitor.start()
+            return bank
+
+    @property
+    def listening(self):
+        """True while every section has a live listener, so the bank can be read as current."""
+        # Lock-free like reads of `bank`, since request handlers check it on the event loop; dict() copies atomically
+        watches = dict(self.watches)
+        return self.listen_requested and all(
+            section in watches and all(watch.is_active for watch in watches[section])
+            for section in self.bank.get(self.test, {})
+        )
+
+    def _monitor(self):
+        while not self.stopped.wait(LISTENER_CHECK_INTERVAL):
+            try:
+                self.check_listeners()
+            except Exception as e:
+                self.counters["listener_check_errors"] += 1
+                print(f"Error checking question listeners: {e}")
+
+    def check_listeners(self):
+        """Drops dead listeners, then syncs (re-attaching them) if any died or another process added a section."""
+        with self.lock:
+            dead = [section for section, watches in self.watches.items() if not all(watch.is_active for watch in watches)]
+            for section in dead:
+                for watch in self.watches.pop(section):
+                    watch.unsubscribe()
+            self.counters["listener_restarts"] += len(dead)
+            known = set(self.bank.get(self.test, {}))
+        added = set(self.store.call(collection_ids, ("questions", self.test))) - known
+        if dead or added:
+            self.sync()
+
+    def _watch(self, section):
+        if section in self.watches:
+            return
+        db = self.listener_client()
+        questions = self._since(self._section_ref(db, "questions", section), "updated_at", self.watermarks.get(section))
+        tombstones = self._since(self._section_ref(db, TOMBSTONES_COLLECTION, section), "deleted_at", self.tombstone_watermarks.get(section))
+        self.watches[section] = [
+            questions.on_snapshot(lambda docs, changes, read_time: self._on_questions(section, changes)),
+            tombstones.on_snapshot(lambda docs, changes, read_time: self._on_tombstones(section, changes)),
+        ]
+
+    def _on_questions(self, section, changes):
+        changed = [plain_document(change.document.to_dict()) for change in changes if change.type.name != "REMOVED"]
+        # Documents only leave a "changed since" query by being deleted
+        removed = {change.document.id for change in changes if change.type.name == "REMOVED"}
+        self._apply(section, changed, removed)
+
+    def _on_tombstones(self, section, changes):
+        tombstones = [plain_document({"id": change.document.id, **change.document.to_dict()}) for change in changes if change.type.name == "ADDED"]
+        self._apply(section, [], {tombstone["id"] for tombstone in tombstones}, tombstones)
+
+    def _apply(self, section, changed, removed, tombstones=()):
+        with self.lock:
+            self.counters["listener_events"] += 1
+            self.counters["documents_read"] += len(changed) + len(tombstones)
+            self._advance(section, changed, tombstones)
+            merged = merge_section(self.bank.get(self.test, {}).get(section, []), changed, removed)
+            if merged is not None:
+                questions, count = merged
+                self._publish({section: questions}, count)
+
+    def _reflects(self, section, question_id, version, deleted):
+        questions = self.bank.get(self.test, {}).get(section, [])
+        question = next((question for question in questions if question.get("id") == question_id), None)
+        if deleted:
+            return question is None
+        if question is None:
+            return False
+        return version is None or (question_version(question) or datetime.min.replace(tzinfo=timezone.utc)) >= as_datetime(version)
+
+    def await_writes(self, writes, timeout=LISTENER_WAIT):
+        """
+        Returns the bank once it reflects writes this process just made, given as
+        (section, question_id, version, deleted): the question gone when `deleted`, else present and,
+        given the write's commit time as `version`, at least that new. Listeners normally deliver
+        them within moments; if a section has no live listener (e.g. a new one) or they lag past
+        `timeout`, this falls back to one sync for the lot.
+        """
+        writes = list(writes)
+        with self.changed:
+            if self.listening and all(section in self.watches for section, *_ in writes):
+                if self.changed.wait_for(lambda: all(self._reflects(*write) for write in writes), timeout):
+                    return self.bank
+                self.counters["listener_timeouts"] += 1
+        return self.sync()
+
+    def await_write(self, section, question_id, version=None, deleted=False, timeout=LISTENER_WAIT):
+        return self.await_writes([(section, question_id, version, deleted)], timeout)
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            for watches in self.watches.values():
+                for watch in watches:
+                    watch.unsubscribe()
+            self.watches = {}
+            self.listen_requested = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sections": len(self.watermarks),
+                "listening": self.listening,
+                "listeners": sum(len(watches) for watches in self.watches.values()),
+                "last_sweep": self.swept_at.isoformat() if self.swept_at else None,
+                **self.counters,
+            }
+
+    def tombstone_write(self, section, question_id):
+        """The write that goes with deleting a question, so the next sync (here or in another process) drops it."""
+        return firestore_write((TOMBSTONES_COLLECTION, self.test, section, question_id), {"id": question_id}, server_timestamps=("deleted_at",))
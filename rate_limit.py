@@ -0,0 +1,151 @@
+import collections
+import threading
+import time
+
+
+class SlidingWindow:
+    """
+    Thread-safe rolling-window limiter: admits at most `limit` units in any `window` seconds, from a
+    ledger of what was admitted when. `acquire` blocks until the amount fits; waiters are served
+    strictly in arrival order, so a large request is never starved by a stream of small ones.
+    Both return the ledger entry, which `settle` corrects once the real amount is known.
+    """
+
+    def __init__(self, limit, window=60.0, clock=time.monotonic):
+        self.limit = float(limit)
+        self.window = float(window)
+        self.clock = clock
+        self.ledger = collections.deque()  # [admitted at, amount], oldest first
+        self.used = 0.0
+        self.condition = threading.Condition()
+        self.waiters = collections.deque()
+
+    def _expire(self, now):
+        while self.ledger and self.ledger[0][0] <= now - self.window:
+            self.used -= self.ledger.popleft()[1]
+
+    def _wait_time(self, amount, now):
+        # Until enough of the oldest entries have left the window for `amount` to fit
+        excess = self.used + amount - self.limit
+        for admitted, entry_amount in self.ledger:
+            excess -= entry_amount
+            if excess <= 0:
+                return admitted + self.window - now
+        return self.window
+
+    def _admit(self, amount, now):
+        entry = [now, amount]
+        self.ledger.append(entry)
+        self.used += amount
+        return entry
+
+    def acquire(self, amount=1):
+        # Never ask for more than the window can hold, or the caller would wait forever
+        amount = min(float(amount), self.limit)
+        ticket = object()
+        with self.condition:
+            self.waiters.append(ticket)
+            try:
+                while True:
+                    now = self.clock()
+                    self._expire(now)
+                    if self.waiters[0] is ticket and self.used + amount <= self.limit:
+                        return self._admit(amount, now)
+                    timeout = self._wait_time(amount, now) if self.waiters[0] is ticket else None
+                    self.condition.wait(timeout)
+            finally:
+                self.waiters.remove(ticket)
+                self.condition.notify_all()
+
+    def try_acquire(self, amount=1):
+        """Admits `amount` only if it fits right now and nobody is queued ahead; returns the entry or None."""
+        amount = min(float(amount), self.limit)
+        with self.condition:
+            now = self.clock()
+            self._expire(now)
+            if self.waiters or self.used + amount > self.limit:
+                return None
+            return self._admit(amount, now)
+
+    def settle(self, entry, amount):
+        """
+        Replaces an admitted entry's amount with what was actually used. Going over the limit makes
+        later callers wait until the entry has left the window; an entry that already left is ignored.
+        """
+        with self.condition:
+            now = self.clock()
+            self._expire(now)
+            if entry[0] > now - self.window:
+                self.used += amount - entry[1]
+                entry[1] = amount
+            self.condition.notify_all()
+
+
+class GeminiRateLimiter:
+    """
+    Shared requests-per-minute and tokens-per-minute limiter for Gemini calls. Both are counted over
+    a rolling minute, so no 60 seconds ever see more than `headroom` of either quota.
+
+    Token usage is only known after a response arrives, so each call reserves an estimate
+    (a running average of what the same stage used before) and `record` settles the reservation
+    against `response.usage_metadata`.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, headroom=0.9, default_estimate=20000, window=60.0, clock=time.monotonic):
+        self.requests = SlidingWindow(requests_per_minute * headroom, window, clock)
+        self.tokens = SlidingWindow(tokens_per_minute * headroom, window, clock)
+        self.default_estimate = default_estimate
+        self.estimates = {}
+        self.lock = threading.Lock()
+
+    def estimate(self, stage):
+        with self.lock:
+            return self.estimates.get(stage, self.default_estimate)
+
+    def acquire(self, stage):
+        """Blocks until the call may be sent; returns the token reservation."""
+        estimate = self.estimate(stage)
+        self.requests.acquire(1)
+        return self.tokens.acquire(estimate)
+
+    def try_acquire(self, stage):
+        """Non-blocking acquire for optional calls (e.g. hedges); returns the reservation or None."""
+        estimate = self.estimate(stage)
+        request = self.requests.try_acquire(1)
+        if request is None:
+            return None
+        reserved = self.tokens.try_acquire(estimate)
+        if reserved is None:
+            self.requests.settle(request, 0)
+        return reserved
+
+    def release(self, reserved):
+        """Returns a reservation whose call never produced a response."""
+        self.tokens.settle(reserved, 0)
+
+    def record(self, stage, usage_metadata, reserved):
+        used = usage_tokens(usage_metadata)
+        if used is None:
+            return
+        self.tokens.settle(reserved, used)
+        with self.lock:
+            previous = self.estimates.get(stage)
+            # Exponential moving average keeps the estimate close to recent prompts for this stage
+            self.estimates[stage] = used if previous is None else 0.8 * previous + 0.2 * used
+
+
+def usage_tokens(usage_metadata):
+    """Total tokens billed for a response, or None if the response carried no usage metadata."""
+    if usage_metadata is None:
+        return None
+    total = getattr(usage_metadata, "total_token_count", None)
+    if total is not None:
+        return total
+    parts = [
+        getattr(usage_metadata, "prompt_token_count", None),
+        getattr(usage_metadata, "candidates_token_count", None),
+        getattr(usage_metadata, "thoughts_token_count", None),
+    ]
+    if all(part is None for part in parts):
+        return None
+    return sum(part or 0 for part in parts)
@@ -0,0 +1,149 @@
+import collections
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+# HTTP statuses worth retrying: timeouts, rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class StagePolicy:
+    timeout: float = 180.0  # seconds allowed for one attempt
+    max_attempts: int = 4
+    base_delay: float = 2.0  # backoff before retry n is uniform(0, base_delay * 2**n)
+    max_delay: float = 60.0
+    hedge: bool = False  # fire a duplicate request once the primary is slower than the stage's p95
+
+
+def is_retryable(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code in RETRYABLE_STATUS_CODES:
+        return True
+    # httpx / httpcore transport errors, without importing them here
+    name = type(error).__name__
+    return "Timeout" in name or "Connect" in name or name in ("RemoteProtocolError", "ReadError")
+
+
+class ResilientCaller:
+    """
+    Wraps LLM calls with a per-attempt deadline, exponential backoff with jitter on retryable
+    errors, and optional hedging.
+
+    `send(timeout)` performs one request and returns the response. If a rate limiter is given,
+    each attempt (and each hedge) reserves capacity from it first and settles the reservation
+    from the response's usage_metadata once the attempt finishes. `observer(stage, event)`, if
+    given, is told about every counted event (e.g. to export metrics); it runs on the caller's thread.
+    """
+
+    def __init__(self, policies=None, default_policy=None, limiter=None, max_workers=64, hedge_min_samples=20, observer=None):
+        self.policies = policies or {}
+        self.default_policy = default_policy or StagePolicy()
+        self.limiter = limiter
+        self.observer = observer
+        self.hedge_min_samples = hedge_min_samples
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=200))
+        self.counters = collections.defaultdict(lambda: collections.Counter())
+
+    def policy(self, stage):
+        return self.policies.get(stage, self.default_policy)
+
+    def stats(self):
+        """Per-stage counts of calls, retries, rejections, hedges, hedge wins, timeouts and failures."""
+        with self.lock:
+            return {stage: dict(counter) for stage, counter in self.counters.items()}
+
+    def _count(self, stage, name):
+        with self.lock:
+            self.counters[stage][name] += 1
+        if self.observer:
+            self.observer(stage, name)
+
+    def hedge_delay(self, stage):
+        """p95 latency of recent successful attempts, or None until enough samples exist."""
+        with self.lock:
+            samples = sorted(self.latencies[stage])
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[int(0.95 * (len(samples) - 1))]
+
+    def call(self, stage, send):
+        policy = self.policy(stage)
+        self._count(stage, "calls")
+        for attempt in range(policy.max_attempts):
+            try:
+                return self._attempt(stage, send, policy)
+            except Exception as e:
+                immediate = getattr(e, "retry_immediately", False)
+                if attempt + 1 >= policy.max_attempts or not (immediate or is_retryable(e)):
+                    self._count(stage, "failures")
+                    raise
+                if immediate:
+                    # Cheap local rejection (e.g. a draft that failed a check mid-stream): no backoff needed
+                    self._count(stage, "rejections")
+                    print(f"{stage} attempt {attempt + 1} rejected ({e}), retrying now")
+                    continue
+                self._count(stage, "retries")
+                delay = random.uniform(0, min(policy.max_delay, policy.base_delay * 2 ** attempt))
+                print(f"{stage} attempt {attempt + 1} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _start(self, stage, send, policy, blocking=True):
+        reserved = None
+        if self.limiter:
+            reserved = self.limiter.acquire(stage) if blocking else self.limiter.try_acquire(stage)
+            if reserved is None:
+                return None
+        started = time.monotonic()
+        future = self.pool.submit(send, policy.timeout)
+        future.add_done_callback(lambda future: self._settle(stage, future, reserved, started))
+        return future
+
+    def _settle(self, stage, future, reserved, started):
+        error = future.exception()
+        if error is None:
+            with self.lock:
+                self.latencies[stage].append(time.monotonic() - started)
+        if self.limiter:
+            if error is None:
+                self.limiter.record(stage, getattr(future.result(), "usage_metadata", None), reserved)
+            else:
+                self.limiter.release(reserved)
+
+    def _attempt(self, stage, send, policy):
+        # The clock starts after the rate limiter admits the call, so queueing for quota
+        # never counts against the stage deadline.
+        primary = self._start(stage, send, policy)
+        deadline = time.monotonic() + policy.timeout
+        pending = {primary}
+
+        hedge_after = self.hedge_delay(stage) if policy.hedge else None
+        if hedge_after is not None and hedge_after < policy.timeout:
+            done, _ = wait(pending, timeout=hedge_after)
+            if not done:
+                # Only hedge when there is spare quota; a hedge should never push us into 429s
+                hedge = self._start(stage, send, policy, blocking=False)
+                if hedge is not None:
+                    self._count(stage, "hedges")
+                    pending.add(hedge)
+                    deadline = time.monotonic() + policy.timeout
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                self._count(stage, "timeouts")
+                raise TimeoutError(f"{stage} call exceeded its {policy.timeout:.0f}s deadline")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count(stage, "hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
@@ -0,0 +1,62 @@
+import json
+import os
+import threading
+
+REVIEW_STATS_FILE = "review_stats.json"
+
+# Generation settings recorded on each question that reviewers' decisions are grouped by
+GROUPS = ("early_exit", "pipeline_mode", "routing_profile")
+
+ACCEPTED = "accepted"
+REMOVED = "removed"
+
+
+class ReviewStats:
+    """
+    Counts how reviewers dispose of generated questions (accepted via /send-questions, removed via
+    /remove-question), grouped by the settings each question was generated with, so removal rates
+    can be compared between e.g. early-exit and fully critiqued questions. Counts are mirrored to a
+    local JSON file so they accumulate across restarts.
+    """
+
+    def __init__(self, json_file=REVIEW_STATS_FILE):
+        self.json_file = json_file
+        self.lock = threading.Lock()
+        self.counts = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.json_file):
+            return {}
+        try:
+            with open(self.json_file, "r") as f:
+                counts = json.load(f)
+                if isinstance(counts, dict):
+                    return counts
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON from {self.json_file}: {e}. Starting with empty review stats.")
+        return {}
+
+    def _save(self):
+        tmp_file = f"{self.json_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.counts, f, indent=4)
+        os.replace(tmp_file, self.json_file)
+
+    def record(self, question, outcome):
+        with self.lock:
+            for group in GROUPS:
+                value = str(question.get(group))  # "True", "False", "None", "structured" ...
+                bucket = self.counts.setdefault(group, {}).setdefault(value, {ACCEPTED: 0, REMOVED: 0})
+                bucket[outcome] += 1
+            self._save()
+
+    def report(self):
+        """{group: {value: {"accepted": n, "removed": n, "removal_rate": r}}}"""
+        with self.lock:
+            return {
+                group: {
+                    value: {**bucket, "removal_rate": round(bucket[REMOVED] / max(1, bucket[ACCEPTED] + bucket[REMOVED]), 3)}
+                    for value, bucket in values.items()
+                }
+                for group, values in self.counts.items()
+            }
@@ -0,0 +1,60 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class WorkScheduler:
+    """
+    Global admission control for generation work items.
+
+    `start_item(item, on_stage)` must start the work and return a Future. The scheduler keeps at
+    most `max_in_flight` items started at once across every request, and admits queued items in
+    arrival order, so one large request can't launch unbounded work and a request for a single
+    skill still gets the full concurrency.
+    """
+
+    def __init__(self, start_item, max_in_flight=8):
+        self.start_item = start_item
+        self.max_in_flight = max_in_flight
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.pending = queue.Queue()
+        threading.Thread(target=self._dispatch, name="scheduler", daemon=True).start()
+
+    def submit(self, item, on_stage=None):
+        """Queues an item without blocking and returns a Future for its result."""
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.pending.put((item, on_stage, future))
+        return future
+
+    def queued(self):
+        return self.pending.qsize()
+
+    def _dispatch(self):
+        while True:
+            item, on_stage, future = self.pending.get()
+            self.slots.acquire()
+            try:
+                inner = self.start_item(item, on_stage)
+            except Exception as e:
+                self.slots.release()
+                future.set_exception(e)
+                continue
+            inner.add_done_callback(lambda inner, future=future: self._finish(inner, future))
+
+    def _finish(self, inner, future):
+        self.slots.release()
+        try:
+            future.set_result(inner.result())
+        except Exception as e:
+            future.set_exception(e)
+
+
+def expand_work_items(section, skill_categories, difficulties, num_questions):
+    """Breaks a generation request into one (skill, difficulty, index) item per question."""
+    return [
+        {"section": section, "skill_category": skill_category, "difficulty": difficulty, "index": index}
+        for skill_category in skill_categories
+        for difficulty in difficulties
+        for index in range(num_questions)
+    ]
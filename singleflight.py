@@ -0,0 +1,85 @@
+import collections
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent work with the same key into one execution whose result every caller shares.
+
+    `submit(key, start)` calls `start()` (which must return a Future) only if nothing for `key` is in
+    flight, and otherwise returns the in-flight result.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.counters = collections.Counter()
+
+    def _claim(self, key):
+        """Registers a new execution for `key`. Call with the lock held."""
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.running[key] = future
+        self.counters["executions"] += 1
+        return future
+
+    def _finish(self, key, future):
+        with self.lock:
+            if self.running.get(key) is future:
+                del self.running[key]
+
+    def submit(self, key, start):
+        with self.lock:
+            running = self.running.get(key)
+            if running is not None:
+                self.counters["shared"] += 1
+                return running
+            future = self._claim(key)
+        try:
+            inner = start()
+        except Exception as e:
+            self._finish(key, future)
+            future.set_exception(e)
+            return future
+        inner.add_done_callback(lambda inner: (self._finish(key, future), _copy_result(inner, future)))
+        return future
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.running), **self.counters}
+
+
+def _copy_result(source, target):
+    error = source.exception()
+    if error is None:
+        target.set_result(source.result())
+    else:
+        target.set_exception(error)
+
+
+def all_settled(futures):
+    """A Future for the list of results of `futures`, with exceptions in place of failed results."""
+    futures = list(futures)
+    combined = Future()
+    combined.set_running_or_notify_cancel()
+    if not futures:
+        combined.set_result([])
+        return combined
+
+    results = [None] * len(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def settle(index, future):
+        error = future.exception()
+        results[index] = future.result() if error is None else error
+        with lock:
+            remaining[0] -= 1
+            done = remaining[0] == 0
+        if done:
+            combined.set_result(results)
+
+    for index, future in enumerate(futures):
+        future.add_done_callback(lambda future, index=index: settle(index, future))
+    return combined
@@ -0,0 +1,23 @@
+"""Smoke test: one small benchmark scenario end to end against the fakes (no Gemini quota, no Firebase)."""
+import json
+
+import benchmark
+
+
+def test_benchmark_smoke(tmp_path):
+    results_file = tmp_path / "benchmark.json"
+    status = benchmark.main([
+        "--shapes", "1x2x1",
+        "--concurrency", "2",
+        "--latency-scale", "0.02",
+        "--max-failure-rate", "0",
+        "--json", str(results_file),
+    ])
+
+    assert status == 0
+    [result] = json.loads(results_file.read_text())
+    assert result["questions"] == 4
+    assert result["http_errors"] == 0
+    assert result["acceptance"] == 1.0
+    assert result["cost_per_question"] > 0
+    assert {"draft", "ai_feedback", "revision", "format"} <= set(result["stages"])
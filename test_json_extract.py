@@ -0,0 +1,24 @@
+"""extract_json: valid JSON is taken as it is; LaTeX backslashes are only repaired when it doesn't parse."""
+import json
+
+from json_extract import extract_json
+
+
+def test_valid_escaped_json_comes_through_unchanged():
+    question = {
+        "question": "Column A\tColumn B\ttext\nnext line",
+        "explanations": {"A": "Use \\frac{1}{2} and \\text{cm}", "B": "quote \" and slash /"},
+        "generation_latex": "\\begin{tikzpicture}\\node at (0,0) {x};\\end{tikzpicture}",
+    }
+    text = json.dumps(question)
+
+    assert extract_json(f"Here is the question:\n{text}\nDone.") == question
+
+
+def test_latex_backslashes_are_repaired_when_the_json_does_not_parse():
+    text = r'{"question": "What is \sqrt{x} when x = 4?", "generation_latex": "\begin{tikzpicture}\node {$\frac{1}{2}$};\end{tikzpicture}"}'
+
+    question = extract_json(text)
+
+    assert question["question"] == r"What is \sqrt{x} when x = 4?"
+    assert question["generation_latex"] == r"\begin{tikzpicture}\node {$\frac{1}{2}$};\end{tikzpicture}"
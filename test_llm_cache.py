@@ -0,0 +1,49 @@
+"""Record -> replay through the LLM cache, end to end against the fakes (no Gemini quota, no Firebase)."""
+import io
+import shutil
+
+import benchmark
+from llm_cache import LLMCache
+
+# With this seed, questions 0-2 of the request below all draw the same answer letter, so their draft
+# prompts are identical and only the work item index tells their cache entries apart
+SEED = "40"
+
+REQUEST = {
+    "section": "math",
+    "domains": [],
+    "skill_categories": ["linear_equations_in_one_variable"],
+    "difficulties": ["medium"],
+    "num_questions": 3,
+}
+
+
+def generate(client, app):
+    app.generated_questions.clear()
+    response = client.post("/generate-questions", json=REQUEST)
+    assert response.status_code == 200
+    return [question["question"] for question in app.generated_questions]
+
+
+def test_replay_keeps_questions_of_one_batch_distinct(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    workspace = benchmark.prepare_workspace()
+    monkeypatch.chdir(workspace)
+    try:
+        args = benchmark.parse_args(["--latency-scale", "0.02"])
+        app, gen, _ = benchmark.load_app(args, io.StringIO())
+        monkeypatch.setattr(gen, "LLM_CACHE_SEED", SEED)
+        monkeypatch.setattr(gen.gemini_client, "unique", True)
+        client = TestClient(app.app)
+
+        monkeypatch.setattr(gen, "llm_cache", LLMCache(str(tmp_path / "cache"), mode="record"))
+        recorded = generate(client, app)
+        # Replay raises on any miss, so every call has to be served from what was recorded
+        monkeypatch.setattr(gen, "llm_cache", LLMCache(str(tmp_path / "cache"), mode="replay"))
+        replayed = generate(client, app)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    assert len(set(recorded)) == 3
+    assert sorted(replayed) == sorted(recorded)
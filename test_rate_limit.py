@@ -0,0 +1,63 @@
+"""GeminiRateLimiter against a fake clock: what it admits in any rolling minute."""
+import threading
+import time
+
+from rate_limit import GeminiRateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def rolling_maximum(times, window=60.0):
+    return max(sum(1 for other in times if start <= other < start + window) for start in times)
+
+
+def test_requests_per_rolling_minute_stay_under_the_limit():
+    clock = FakeClock()
+    limiter = GeminiRateLimiter(requests_per_minute=100, tokens_per_minute=10 ** 9, headroom=0.9, clock=clock)
+    admitted = []
+    # A caller that sends whenever it is allowed to, for five minutes
+    while clock.now < 300:
+        while limiter.try_acquire("draft") is not None:
+            admitted.append(clock.now)
+        clock.now += 0.5
+
+    assert rolling_maximum(admitted) <= 90
+    # ...and the quota is still used: 90 per minute for five minutes
+    assert len(admitted) >= 5 * 90
+
+
+def test_tokens_used_beyond_the_reservation_hold_back_later_calls():
+    clock = FakeClock()
+    limiter = GeminiRateLimiter(requests_per_minute=10 ** 6, tokens_per_minute=100000, headroom=1.0, default_estimate=10000, clock=clock)
+    admitted = []
+    while clock.now < 300:
+        reserved = limiter.try_acquire("draft")
+        if reserved is not None:
+            admitted.append((clock.now, reserved))
+            # The response used more than was reserved
+            limiter.record("draft", type("Usage", (), {"total_token_count": 12500})(), reserved)
+        else:
+            clock.now += 0.5
+
+    for start, _ in admitted:
+        assert sum(reserved[1] for at, reserved in admitted if start <= at < start + 60) <= 100000
+
+
+def test_blocked_callers_are_admitted_once_the_window_moves_on():
+    limiter = GeminiRateLimiter(requests_per_minute=4, tokens_per_minute=10 ** 9, headroom=1.0, window=0.2)
+    admitted = []
+    threads = [threading.Thread(target=lambda: admitted.append(limiter.acquire("draft"))) for _ in range(8)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(admitted) == 8
+    assert time.monotonic() - started >= 0.2
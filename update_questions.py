@@ -3,9 +3,9 @@ from firebase_admin import credentials, firestore
 from google import genai
 from google.genai.types import GenerateContentConfig
 import os
-import json
-import re
 from google.api_core.retry import Retry
+from json_extract import extract_json
+from model_routing import ModelRouter
 # Initialize Firebase Admin SDK
 cred = credentials.Certificate("serviceAccountKey.json")
 firebase_admin.initialize_app(cred)
@@ -14,6 +14,7 @@ db = firestore.client()
 
 gemini_api_key = os.environ["GEMINI_API_KEY"]
 gemini_client = genai.Client(api_key=gemini_api_key)
+explanations_route = ModelRouter.from_env().route("explanations")
 
 with open ("prompts/explanationprompt.txt") as f:
     explanation_system_prompt = f.read()
@@ -41,21 +42,17 @@ def add_section_field():
                 explanation_prompt = f"Please generate the answer explanations for the following question: {question_data}. "
 
                 explanations_response = gemini_client.models.generate_content(
-                model="gemini-2.5-pro-preview-06-05",
+                model=explanations_route.model,
                 contents=[explanation_prompt],
-                    config=GenerateContentConfig(
+                    config=explanations_route.apply(GenerateContentConfig(
                         system_instruction=[explanation_system_prompt]
-                    )
+                    ))
                 )
-                explanations = re.search(r'\{.*\}', explanations_response.text, re.DOTALL)
-                if explanations:
-                    explanations = explanations.group(0)
-                    explanations = json.loads(explanations)
-                else:
-                    raise ValueError("No valid JSON found in response")
+                explanations = extract_json(explanations_response.text)
                 
 
                 question_data["explanations"] = explanations
+                question_data["updated_at"] = firestore.SERVER_TIMESTAMP  # the commit time, as the question sync expects
                 doc_ref = questions_ref.document(doc.id)
                 doc_ref.set(question_data)
 
@@ -0,0 +1,122 @@
+import collections
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from firestore_store import MAX_BATCH_WRITES, commit_writes
+from resilience import is_retryable
+
+OUTBOX_FILE = "write_outbox.json"
+DEAD_LETTER_FILE = "write_outbox_dead.json"
+
+
+class WriteOutbox:
+    """
+    Durable queue of Firestore write groups. `enqueue` saves a group to a local JSON file before
+    anything is sent, and `flush` commits the queued groups as WriteBatches of up to 500 writes,
+    recording progress after each batch. A crash or a retryable failure (resilience.is_retryable)
+    leaves the remainder queued for the next flush. A group that fails for any other reason would
+    fail forever and hold up everything queued behind it, so it moves to a dead-letter file instead.
+    Writes are set()s and deletes of fixed document ids, so committing one twice is harmless.
+    """
+
+    def __init__(self, store, json_file=OUTBOX_FILE, dead_letter_file=DEAD_LETTER_FILE):
+        self.store = store
+        self.json_file = json_file
+        self.dead_letter_file = dead_letter_file
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.groups = self._load(json_file)
+        self.dead = self._load(dead_letter_file)
+        self.counters = collections.Counter()
+
+    def _load(self, json_file):
+        if not os.path.exists(json_file):
+            return []
+        try:
+            with open(json_file, "r") as f:
+                groups = json.load(f)
+                if isinstance(groups, list):
+                    return groups
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON from {json_file}: {e}. Starting with an empty list.")
+        return []
+
+    def _save(self, json_file=None, groups=None):
+        json_file = json_file or self.json_file
+        tmp_file = f"{json_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.groups if groups is None else groups, f, indent=4, default=str)
+        os.replace(tmp_file, json_file)
+
+    def enqueue(self, writes):
+        group = {
+            "id": uuid.uuid4().hex,
+            "created": datetime.utcnow().isoformat(),
+            "writes": json.loads(json.dumps(writes, default=str)),
+            "committed": 0,
+        }
+        with self.lock:
+            self.groups.append(group)
+            self._save()
+        return group["id"]
+
+    def flush(self):
+        """
+        Commits every queued write; returns how many were committed. Raises on the first batch that
+        fails with a retryable error; groups that fail otherwise are dead-lettered and skipped.
+        """
+        committed = 0
+        with self.flush_lock:
+            while True:
+                with self.lock:
+                    if not self.groups:
+                        return committed
+                    group = self.groups[0]
+                writes = group["writes"][group["committed"]:group["committed"] + MAX_BATCH_WRITES]
+                try:
+                    self.store.call(commit_writes, writes)
+                except Exception as e:
+                    self.counters["failed_batches"] += 1
+                    if is_retryable(e):
+                        raise
+                    self._dead_letter(group, e)
+                    continue
+                self.counters["batches"] += 1
+                committed += len(writes)
+                with self.lock:
+                    group["committed"] += len(writes)
+                    if group["committed"] >= len(group["writes"]):
+                        self.groups.pop(0)
+                    self._save()
+
+    def _dead_letter(self, group, error):
+        print(f"Outbox group {group['id']} failed permanently, moving it to {self.dead_letter_file}: {error}")
+        with self.lock:
+            self.dead.append({**group, "error": str(error), "failed": datetime.utcnow().isoformat()})
+            self._save(self.dead_letter_file, self.dead)
+            self.groups.remove(group)
+            self._save()
+        self.counters["dead_lettered_groups"] += 1
+
+    def dead_letter_error(self, group_id):
+        """Why the group was dead-lettered, or None if it wasn't."""
+        with self.lock:
+            return next((group["error"] for group in self.dead if group["id"] == group_id), None)
+
+    def pending(self):
+        with self.lock:
+            return sum(len(group["writes"]) - group["committed"] for group in self.groups)
+
+    def stats(self):
+        with self.lock:
+            dead_writes = sum(len(group["writes"]) - group["committed"] for group in self.dead)
+        return {
+            "pending_writes": self.pending(),
+            "pending_groups": len(self.groups),
+            "dead_letter_groups": len(self.dead),
+            "dead_letter_writes": dead_writes,
+            **self.counters,
+        }